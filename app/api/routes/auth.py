@@ -1,32 +1,44 @@
 # app/api/routes/auth.py
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 from sqlalchemy.util import deprecated
 
-from app.db import get_db
-from app.core.users import authenticate_user, create_access_token, create_refresh_token, \
+from app.db import DbRunner, get_db_runner
+from app.core.users import authenticate_user_async, create_access_token, create_refresh_token, \
     rotate_refresh_token  # usa la versione DB
+from app.core.password_pool import PasswordPoolSaturated
 from app.schemas import TokenResponse
 from app.schemas.auth import TokenPair, LoginIn, RefreshIn
 
 router = APIRouter(tags=["auth"], prefix="/auth")
 
 
+async def _authenticate(db: DbRunner, username: str, password: str):
+    try:
+        return await authenticate_user_async(db, username, password)
+    except PasswordPoolSaturated as e:
+        # pool bcrypt saturo: meglio un 503 immediato che una coda infinita
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Troppe richieste di login, riprova tra poco",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
 @router.post("/login", response_model=TokenPair)
-def login(body: LoginIn, db: Session = Depends(get_db)):
-    user = authenticate_user(db, body.username, body.password)
+async def login(body: LoginIn, db: DbRunner = Depends(get_db_runner)):
+    user = await _authenticate(db, body.username, body.password)
     if not user:
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
     access = create_access_token({"sub": user["username"], "scopes": user["scopes"]})
-    refresh = create_refresh_token(db, user_id=user["username"], device=body.device)
+    refresh = await db.run(create_refresh_token, user_id=user["username"], device=body.device)
     return TokenPair(access_token=access, refresh_token=refresh)
 
 @router.post("/refresh", response_model=TokenPair)
-def refresh(body: RefreshIn, db: Session = Depends(get_db)):
+async def refresh(body: RefreshIn, db: DbRunner = Depends(get_db_runner)):
     try:
-        new_refresh_raw, token_row = rotate_refresh_token(db, body.refresh_token, device=body.device)
+        new_refresh_raw, token_row = await db.run(rotate_refresh_token, body.refresh_token, device=body.device)
     except ValueError:
         raise HTTPException(status_code=401, detail="Refresh token non valido")
 
@@ -48,9 +60,9 @@ def logout_all_devices(user=Depends(...)):  # opzionale: usa il tuo get_current_
 
 @deprecated
 @router.post("/token", response_model=TokenResponse, status_code=status.HTTP_200_OK)
-def login(form_data: OAuth2PasswordRequestForm = Depends(),
-         db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(),
+         db: DbRunner = Depends(get_db_runner)):
+    user = await _authenticate(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,37 +1,36 @@
 # app/api/routes/chatbot.py
-import asyncio
-import json
-import threading
-
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security
 from fastapi.responses import StreamingResponse
-
-from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 
 from app.schemas.chatbot import ChatbotMessageIn, ChatbotResponse
 from app.core.deps import get_current_user
-from app.db import get_db
-from app.db.models import User
+from app.db import DbRunner, get_db_runner
 from app.api.services.assistant import (
+    RUN_TIMEOUT_S,
     assistant_id,
-    create_thread,
-    add_user_message,
-    get_last_assistant_message,
-    run,
+    aadd_user_message,
+    aget_last_assistant_message,
+    arun,
+    astream_text,
 )
+from app.api.services.llm_governor import GovernorRejected, governor
+from app.api.services.sse import relay, sse_event
+from app.api.services.user_cache import get_or_create_thread_id, get_thread_id as cached_thread_id
 from app.core.feature_flags import get_bool, get_value
 
 router = APIRouter(tags=["chatbot"], prefix="/chatbot")
 
+
 @router.post(
     "/send_message",
     response_model=ChatbotResponse,
     status_code=status.HTTP_200_OK,
 )
-def send_message(
+async def send_message(
     body: ChatbotMessageIn,
     user = Security(get_current_user, scopes=["chatbot:write"]),
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
     streaming: bool = Query(False, description="Se true, risposta in streaming via SSE"),
     debug: bool = Query(True, description="Se true, risposta in debug via SSE"),
 ):
@@ -42,74 +41,44 @@ def send_message(
     if not body.message.strip():
         raise HTTPException(400, "Messaggio vuoto")
 
-    # 1) thread: usa quello del body oppure carica/crea e persisti su DB
+    # 0) posto nel governor (limite globale/per utente); coda piena → 429/503 subito
+    try:
+        ticket = await governor.acquire(user["username"])
+    except GovernorRejected as e:
+        raise HTTPException(e.status_code, e.detail, headers={"Retry-After": str(e.retry_after)})
+    try:
+        return await _send_message(body, user, db, ticket, streaming, debug)
+    except BaseException:
+        governor.release(ticket)
+        raise
+
+
+async def _send_message(body: ChatbotMessageIn, user, db: DbRunner, ticket, streaming: bool, debug: bool):
+    # 1) thread: usa quello del body oppure quello dell'utente (cache; creato una volta sola)
     thread_id = (body.thread_id or "").strip()
     if not thread_id:
-        db_user = db.query(User).filter(User.username == user["username"]).first()
-        if not db_user:
+        thread_id = await get_or_create_thread_id(db, user["username"])
+        if not thread_id:
             raise HTTPException(404, "Utente non trovato")
 
-        if db_user.thread_id:
-            thread_id = db_user.thread_id
-        else:
-            thread_id = create_thread()
-            db_user.thread_id = thread_id
-            db.commit()
-
     # 2) append messaggio utente
     try:
-        add_user_message(thread_id, body.message)
+        await aadd_user_message(thread_id, body.message)
     except Exception as e:
         raise HTTPException(502, f"Errore nel passare il messaggio al thread: {e}")
 
     # 3) esecuzione assistant
     if streaming:
         async def sse_gen():
-            yield f"event: meta\ndata: {json.dumps({'thread_id': thread_id})}\n\n"
-
-            q: asyncio.Queue[str | None] = asyncio.Queue(maxsize=512)
-            loop = asyncio.get_running_loop()
-
-            def produce():
-                try:
-                    asyncio.run_coroutine_threadsafe(
-                        q.put("__DBG__:producer-started"), loop
-                    ).result()
-                    for piece in run(thread_id, streaming=True):
-                        asyncio.run_coroutine_threadsafe(q.put(piece), loop).result()
-                except Exception as e:
-                    pass
-                    #asyncio.run_coroutine_threadsafe(q.put(f\"__ERR__:{e}\"), loop).result()
-                finally:
-                    asyncio.run_coroutine_threadsafe(q.put(None), loop).result()
-
-            threading.Thread(target=produce, daemon=True).start()
-
-            while True:
-                try:
-                    chunk = await asyncio.wait_for(q.get(), timeout=2.0)
-                except asyncio.TimeoutError:
-                    yield "event: ping\ndata: {}\n\n"
-                    continue
-
-                if chunk is None:
-                    break
-                if chunk.startswith("__ERR__:"):
-                    detail = chunk.replace("__ERR__:", "", 1)
-                    yield f"event: error\ndata: {json.dumps({'detail': detail})}\n\n"
-                    break
-                if chunk.startswith("__DBG__:"):
-                    yield f"event: debug\ndata: {json.dumps({'note': chunk[8:]})}\n\n"
-                    continue
-                if chunk.startswith("__EVT__:"):
-                    # inoltra il tipo di evento SDK per capire cosa arriva nel container
-                    yield f"event: sdk\ndata: {json.dumps({'type': chunk[8:]})}\n\n"
-                    continue
-
-                # vero testo
-                yield f"event: delta\ndata: {json.dumps({'text': chunk})}\n\n"
-
-            yield "event: done\ndata: {}\n\n"
+            try:
+                yield sse_event("meta", {"thread_id": thread_id})
+                if debug:
+                    yield sse_event("debug", {"note": "producer-started", "queued_ms": round(ticket.queued_ms)})
+                async for frame in relay(astream_text(thread_id)):
+                    yield frame
+                yield "event: done\ndata: {}\n\n"
+            finally:
+                governor.release(ticket)
 
         return StreamingResponse(
             sse_gen(),
@@ -119,20 +88,25 @@ def send_message(
                 "Connection": "keep-alive",
                 "X-Accel-Buffering": "no",
             },
+            # se lo stream non parte (client già disconnesso) il posto va liberato comunque
+            background=BackgroundTask(governor.release, ticket),
         )
 
-    # → percorso non-streaming (polling + risposta finale)
+    # → percorso non-streaming (polling adattivo async + risposta finale)
     try:
-        status_str = run(thread_id, streaming=False, timeout_s=60)
+        status_str = await arun(thread_id, timeout_s=RUN_TIMEOUT_S)
+    except TimeoutError:
+        raise HTTPException(504, "Il run dell'assistente non è terminato in tempo")
     except Exception as e:
         raise HTTPException(502, f"Errore durante l'esecuzione del run: {e}")
 
+    governor.release(ticket)
     if status_str != "completed":
         raise HTTPException(502, f"Run non completato (stato: {status_str})")
 
     # 4) recupera risposta intera
     try:
-        reply = get_last_assistant_message(thread_id) or ""
+        reply = await aget_last_assistant_message(thread_id) or ""
     except Exception as e:
         raise HTTPException(502, f"Errore nel recupero della risposta: {e}")
 
@@ -152,11 +126,12 @@ def get_prompt():
 
 
 @router.get("/thread_id", response_model=dict)
-def get_thread_id(
+async def get_thread_id(
     me=Security(get_current_user, scopes=["entries:read"]),
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
 ):
-    user = db.query(User).filter(User.username == me["username"]).first()
-    if not user:
+    try:
+        thread_id = await cached_thread_id(db, me["username"])
+    except LookupError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return {"thread_id": user.thread_id}
\ No newline at end of file
+    return {"thread_id": thread_id}
\ No newline at end of file
@@ -1,65 +1,446 @@
-from fastapi import APIRouter, Depends, status, Security, HTTPException, Query
+import base64
+import json
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, status, Security, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.api.services.queueing import enqueue_entry
+from app.api.services.changes import changes_since, cursor_expired
+from app.api.services.journal_io import FORMATS, ImportFormatError, export_entries, import_entries
+from app.api.services.outbox import add_to_outbox, notify_dispatcher
+from app.api.services.search import index_entries, index_rows, search_entries
+from app.api.services.stats import mood_timeseries, user_tz
+from app.api.services.user_stats import record_deletion, record_entries
+from app.api.services.versioning import bump_version, current_version, etag_headers, make_etag, not_modified
 from app.core.deps import get_current_user
-from app.db import get_db
-from app.db.models import Entry
-from app.schemas.entry import EntryCreate, EntryOut, PaginatedEntries
+from app.db import DbRunner, get_db_runner
+from app.db.models import Entry, EntryTerm, EntryTombstone, SentimentOutbox
+from app.schemas.entry import EntryBatchIn, EntryBatchOut, EntryChanges, EntryCreate, EntryOut, PaginatedEntries, MoodTimeseries, SearchResults
 
 router = APIRouter()
 
 
+def _encode_cursor(entry_id: int) -> str:
+    return base64.urlsafe_b64encode(f"e:{entry_id}".encode("ascii")).decode("ascii").rstrip("=")
 
-@router.post("/entries", response_model=EntryOut, status_code=status.HTTP_201_CREATED,)
-def create_entry(
-        body: EntryCreate,
-        user=Security(get_current_user, scopes=["entries:write"]),
-        db: Session = Depends(get_db),
-):
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        prefix, _, value = raw.partition(":")
+        if prefix != "e":
+            raise ValueError(raw)
+        return int(value)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="cursore non valido")
+
+
+SEARCH_PLAN_MAX_BYTES = 64 * 1024    # piano decompresso (8 gruppi x 50 termini stanno ben sotto)
+
+
+def _encode_search_cursor(score: int, entry_id: int, plan: list[dict[str, int]]) -> str:
+    # il piano (termini espansi + pesi della prima pagina) compresso dopo (score, id)
+    packed = zlib.compress(json.dumps(plan, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    raw = f"s:{score}:{entry_id}:".encode("ascii") + packed
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_search_cursor(cursor: str) -> tuple[int, int, list[dict[str, int]]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        prefix, score, entry_id, packed = raw.split(b":", 3)
+        if prefix != b"s":
+            raise ValueError(raw)
+        unpacker = zlib.decompressobj()
+        plan_json = unpacker.decompress(packed, SEARCH_PLAN_MAX_BYTES)
+        if unpacker.unconsumed_tail:
+            raise ValueError("piano troppo grande")
+        plan = json.loads(plan_json)
+        if not isinstance(plan, list) or not plan or not all(
+            isinstance(g, dict) and g and all(isinstance(t, str) and type(w) is int for t, w in g.items())
+            for g in plan
+        ):
+            raise ValueError("piano non valido")
+        return int(score), int(entry_id), plan
+    except (ValueError, UnicodeDecodeError, zlib.error):
+        raise HTTPException(status_code=400, detail="cursore non valido")
+
+
+def _encode_changes_cursor(seq: int, entry_id: int) -> str:
+    # issued_at nel cursore: oltre la retention dei tombstone il client deve ripartire da zero
+    raw = f"c:{seq}:{entry_id}:{int(time.time())}"
+    return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii").rstrip("=")
+
+
+def _decode_changes_cursor(cursor: str) -> tuple[int, int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        prefix, seq, entry_id, issued_at = raw.split(":")
+        if prefix != "c":
+            raise ValueError(raw)
+        return int(seq), int(entry_id), int(issued_at)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="cursore non valido")
+
+
+def _by_client_id(db: Session, username: str, client_id: str) -> Entry | None:
+    return db.scalar(select(Entry).where(Entry.user_id == username, Entry.client_id == client_id))
+
+
+def _insert_entry(db: Session, username: str, body: EntryCreate) -> tuple[Entry, bool]:
+    """(entry, creata): False se è il replay di una bozza già salvata (si ritorna quella)."""
+    if body.client_id is not None:
+        existing = _by_client_id(db, username, body.client_id)
+        if existing is not None:
+            return existing, False
+    # versione prima dell'INSERT: diventa il change_seq dell'entry (delta sync)
+    seq = bump_version(db, username)
     e = Entry(
-        user_id=user["username"],
+        user_id=username,
         title=body.title,
         content=body.content,
         mood=body.mood,
+        change_seq=seq,
+        client_id=body.client_id,
     )
-    db.add(e); db.commit(); db.refresh(e)
-    enqueue_entry(e.id)
+    db.add(e)
+    add_to_outbox(db, [e])   # job di sentiment nella stessa transazione
+    index_entries(db, [e])   # termini per /entries/search, idem
+    try:
+        db.flush()           # created_at dall'INSERT, per il giorno locale
+        record_entries(db, username, [(e.created_at, e.mood)])   # user_stats, idem
+        db.commit()
+    except IntegrityError:
+        # stessa bozza salvata in parallelo da un'altra richiesta: vale quella
+        db.rollback()
+        existing = _by_client_id(db, username, body.client_id) if body.client_id is not None else None
+        if existing is None:
+            raise
+        return existing, False
+    return e, True
+
+
+def _existing_client_ids(db: Session, username: str, client_ids: list[str]) -> dict[str, int]:
+    if not client_ids:
+        return {}
+    return dict(db.execute(
+        select(Entry.client_id, Entry.id).where(Entry.user_id == username, Entry.client_id.in_(client_ids))
+    ).all())
+
+
+def _insert_batch(db: Session, username: str, items: list[tuple[int, EntryCreate]]) -> list[dict]:
+    """
+    Una transazione per tutto il lotto: INSERT multi-riga con RETURNING degli
+    id, outbox e indice di ricerca in executemany. Le bozze con client_id già
+    salvato (anche più volte nello stesso lotto) risultano "duplicate".
+    """
+    for attempt in range(2):
+        known = _existing_client_ids(db, username, list({b.client_id for _, b in items if b.client_id}))
+        results, todo = [], []
+        for index, body in items:
+            if body.client_id is not None and body.client_id in known:
+                results.append({"index": index, "status": "duplicate", "id": known[body.client_id],
+                                "client_id": body.client_id})
+                continue
+            if body.client_id is not None:
+                known[body.client_id] = None    # segnaposto: le ripetizioni nel lotto sono duplicate
+            todo.append((index, body))
+        if not todo:
+            return results
+
+        seq = bump_version(db, username)
+        try:
+            # Core insert (non ORM bulk): parametri uniformi → un solo INSERT multi-VALUES
+            rows = db.execute(
+                insert(Entry.__table__).returning(
+                    Entry.id, Entry.user_id, Entry.title, Entry.content, Entry.created_at, Entry.client_id,
+                    sort_by_parameter_order=True,
+                ),
+                [{"user_id": username, "title": b.title, "content": b.content, "mood": b.mood,
+                  "change_seq": seq, "client_id": b.client_id} for _, b in todo],
+            ).all()
+            db.execute(insert(SentimentOutbox), [{"entry_id": r.id} for r in rows])
+            index_rows(db, rows)
+            record_entries(db, username, [(r.created_at, b.mood) for (_, b), r in zip(todo, rows)])
+            db.commit()
+        except IntegrityError:
+            # stessa bozza salvata in parallelo da un'altra richiesta: si rilegge e si riprova una volta
+            db.rollback()
+            if attempt:
+                raise
+            continue
+        by_client = {r.client_id: r.id for r in rows if r.client_id}
+        for (index, body), r in zip(todo, rows):
+            results.append({"index": index, "status": "created", "id": r.id, "client_id": r.client_id,
+                            "created_at": r.created_at})
+        for res in results:
+            if res["status"] == "duplicate" and res["id"] is None:
+                res["id"] = by_client.get(res["client_id"])
+        return results
+
+
+def _delete_entry(db: Session, username: str, entry_id: int) -> bool:
+    # lock sull'utente prima di leggere: due DELETE parallele dello stesso id → la seconda vede 404
+    seq = bump_version(db, username)
+    gone = db.execute(
+        select(Entry.created_at, Entry.mood).where(Entry.id == entry_id, Entry.user_id == username)
+    ).first()
+    if gone is None:
+        db.rollback()
+        return False
+    # righe collegate esplicite: non tutti i backend applicano ON DELETE CASCADE
+    db.execute(delete(EntryTerm).where(EntryTerm.entry_id == entry_id))
+    db.execute(delete(SentimentOutbox).where(SentimentOutbox.entry_id == entry_id))
+    db.execute(delete(Entry).where(Entry.id == entry_id))
+    db.add(EntryTombstone(entry_id=entry_id, user_id=username, change_seq=seq))
+    record_deletion(db, username, gone.created_at, gone.mood)
+    db.commit()
+    return True
+
+
+def _changes(db: Session, username: str, after: tuple[int, int] | None, limit: int, version: int) -> dict:
+    page = changes_since(db, username, after, limit, version)
+    return {
+        "changes": page["changes"],
+        "has_more": page["has_more"],
+        "next_cursor": _encode_changes_cursor(*page["next"]),
+    }
+
+
+def _page_entries(db: Session, username: str, skip: int, limit: int, after_id: int | None, include_total: bool) -> dict:
+    q = db.query(Entry).filter(Entry.user_id == username)
+    total = q.count() if include_total else None
+
+    if after_id is not None:
+        # keyset: costo costante a qualunque profondità (usa ix_entries_user_id_id)
+        q = q.filter(Entry.id < after_id)
+    elif skip:
+        q = q.offset(skip)
+
+    rows = q.order_by(Entry.id.desc()).limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = _encode_cursor(items[-1].id) if len(rows) > limit else None
+    return {
+        "total": total,
+        "count": len(items),   # numero entries ritornate in questa pagina
+        "items": items,
+        "next_cursor": next_cursor,
+    }
+
+
+def _user_entry(db: Session, username: str, entry_id: int) -> Entry | None:
+    return db.query(Entry).filter(
+        Entry.id == entry_id,
+        Entry.user_id == username  # o user["id"], dipende dal tuo token
+    ).first()
+
+
+def _search(db: Session, username: str, q: str, limit: int, after: tuple[int, int] | None) -> dict:
+    page = search_entries(db, username, q, limit, after)
+    if page["next_cursor"] is not None:
+        page["next_cursor"] = _encode_search_cursor(*page["next_cursor"])
+    return page
+
+
+def _timeseries(db: Session, username: str, granularity: str, date_from: date | None, date_to: date | None) -> dict:
+    tz = user_tz(db, username)
+    if date_to is None:
+        date_to = datetime.now(timezone.utc).astimezone(tz).date()
+    if date_from is None:
+        date_from = date_to - timedelta(days=365)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="intervallo non valido")
+    if (date_to - date_from).days > 366 * 10:
+        raise HTTPException(status_code=400, detail="intervallo troppo ampio (max 10 anni)")
+    return mood_timeseries(db, username, granularity, date_from, date_to, tz)
+
+
+@router.post("/entries", response_model=EntryOut, status_code=status.HTTP_201_CREATED,)
+async def create_entry(
+        body: EntryCreate,
+        response: Response,
+        user=Security(get_current_user, scopes=["entries:write"]),
+        db: DbRunner = Depends(get_db_runner),
+):
+    e, created = await db.run(_insert_entry, user["username"], body)
+    if created:
+        notify_dispatcher()
+    else:
+        response.status_code = status.HTTP_200_OK   # replay: niente di nuovo
     return e
 
 
+@router.post("/entries:batch", response_model=EntryBatchOut)
+async def create_entries_batch(
+        body: EntryBatchIn,
+        user=Security(get_current_user, scopes=["entries:write"]),
+        db: DbRunner = Depends(get_db_runner),
+):
+    # svuotamento della coda offline: una richiesta, una transazione, un risveglio del dispatcher
+    results, valid = [], []
+    for index, raw in enumerate(body.items):
+        try:
+            valid.append((index, EntryCreate.model_validate(raw)))
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            cid = raw.get("client_id")
+            results.append({"index": index, "status": "invalid", "error": error,
+                            "client_id": cid if isinstance(cid, str) else None})
+    if valid:
+        results += await db.run(_insert_batch, user["username"], valid)
+    created = sum(r["status"] == "created" for r in results)
+    if created:
+        notify_dispatcher()
+    return {"created": created, "results": sorted(results, key=lambda r: r["index"])}
+
+
 @router.get("/entries", response_model=PaginatedEntries)
-def list_entries(
+async def list_entries(
+    request: Request,
+    response: Response,
     user = Security(get_current_user, scopes=["entries:read"]),
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    after: str | None = Query(None, description="Cursore opaco (next_cursor della pagina precedente)"),
+    include_total: bool | None = Query(None, description="Calcola il totale (default: solo sulla prima pagina)"),
 ):
-    q = db.query(Entry).filter(Entry.user_id == user["username"])
-    total = q.count()
-    items = (
-        q.order_by(Entry.id.desc())
-         .offset(skip)
-         .limit(limit)
-         .all()
+    after_id = _decode_cursor(after) if after is not None else None
+    # il COUNT(*) serve solo per mostrare il totale: di default lo calcoliamo
+    # sulla prima pagina e lo saltiamo quando si scorre con il cursore
+    if include_total is None:
+        include_total = after is None
+
+    # versione letta prima della pagina: al peggio l'ETag è più vecchio dei dati (mai il contrario)
+    version = await db.run(current_version, user["username"])
+    etag = make_etag("entries", user["username"], version, skip, limit, after_id, include_total)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response.headers.update(etag_headers(etag))
+    return await db.run(_page_entries, user["username"], skip, limit, after_id, include_total)
+
+
+@router.get("/entries/stats/timeseries", response_model=MoodTimeseries, response_model_by_alias=True)
+async def entries_timeseries(
+    user = Security(get_current_user, scopes=["entries:read"]),
+    db: DbRunner = Depends(get_db_runner),
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    date_from: date | None = Query(None, alias="from", description="Data locale iniziale (inclusa)"),
+    date_to: date | None = Query(None, alias="to", description="Data locale finale (inclusa)"),
+):
+    return await db.run(_timeseries, user["username"], granularity, date_from, date_to)
+
+
+@router.get("/entries/search", response_model=SearchResults)
+async def search(
+    request: Request,
+    response: Response,
+    user = Security(get_current_user, scopes=["entries:read"]),
+    db: DbRunner = Depends(get_db_runner),
+    q: str = Query(..., min_length=1, max_length=200, description="Parole (tutte richieste); 'parol*' per prefisso"),
+    limit: int = Query(20, ge=1, le=50),
+    after: str | None = Query(None, description="Cursore opaco (next_cursor della pagina precedente)"),
+):
+    after_key = _decode_search_cursor(after) if after is not None else None
+    version = await db.run(current_version, user["username"])
+    etag = make_etag("search", user["username"], version, q, limit, after)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response.headers.update(etag_headers(etag))
+    return await db.run(_search, user["username"], q, limit, after_key)
+
+
+@router.get("/entries/changes", response_model=EntryChanges)
+async def entry_changes(
+    request: Request,
+    response: Response,
+    user = Security(get_current_user, scopes=["entries:read"]),
+    db: DbRunner = Depends(get_db_runner),
+    since: str | None = Query(None, description="next_cursor dell'ultima sync (assente: sync completa)"),
+    limit: int = Query(200, ge=1, le=500),
+):
+    after, reset = None, False
+    if since is not None:
+        seq, entry_id, issued_at = _decode_changes_cursor(since)
+        if cursor_expired(issued_at):
+            reset = True            # tombstone forse già cancellati: si riparte da zero
+        else:
+            after = (seq, entry_id)
+
+    version = await db.run(current_version, user["username"])
+    if version is None:
+        raise HTTPException(status_code=404, detail="user not found")
+    # giorno di emissione nell'ETag: anche un client che riceve solo 304 prende
+    # almeno un cursore nuovo al giorno, prima della retention dei tombstone
+    etag = make_etag("changes", user["username"], version, after, limit, reset, int(time.time()) // 86400)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response.headers.update(etag_headers(etag))
+    if after is not None and after[0] > version:
+        # niente di nuovo dall'ultima sync: un solo lookup per PK, stessa posizione, issued_at nuovo
+        return {"changes": [], "has_more": False, "next_cursor": _encode_changes_cursor(*after), "reset": False}
+    page = await db.run(_changes, user["username"], after, limit, version)
+    page["reset"] = reset
+    return page
+
+
+@router.get("/entries/export")
+async def export(
+    user = Security(get_current_user, scopes=["entries:read"]),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+):
+    # tutte le entries in una risposta, a chunk dal cursore DB (niente buffer nel pod)
+    filename = f"moodtrack-{datetime.now(timezone.utc):%Y%m%d}.{format}"
+    return StreamingResponse(
+        export_entries(user["username"], format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
     )
-    return {
-        "total": total,
-        "count": len(items),   # numero entries ritornate in questa pagina
-        "items": items,
-    }
+
+
+@router.post("/entries/import")
+async def import_(
+    request: Request,
+    user = Security(get_current_user, scopes=["entries:write"]),
+    db: DbRunner = Depends(get_db_runner),
+    format: str | None = Query(None, pattern="^(ndjson|csv)$", description="Default dal Content-Type"),
+):
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    try:
+        result = await import_entries(db, user["username"], request.stream(), format)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result["imported"]:
+        notify_dispatcher()
+    return result
 
 
 @router.get("/entries/{entry_id}", response_model=EntryOut)
-def get_entry(
+async def get_entry(
     entry_id: int,
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
     user=Security(get_current_user, scopes=["entries:read"])
 ):
-    e = db.query(Entry).filter(
-        Entry.id == entry_id,
-        Entry.user_id == user["username"]  # o user["id"], dipende dal tuo token
-    ).first()
-
+    e = await db.run(_user_entry, user["username"], entry_id)
     if not e:
         raise HTTPException(status_code=404, detail="not found")
-    return e
\ No newline at end of file
+    return e
+
+
+@router.delete("/entries/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_entry(
+    entry_id: int,
+    db: DbRunner = Depends(get_db_runner),
+    user=Security(get_current_user, scopes=["entries:write"])
+):
+    if not await db.run(_delete_entry, user["username"], entry_id):
+        raise HTTPException(status_code=404, detail="not found")
@@ -1,10 +1,25 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.api.services.warmup import warmup_state
 
 
 
 router = APIRouter(tags=["health"])
 
 
+# liveness: il processo risponde, nessuna dipendenza esterna (un DB giù non deve far riavviare il pod)
 @router.get("/health")
+@router.get("/health/live")
 def health():
-    return "OK"
\ No newline at end of file
+    return "OK"
+
+
+# readiness: 503 finché il warm-up (connessioni DB, ...) non è completato
+@router.get("/health/ready")
+def ready():
+    state = warmup_state()
+    return JSONResponse(
+        {"status": "ready" if state["ready"] else "warming", "steps": state["steps"]},
+        status_code=200 if state["ready"] else 503,
+    )
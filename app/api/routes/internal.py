@@ -1,9 +1,21 @@
 # app/api/routes/internal.py
 import os, hmac, hashlib
 from fastapi import APIRouter, Header, HTTPException, Depends, Request
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from app.db import get_db
 from app.db.models import Entry
+from app.schemas.internal import BatchGetIn, BatchSentimentIn, score_in_range, score_to_mood
+from app.api.services.queueing import get_producer
+from app.api.services.outbox import backlog_stats, get_dispatcher
+from app.api.services.versioning import bump_versions_for_entries
+from app.api.services.user_stats import record_mood_changes
+from app.core.password_pool import get_password_pool
+from app.api.services.llm_governor import governor
+from app.api.services.user_cache import cache_stats
+from app.api.services.token_purge import get_purger
+from app.api.services.warmup import warmup_state
+from app.obs.startup import report as startup
 
 JOB_KEY = os.getenv("JOB_KEY", "")
 
@@ -30,6 +42,54 @@ router = APIRouter(
     include_in_schema=False,
 )
 
+@router.post("/entries:batchGet")
+def batch_get_entries(body: BatchGetIn, db: Session = Depends(get_db)):
+    # un'unica query IN al posto di N GET
+    ids = list(dict.fromkeys(body.ids))
+    rows = db.execute(select(Entry.id, Entry.content).where(Entry.id.in_(ids))).all()
+    found = {r.id for r in rows}
+    return {
+        "items": [{"id": r.id, "content": r.content} for r in rows],
+        "missing": [i for i in ids if i not in found],
+    }
+
+@router.patch("/entries:batchSentiment")
+def batch_patch_sentiment(body: BatchSentimentIn, db: Session = Depends(get_db)):
+    results: dict[int, dict] = {}
+    scores: dict[int, int] = {}
+    for it in body.items:
+        # in caso di id duplicati vince l'ultimo
+        score = it.sentiment_score
+        if score is None or not score_in_range(score):
+            error = "missing score" if score is None else "score out of range"
+            results[it.entry_id] = {"entry_id": it.entry_id, "ok": False, "error": error}
+            scores.pop(it.entry_id, None)
+        else:
+            results.pop(it.entry_id, None)
+            scores[it.entry_id] = score_to_mood(score)
+
+    if scores:
+        # prima il lock sui proprietari, poi il mood precedente (user_stats): due consegne
+        # sovrapposte dello stesso punteggio non contano il cambio due volte
+        bump_versions_for_entries(db, list(scores))
+        before = {r.id: r for r in db.execute(
+            select(Entry.id, Entry.user_id, Entry.created_at, Entry.mood).where(Entry.id.in_(list(scores)))
+        )}
+        existing = set(before)
+        params = [{"id": i, "mood": s} for i, s in scores.items() if i in existing]
+        if params:
+            # bulk UPDATE per primary key → un solo executemany
+            db.execute(update(Entry), params)
+            record_mood_changes(db, [(before[p["id"]].user_id, before[p["id"]].created_at,
+                                      before[p["id"]].mood, p["mood"]) for p in params])
+        db.commit()
+        for i in scores:
+            results[i] = {"entry_id": i, "ok": True} if i in existing else {"entry_id": i, "ok": False, "error": "not found"}
+
+    # un risultato per id, nell'ordine della richiesta
+    order = dict.fromkeys(it.entry_id for it in body.items)
+    return {"results": [results[i] for i in order]}
+
 @router.get("/entries/{entry_id}")
 def get_entry(entry_id: int, db: Session = Depends(get_db)):
     e = db.query(Entry).filter(Entry.id == entry_id).first()
@@ -40,7 +100,53 @@ def get_entry(entry_id: int, db: Session = Depends(get_db)):
 def patch_sentiment(entry_id: int, body: dict, db: Session = Depends(get_db)):
     score = body.get("sentiment_score")
     if score is None: raise HTTPException(status_code=400, detail="missing score")
-    updated = db.query(Entry).filter(Entry.id == entry_id).update({"mood": score})
-    if updated == 0: raise HTTPException(status_code=404, detail="not found")
+    score = score_to_mood(score)
+    bump_versions_for_entries(db, [entry_id])   # lock sul proprietario prima di leggere il mood precedente
+    before = db.execute(select(Entry.user_id, Entry.created_at, Entry.mood).where(Entry.id == entry_id)).first()
+    if before is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="not found")
+    db.query(Entry).filter(Entry.id == entry_id).update({"mood": score})
+    record_mood_changes(db, [(before.user_id, before.created_at, before.mood, score)])
     db.commit()
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
+
+@router.get("/queue/stats")
+def queue_stats(db: Session = Depends(get_db)):
+    # backlog dell'outbox (condiviso), dispatcher e contatori di invio del producer (per pod)
+    return {
+        "outbox": backlog_stats(db),
+        "dispatcher": get_dispatcher().stats(),
+        "producer": get_producer().stats(),
+    }
+
+
+@router.get("/auth/pool/stats")
+def auth_pool_stats():
+    # occupazione del process pool bcrypt (per pod)
+    return get_password_pool().stats()
+
+
+@router.get("/llm/governor/stats")
+def llm_governor_stats():
+    # run dell'assistente in corso / in coda e limiti llm:* effettivi (per pod)
+    return governor.stats()
+
+
+@router.get("/users/cache/stats")
+def user_cache_stats():
+    # hit/miss della cache profili e thread_id (per pod)
+    return cache_stats()
+
+
+@router.get("/auth/refresh-tokens/stats")
+def refresh_token_stats():
+    # dimensione di refresh_tokens all'ultimo giro di purge (per pod)
+    p = get_purger()
+    return {"last_run_at": p.last_run_at, "purged": p.purged, **p.last_stats}
+
+
+@router.get("/startup/report")
+def startup_report():
+    # tempi di import/warm-up di questo pod e stato della readiness
+    return {**startup.as_dict(), "warmup": warmup_state()}
@@ -1,54 +1,72 @@
 # app/api/routes/user.py
-from fastapi import APIRouter, Depends, HTTPException, status, Security
-from sqlalchemy.orm import Session, joinedload
-from app.db import SessionLocal
-from app.db.models import User, UserSettings
-from app.schemas.user import UserWithSettingsOut, UserSettingsUpdate
+from fastapi import APIRouter, Depends, HTTPException, status, Security, Request, Response
+from sqlalchemy.orm import Session
+from app.api.services.user_cache import get_profile, invalidate_user
+from app.api.services.user_stats import get_stats, tz_changed
+from app.api.services.versioning import bump_version, current_version, etag_headers, make_etag, not_modified
+from app.db import DbRunner, get_db_runner
+from app.db.models import UserSettings
+from app.schemas.user import UserStatsOut, UserWithSettingsOut, UserSettingsUpdate
 from app.core.deps import get_current_user  # dipendenza che decodifica il JWT
 
 router = APIRouter(tags=["users"], prefix="/users")
 
-# Dependency per avere una sessione DB
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def _save_settings(db: Session, username: str, body: UserSettingsUpdate):
+    us = db.query(UserSettings).filter(UserSettings.user_id == username).first()
+    if not us:
+        us = UserSettings(user_id=username)
+        db.add(us)
+    if body.email_opt_in is not None:
+        us.email_opt_in = body.email_opt_in
+    if body.weekly_summary_day is not None:
+        us.weekly_summary_day = body.weekly_summary_day
+    if body.tz_iana:
+        us.tz_iana = body.tz_iana
+    bump_version(db, username)
+    if body.tz_iana:
+        tz_changed(db, username, body.tz_iana)   # giorni locali di user_stats
+    db.commit()
+
 
 @router.get("/me", response_model=UserWithSettingsOut)
 async def get_my_profile(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
     user=Security(get_current_user, scopes=["entries:read"]),
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
 ):
-    user = (
-        db.query(User)
-        .options(joinedload(User.settings))
-        .filter(User.username == current_user["username"])
-        .first()
-    )
+    version = await db.run(current_version, current_user["username"])
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    etag = make_etag("profile", current_user["username"], version)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
+    user = await get_profile(db, current_user["username"], version)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    response.headers.update(etag_headers(etag))
 
     return user
 
 
 @router.put("/me")
-def update_my_settings(
+async def update_my_settings(
     body: UserSettingsUpdate,
     me=Security(get_current_user, scopes=["entries:write"]),
-    db: Session = Depends(get_db),
+    db: DbRunner = Depends(get_db_runner),
 ):
-    us = db.query(UserSettings).filter(UserSettings.user_id == me["username"]).first()
-    if not us:
-        us = UserSettings(user_id=me["username"])
-        db.add(us)
-    if body.email_opt_in is not None:
-        us.email_opt_in = body.email_opt_in
-    if body.weekly_summary_day is not None:
-        us.weekly_summary_day = body.weekly_summary_day
-    if body.tz_iana:
-        us.tz_iana = body.tz_iana
-    db.commit()
-    return {"ok": True}
\ No newline at end of file
+    await db.run(_save_settings, me["username"], body)
+    invalidate_user(me["username"])
+    return {"ok": True}
+
+
+@router.get("/me/stats", response_model=UserStatsOut)
+async def get_my_stats(
+    user=Security(get_current_user, scopes=["entries:read"]),
+    db: DbRunner = Depends(get_db_runner),
+):
+    # una lettura per PK di user_stats (aggiornata dalle scritture sulle entries)
+    return await db.run(get_stats, user["username"])
@@ -1,39 +1,87 @@
-import os, time
-from openai import AzureOpenAI
+import asyncio, os, threading, time
 
-client = AzureOpenAI(
+# timeout della singola chiamata HTTP e deadline complessiva di un run
+REQUEST_TIMEOUT_S = float(os.getenv("AZURE_OPENAI_TIMEOUT_S", "20"))
+RUN_TIMEOUT_S = float(os.getenv("ASSISTANT_RUN_TIMEOUT_S", "60"))
+
+# polling adattivo: veloce all'inizio (run brevi), poi sempre più rado
+POLL_SCHEDULE_S = (0.25, 0.25, 0.5, 0.5, 1.0, 1.0, 1.5)
+POLL_MAX_S = 2.0
+
+_client_kwargs = dict(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
+    timeout=REQUEST_TIMEOUT_S,
+    max_retries=2,
 )
+# client creati al primo uso (o nel warm-up): l'import dell'SDK openai non pesa sull'avvio
+client = None
+aclient = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import AzureOpenAI
+                client = AzureOpenAI(**_client_kwargs)
+    return client
+
+
+def get_aclient():
+    global aclient
+    if aclient is None:
+        with _client_lock:
+            if aclient is None:
+                from openai import AsyncAzureOpenAI
+                aclient = AsyncAzureOpenAI(**_client_kwargs)
+    return aclient
+
+
 assistant_id = os.getenv("AZURE_OPENAI_ASSISTANT_ID")
 
+_PENDING = ("queued", "in_progress", "cancelling")
+
+
+def _poll_delays():
+    yield from POLL_SCHEDULE_S
+    while True:
+        yield POLL_MAX_S
 
 
 def create_thread():
-    return client.beta.threads.create().id
+    return get_client().beta.threads.create().id
 
 def add_user_message(thread_id: str, text: str):
-    return client.beta.threads.messages.create(
+    return get_client().beta.threads.messages.create(
         thread_id=thread_id, role="user", content=text
     )
 
 
 def run(thread_id: str, streaming: bool = False, timeout_s: int = 60):
     if not streaming:
-        run_obj = client.beta.threads.runs.create(
+        deadline = time.monotonic() + timeout_s
+        run_obj = get_client().beta.threads.runs.create(
             thread_id=thread_id, assistant_id=assistant_id
         )
-        while run_obj.status in ("queued", "in_progress", "cancelling"):
-            time.sleep(1)
-            run_obj = client.beta.threads.runs.retrieve(
+        delays = _poll_delays()
+        while run_obj.status in _PENDING:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _cancel_quietly(thread_id, run_obj.id)
+                raise TimeoutError(f"run {run_obj.id} oltre {timeout_s}s")
+            time.sleep(min(next(delays), remaining))
+            run_obj = get_client().beta.threads.runs.retrieve(
                 thread_id=thread_id, run_id=run_obj.id
             )
         return run_obj.status
 
     # -------- generator bloccante che produce pezzi di testo --------
     def _gen():
-        with client.beta.threads.runs.stream(
+        with get_client().beta.threads.runs.stream(
             thread_id=thread_id,
             assistant_id=assistant_id,
         ) as stream:
@@ -117,8 +165,14 @@ def run(thread_id: str, streaming: bool = False, timeout_s: int = 60):
 
 
 
-def get_last_assistant_message(thread_id: str) -> str:
-    msgs = client.beta.threads.messages.list(thread_id=thread_id)
+def _cancel_quietly(thread_id: str, run_id: str):
+    try:
+        get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception:
+        pass
+
+
+def _last_assistant_text(msgs) -> str:
     for m in msgs.data:
         if m.role == "assistant":
             parts = [c.text.value for c in m.content if getattr(c, "type", None)=="text"]
@@ -126,6 +180,60 @@ def get_last_assistant_message(thread_id: str) -> str:
     return ""
 
 
+def get_last_assistant_message(thread_id: str) -> str:
+    msgs = get_client().beta.threads.messages.list(thread_id=thread_id)
+    return _last_assistant_text(msgs)
+
+
+# ---------------------------------------------------------------- async
+# Stesse operazioni con AsyncAzureOpenAI: le chat non occupano thread del pool.
+
+async def acreate_thread() -> str:
+    return (await get_aclient().beta.threads.create()).id
+
+
+async def aadd_user_message(thread_id: str, text: str):
+    return await get_aclient().beta.threads.messages.create(
+        thread_id=thread_id, role="user", content=text
+    )
+
+
+async def arun(thread_id: str, timeout_s: float = RUN_TIMEOUT_S) -> str:
+    """
+    Crea il run e ne attende la fine con polling adattivo.
+    Oltre timeout_s cancella il run (best effort) e solleva TimeoutError.
+    """
+    deadline = time.monotonic() + timeout_s
+    run_obj = await asyncio.wait_for(
+        get_aclient().beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id),
+        timeout=timeout_s,
+    )
+    delays = _poll_delays()
+    while run_obj.status in _PENDING:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            await _acancel_quietly(thread_id, run_obj.id)
+            raise TimeoutError(f"run {run_obj.id} oltre {timeout_s}s")
+        await asyncio.sleep(min(next(delays), remaining))
+        run_obj = await asyncio.wait_for(
+            get_aclient().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_obj.id),
+            timeout=max(0.1, deadline - time.monotonic()),
+        )
+    return run_obj.status
+
+
+async def _acancel_quietly(thread_id: str, run_id: str):
+    try:
+        await asyncio.wait_for(get_aclient().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id), timeout=5)
+    except Exception:
+        pass
+
+
+async def aget_last_assistant_message(thread_id: str) -> str:
+    msgs = await get_aclient().beta.threads.messages.list(thread_id=thread_id)
+    return _last_assistant_text(msgs)
+
+
 
 
 
@@ -136,7 +244,7 @@ def get_last_assistant_message(thread_id: str) -> str:
 """
 def create_assistant():
     # 1) crea (una volta) l'assistente
-    a = client.beta.assistants.create(
+    a = get_client().beta.assistants.create(
         name="MoodTrack Confidente",
         instructions=(
             "Sei MoodTrack, un confidente empatico. Non sei un terapeuta. "
@@ -146,4 +254,33 @@ def create_assistant():
         tools=[]  # in futuro: [{"type":"function", "function": {...}}], "file_search", "code_interpreter"
     )
     return a
-"""
\ No newline at end of file
+"""
+
+async def astream_text(thread_id: str):
+    """
+    Async generator dei pezzi di testo di un run in streaming (nessun thread).
+    Solleva RuntimeError se il run fallisce.
+    """
+    yielded_any = False
+    async with get_aclient().beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+    ) as stream:
+        async for event in stream:
+            etype = getattr(event, "event", None) or getattr(event, "type", "") or ""
+            if etype.endswith("message.delta"):
+                delta = getattr(event.data, "delta", None)
+                for block in (getattr(delta, "content", None) or []):
+                    t = getattr(block, "text", None)
+                    if getattr(block, "type", None) == "text" and t and getattr(t, "value", None):
+                        yielded_any = True
+                        yield t.value
+            elif etype in ("thread.run.failed", "thread.run.expired", "error"):
+                raise RuntimeError(f"run stream error: {etype}")
+
+        # nessun delta? prendi i messaggi finali e inviali in blocco
+        if not yielded_any:
+            for m in await stream.get_final_messages():
+                for c in m.content:
+                    if getattr(c, "type", None) == "text" and c.text.value:
+                        yield c.text.value
@@ -0,0 +1,116 @@
+# app/api/services/changes.py
+"""
+Delta sync delle entries (GET /entries/changes).
+
+Ogni scrittura su un'entry ne copia in change_seq la nuova users.data_version
+(stessa transazione, riga utente bloccata fino al commit): per un utente i
+change_seq crescono nell'ordine dei commit. Le delete lasciano un
+tombstone con lo stesso schema. Il feed è l'unione, ordinata per
+(change_seq, id), di entries vive e tombstone oltre il cursore.
+
+I tombstone più vecchi di CHANGES_TOMBSTONE_RETENTION_D si cancellano:
+un cursore emesso prima di quella soglia risponde reset=true (il client
+riparte da zero).
+
+    python -m app.api.services.changes purge [--days 90]
+"""
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.orm import Session
+
+from app.db.models import Entry, EntryTombstone
+
+CHANGES_TOMBSTONE_RETENTION_D = int(os.getenv("CHANGES_TOMBSTONE_RETENTION_D", "90"))
+CHANGES_PURGE_BATCH = 1000
+
+_START = (-1, 0)
+
+
+def cursor_expired(issued_at: int) -> bool:
+    """Cursore più vecchio della retention dei tombstone: potrebbe aver perso delle delete."""
+    horizon = datetime.now(timezone.utc) - timedelta(days=CHANGES_TOMBSTONE_RETENTION_D)
+    return issued_at < horizon.timestamp()
+
+
+def _after(seq_col, id_col, after: tuple[int, int]):
+    seq, last_id = after
+    return or_(seq_col > seq, and_(seq_col == seq, id_col > last_id))
+
+
+def changes_since(db: Session, username: str, after: tuple[int, int] | None, limit: int, version: int) -> dict:
+    """
+    Modifiche dopo after=(change_seq, id) in ordine, al massimo limit.
+    after=None: sync iniziale, la prima pagina ha solo entries vive (niente
+    tombstone); le pagine dopo hanno un cursore normale e possono contenere
+    delete di entries mai ricevute, che il client ignora.
+    version: users.data_version letta prima. Entrambe le query si fermano a
+    change_seq <= version: quei change_seq erano già committati quando è stata
+    letta, quindi le due SELECT (statement separati, READ COMMITTED) vedono lo
+    stesso insieme anche se nel frattempo arriva una scrittura; quello che
+    arriva dopo ha change_seq > version e va nella sync successiva.
+    """
+    start = after or _START
+    upserts = db.scalars(
+        select(Entry)
+        .where(Entry.user_id == username, Entry.change_seq <= version, _after(Entry.change_seq, Entry.id, start))
+        .order_by(Entry.change_seq, Entry.id)
+        .limit(limit + 1)
+    ).all()
+    deletes = []
+    if after is not None:
+        deletes = db.execute(
+            select(EntryTombstone.entry_id, EntryTombstone.change_seq)
+            .where(EntryTombstone.user_id == username, EntryTombstone.change_seq <= version,
+                   _after(EntryTombstone.change_seq, EntryTombstone.entry_id, start))
+            .order_by(EntryTombstone.change_seq, EntryTombstone.entry_id)
+            .limit(limit + 1)
+        ).all()
+
+    merged = sorted(
+        [((e.change_seq, e.id), {"op": "upsert", "id": e.id, "entry": e}) for e in upserts]
+        + [((d.change_seq, d.entry_id), {"op": "delete", "id": d.entry_id}) for d in deletes],
+        key=lambda kv: kv[0],
+    )
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    if has_more:
+        nxt = merged[-1][0]
+    else:
+        # fine del feed: consegnato tutto fino a version → (S + 1, 0) = "completo fino a S";
+        # un cursore già oltre version (non dovrebbe capitare) resta dov'è
+        nxt = max((version + 1, 0), start)
+    return {"changes": [c for _, c in merged], "has_more": has_more, "next": nxt}
+
+
+def purge_tombstones(db: Session, days: int = CHANGES_TOMBSTONE_RETENTION_D) -> int:
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    total = 0
+    while True:
+        ids = db.scalars(
+            select(EntryTombstone.entry_id).where(EntryTombstone.deleted_at < cutoff).limit(CHANGES_PURGE_BATCH)
+        ).all()
+        if not ids:
+            return total
+        db.execute(delete(EntryTombstone).where(EntryTombstone.entry_id.in_(ids)))
+        db.commit()
+        total += len(ids)
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.changes", description="Tombstone del delta sync")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("purge", help="cancella i tombstone più vecchi della retention")
+    p.add_argument("--days", type=int, default=CHANGES_TOMBSTONE_RETENTION_D)
+    args = ap.parse_args(argv)
+
+    with SessionLocal() as db:
+        print(f"cancellati {purge_tombstones(db, args.days)} tombstone")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# app/api/services/journal_io.py
+"""
+Export/import del diario di un utente (NDJSON o CSV), in streaming.
+
+- export: una SELECT sola con cursore lato server (yield_per), righe come
+  tuple (niente oggetti ORM) serializzate a blocchi di EXPORT_BATCH; la
+  memoria non dipende dal numero di entries. Gira in una sessione sync
+  dedicata: StreamingResponse itera il generatore nel threadpool.
+- import: il body si legge a pezzi, le righe si validano una alla volta e
+  si inseriscono a lotti di IMPORT_BATCH, ognuno nella sua transazione con
+  outbox di sentiment (solo per le entries senza mood) e indice di ricerca.
+  Le righe già presenti (stesso client_id, oppure stesso created_at e
+  titolo) si saltano: reimportare lo stesso file dopo un errore non crea
+  duplicati. Le statistiche (user_stats) si ricalcolano una volta, alla fine.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.api.services.outbox import add_to_outbox
+from app.api.services.search import index_entries
+from app.api.services.user_stats import lock_user, rebuild_user
+from app.api.services.versioning import bump_version
+from app.db import SessionLocal
+from app.db.models import Entry
+from app.schemas.entry import EntryImport
+
+EXPORT_BATCH      = int(os.getenv("EXPORT_BATCH", "500"))          # righe per fetch/chunk HTTP
+IMPORT_BATCH      = int(os.getenv("IMPORT_BATCH", "500"))          # righe per transazione
+IMPORT_MAX_ROWS   = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+IMPORT_MAX_LINE   = int(os.getenv("IMPORT_MAX_LINE_BYTES", "65536"))
+IMPORT_MAX_ERRORS = 50                                             # errori riportati nella risposta
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+FIELDS = ("id", "title", "content", "mood", "created_at", "client_id")
+
+
+class ImportFormatError(ValueError):
+    """Upload non leggibile (riga troppo lunga, CSV senza intestazione, ...)."""
+
+
+def _iso(dt: datetime | None) -> str | None:
+    return dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z") if dt else None
+
+
+# ---------------------------------------------------------------- export
+
+def _encode(rows, fmt: str) -> str:
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({"id": r.id, "title": r.title, "content": r.content, "mood": r.mood,
+                        "created_at": _iso(r.created_at), "client_id": r.client_id}, ensure_ascii=False) + "\n"
+            for r in rows
+        )
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerows((r.id, r.title, r.content, "" if r.mood is None else r.mood, _iso(r.created_at), r.client_id or "")
+                for r in rows)
+    return buf.getvalue()
+
+
+def export_entries(username: str, fmt: str, session_factory=SessionLocal) -> Iterator[str]:
+    """Generatore di chunk di testo: uno per blocco di EXPORT_BATCH righe."""
+    with session_factory() as db:
+        result = db.execute(
+            select(Entry.id, Entry.title, Entry.content, Entry.mood, Entry.created_at, Entry.client_id)
+            .where(Entry.user_id == username)
+            .order_by(Entry.id)
+            .execution_options(yield_per=EXPORT_BATCH)
+        )
+        if fmt == "csv":
+            yield ",".join(FIELDS) + "\n"
+        for part in result.partitions():
+            yield _encode(part, fmt)
+
+
+# ---------------------------------------------------------------- import
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buf = ""
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        *complete, buf = buf.split("\n")
+        for line in complete:
+            yield line + "\n"
+        if len(buf) > IMPORT_MAX_LINE:
+            raise ImportFormatError(f"riga oltre {IMPORT_MAX_LINE} byte")
+    buf += decoder.decode(b"", final=True)
+    if buf:
+        yield buf
+
+
+async def _records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | str]]:
+    """(numero di riga, record) oppure (numero di riga, messaggio d'errore)."""
+    lineno = 0
+    if fmt == "ndjson":
+        async for line in _lines(chunks):
+            lineno += 1
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                yield lineno, f"JSON non valido: {e}"
+                continue
+            yield lineno, obj if isinstance(obj, dict) else "atteso un oggetto JSON"
+        return
+
+    header, pending, start = None, "", 0
+    async for line in _lines(chunks):
+        lineno += 1
+        if not pending:
+            start = lineno
+        pending += line
+        if pending.count('"') % 2:     # campo tra virgolette che continua sulla riga dopo
+            if len(pending) > IMPORT_MAX_LINE:
+                raise ImportFormatError(f"record oltre {IMPORT_MAX_LINE} byte (riga {start})")
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        row = next(csv.reader([record]))
+        if header is None:
+            header = [h.strip().lower() for h in row]
+            if not {"title", "content"} <= set(header):
+                raise ImportFormatError("intestazione CSV senza colonne title/content")
+            continue
+        obj = {k: (v if v != "" else None) for k, v in zip(header, row)}
+        yield start, obj
+    if pending:
+        yield start, "CSV troncato (virgolette non chiuse)"
+
+
+def _fresh(db: Session, username: str, items: list[EntryImport]) -> list[EntryImport]:
+    """Le righe del lotto non ancora presenti (né ripetute nel lotto)."""
+    stamps = list({i.created_at for i in items if i.created_at is not None})
+    client_ids = list({i.client_id for i in items if i.client_id is not None})
+    seen, known = set(), set()
+    if stamps:
+        seen = set(db.execute(
+            select(Entry.created_at, Entry.title)
+            .where(Entry.user_id == username, Entry.created_at.in_(stamps))
+        ).all())
+    if client_ids:
+        known = set(db.scalars(
+            select(Entry.client_id).where(Entry.user_id == username, Entry.client_id.in_(client_ids))
+        ).all())
+    fresh = []
+    for i in items:
+        key = (i.created_at, i.title)
+        if (i.created_at is not None and key in seen) or (i.client_id is not None and i.client_id in known):
+            continue
+        seen.add(key)
+        if i.client_id is not None:
+            known.add(i.client_id)
+        fresh.append(i)
+    return fresh
+
+
+def _insert_batch(db: Session, username: str, items: list[EntryImport]) -> tuple[int, int]:
+    """Inserisce un lotto in una transazione; ritorna (inserite, duplicate)."""
+    for attempt in range(2):
+        # change_seq del lotto (delta sync); prima del controllo dei duplicati: con la riga
+        # utente bloccata due import paralleli dello stesso file non inseriscono due volte
+        seq = bump_version(db, username)
+        fresh = _fresh(db, username, items)
+        if not fresh:
+            db.rollback()
+            return 0, len(items)
+        new = []
+        for i in fresh:
+            e = Entry(user_id=username, title=i.title, content=i.content, mood=i.mood, change_seq=seq,
+                      client_id=i.client_id)
+            if i.created_at is not None:
+                e.created_at = i.created_at
+            new.append(e)
+        db.add_all(new)
+        add_to_outbox(db, [e for e in new if e.mood is None])   # il mood importato non si ricalcola
+        index_entries(db, new)
+        try:
+            db.commit()
+        except IntegrityError:
+            # stesso client_id salvato in parallelo (bozza o altro import): si rilegge e si riprova una volta
+            db.rollback()
+            if attempt:
+                raise
+            continue
+        return len(new), len(items) - len(new)
+
+
+def _rebuild_stats(db: Session, username: str) -> None:
+    # una volta per import: le date storiche non si aggiungono in O(1) (vedi user_stats)
+    lock_user(db, username)
+    rebuild_user(db, username)
+    db.commit()
+
+
+async def import_entries(db, username: str, chunks: AsyncIterator[bytes], fmt: str) -> dict:
+    """db è un DbRunner; un db.run (quindi una transazione) per lotto."""
+    out = {"imported": 0, "duplicates": 0, "failed": 0, "batches": 0, "truncated": False, "errors": []}
+    batch: list[EntryImport] = []
+    rows = 0
+
+    async def flush():
+        inserted, dup = await db.run(_insert_batch, username, batch)
+        out["imported"] += inserted
+        out["duplicates"] += dup
+        out["batches"] += 1
+        batch.clear()
+
+    try:
+        async for lineno, rec in _records(chunks, fmt):
+            if rows >= IMPORT_MAX_ROWS:
+                out["truncated"] = True
+                break
+            rows += 1
+            if isinstance(rec, dict):
+                try:
+                    batch.append(EntryImport.model_validate(rec))
+                except ValidationError as e:
+                    rec = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            if isinstance(rec, str):
+                out["failed"] += 1
+                if len(out["errors"]) < IMPORT_MAX_ERRORS:
+                    out["errors"].append({"line": lineno, "error": rec})
+                continue
+            if len(batch) >= IMPORT_BATCH:
+                await flush()
+        if batch:
+            await flush()
+    finally:
+        if out["imported"]:     # anche se l'import si interrompe a metà
+            await db.run(_rebuild_stats, username)
+    return out
@@ -0,0 +1,222 @@
+# app/api/services/llm_governor.py
+"""
+Governor delle chiamate all'assistente (per pod).
+
+- limite globale e per utente di run in corso;
+- coda d'attesa limitata ed equa: quando si libera un posto si serve a
+  turno ogni utente in attesa (round-robin), così chi manda molti messaggi
+  non affama gli altri;
+- oltre la coda: GovernorRejected → 429 (limite per utente) o 503 (pod saturo)
+  con Retry-After.
+
+I limiti si leggono ad ogni richiesta dai flag llm:* di App Configuration,
+con default da env.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+from app.core.feature_flags import get_value
+
+_DEFAULTS = {
+    "llm:max_concurrent":          int(os.getenv("LLM_MAX_CONCURRENT", "16")),
+    "llm:max_concurrent_per_user": int(os.getenv("LLM_MAX_CONCURRENT_PER_USER", "1")),
+    "llm:max_queue":               int(os.getenv("LLM_MAX_QUEUE", "64")),
+    "llm:max_queue_per_user":      int(os.getenv("LLM_MAX_QUEUE_PER_USER", "2")),
+    "llm:queue_timeout_s":         float(os.getenv("LLM_QUEUE_TIMEOUT_S", "10")),
+    "llm:retry_after_s":           int(os.getenv("LLM_RETRY_AFTER_S", "2")),
+}
+
+
+def _limit(key: str):
+    default = _DEFAULTS[key]
+    raw = get_value(key)
+    if raw is None:
+        return default
+    try:
+        return type(default)(raw)
+    except (TypeError, ValueError):
+        return default
+
+
+class GovernorRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Ticket:
+    __slots__ = ("user", "released", "queued_ms")
+
+    def __init__(self, user: str, queued_ms: float = 0.0):
+        self.user = user
+        self.released = False
+        self.queued_ms = queued_ms
+
+
+class LlmGovernor:
+    def __init__(self):
+        self.active = 0
+        self.active_by_user: dict[str, int] = {}
+        # utente → code di future in attesa; l'ordine del dict è il turno round-robin
+        self.waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.stats_counters = {"granted": 0, "queued": 0, "rejected_user": 0, "rejected_full": 0, "timeouts": 0}
+        self._queue_hist = None
+
+    # -- conteggi
+    def waiting_total(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    def _can_run(self, user: str, max_total: int, max_user: int) -> bool:
+        return self.active < max_total and self.active_by_user.get(user, 0) < max_user
+
+    def _grant(self, user: str):
+        self.active += 1
+        self.active_by_user[user] = self.active_by_user.get(user, 0) + 1
+        self.stats_counters["granted"] += 1
+
+    # -- API
+    async def acquire(self, user: str) -> Ticket:
+        max_total = _limit("llm:max_concurrent")
+        max_user = _limit("llm:max_concurrent_per_user")
+        retry_after = _limit("llm:retry_after_s")
+
+        if not self.waiting and self._can_run(user, max_total, max_user):
+            self._grant(user)
+            self._record_queue_time(0.0)
+            return Ticket(user)
+
+        if len(self.waiting.get(user, ())) >= _limit("llm:max_queue_per_user"):
+            self.stats_counters["rejected_user"] += 1
+            raise GovernorRejected(429, "Troppi messaggi in corso, attendi la risposta precedente", retry_after)
+        if self.waiting_total() >= _limit("llm:max_queue"):
+            self.stats_counters["rejected_full"] += 1
+            raise GovernorRejected(503, "Assistente sovraccarico, riprova tra poco", retry_after)
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user, deque()).append(fut)
+        self.stats_counters["queued"] += 1
+        t0 = time.perf_counter()
+        # c'è coda ma forse solo di utenti già al loro limite: si riparte dal turno
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), _limit("llm:queue_timeout_s"))
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # concesso proprio allo scadere: lo teniamo
+                pass
+            else:
+                self._drop_waiter(user, fut)
+                self.stats_counters["timeouts"] += 1
+                raise GovernorRejected(503, "Assistente sovraccarico, riprova tra poco", retry_after)
+        except asyncio.CancelledError:
+            # client disconnesso mentre attendeva: libera il posto se già concesso
+            if fut.done() and not fut.cancelled():
+                self.release(Ticket(user))
+            else:
+                self._drop_waiter(user, fut)
+            raise
+        queued_ms = (time.perf_counter() - t0) * 1000
+        self._record_queue_time(queued_ms)
+        return Ticket(user, queued_ms)
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        self.active -= 1
+        left = self.active_by_user.get(ticket.user, 1) - 1
+        if left > 0:
+            self.active_by_user[ticket.user] = left
+        else:
+            self.active_by_user.pop(ticket.user, None)
+        self._dispatch()
+
+    # -- interni
+    def _drop_waiter(self, user: str, fut: asyncio.Future):
+        q = self.waiting.get(user)
+        if q is not None:
+            try:
+                q.remove(fut)
+            except ValueError:
+                pass
+            if not q:
+                del self.waiting[user]
+        if not fut.done():
+            fut.cancel()
+
+    def _dispatch(self):
+        """Concede i posti liberi a turno agli utenti in attesa."""
+        max_total = _limit("llm:max_concurrent")
+        max_user = _limit("llm:max_concurrent_per_user")
+        progressed = True
+        while progressed and self.waiting and self.active < max_total:
+            progressed = False
+            for user in list(self.waiting):
+                if self.active >= max_total:
+                    break
+                if not self._can_run(user, max_total, max_user):
+                    continue
+                q = self.waiting[user]
+                fut = q.popleft()
+                if not q:
+                    del self.waiting[user]
+                else:
+                    self.waiting.move_to_end(user)   # in fondo al turno
+                if fut.done():
+                    continue
+                self._grant(user)
+                fut.set_result(True)
+                progressed = True
+
+    def _record_queue_time(self, ms: float):
+        if self._queue_hist is None:
+            from opentelemetry import metrics
+            self._queue_hist = metrics.get_meter("moodtrack.llm").create_histogram(
+                "moodtrack.llm.queue_time", unit="ms", description="Attesa nel governor prima del run"
+            )
+        self._queue_hist.record(ms)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_users": len(self.active_by_user),
+            "waiting": self.waiting_total(),
+            "waiting_users": len(self.waiting),
+            "limits": {k: _limit(k) for k in _DEFAULTS},
+            **self.stats_counters,
+        }
+
+
+governor = LlmGovernor()
+
+
+def _register_metrics():
+    from opentelemetry import metrics
+    from opentelemetry.metrics import Observation
+
+    meter = metrics.get_meter("moodtrack.llm")
+    meter.create_observable_gauge(
+        "moodtrack.llm.active",
+        callbacks=[lambda _opts: [Observation(governor.active)]],
+        description="Run dell'assistente in corso",
+    )
+    meter.create_observable_gauge(
+        "moodtrack.llm.waiting",
+        callbacks=[lambda _opts: [Observation(governor.waiting_total())]],
+        description="Richieste in coda nel governor",
+    )
+    meter.create_observable_counter(
+        "moodtrack.llm.rejected",
+        callbacks=[lambda _opts: [
+            Observation(governor.stats_counters["rejected_user"], {"reason": "per_user"}),
+            Observation(governor.stats_counters["rejected_full"] + governor.stats_counters["timeouts"], {"reason": "saturated"}),
+        ]],
+        description="Richieste rifiutate dal governor",
+    )
+
+
+_register_metrics()
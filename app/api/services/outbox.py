@@ -0,0 +1,214 @@
+# app/api/services/outbox.py
+"""
+Dispatcher dell'outbox di sentiment.
+
+create_entry scrive Entry + SentimentOutbox nella stessa transazione; questo
+modulo svuota l'outbox a lotti (SELECT ... ORDER BY id, invio in coda con
+il producer di processo, DELETE bulk) in un thread del pod o da riga di comando:
+
+    python -m app.api.services.outbox stats
+    python -m app.api.services.outbox list --limit 20
+    python -m app.api.services.outbox drain
+    python -m app.api.services.outbox replay --ids 12 13 14
+    python -m app.api.services.outbox replay --unscored --since-id 1000
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from app.api.services.queueing import encode_message, get_producer
+from app.db import SessionLocal
+from app.db.models import Entry, SentimentOutbox
+
+OUTBOX_DISPATCHER = os.getenv("OUTBOX_DISPATCHER", "1").strip().lower() in ("1", "true", "yes", "on")
+OUTBOX_BATCH      = int(os.getenv("OUTBOX_BATCH", "100"))          # righe per lotto
+OUTBOX_POLL_S     = float(os.getenv("OUTBOX_POLL_S", "2"))         # polling se nessuno ci sveglia
+OUTBOX_BACKOFF_S  = float(os.getenv("OUTBOX_BACKOFF_S", "1"))
+OUTBOX_BACKOFF_MAX_S = 30.0
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def add_to_outbox(db: Session, entries: list[Entry]) -> None:
+    """Accoda (nella transazione corrente) le entry per il sentiment."""
+    db.add_all([SentimentOutbox(entry=e) for e in entries])
+
+
+class OutboxDispatcher:
+    def __init__(self, producer=None, batch_size: int = OUTBOX_BATCH, poll_interval: float = OUTBOX_POLL_S,
+                 session_factory=SessionLocal):
+        self._producer = producer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.dispatched = 0
+        self.failures = 0
+
+    @property
+    def producer(self):
+        # di default il producer di processo: lotti, retry/backoff e contatori di invio
+        return self._producer or get_producer()
+
+    def drain_once(self) -> int:
+        """Invia un lotto; ritorna il numero di righe consegnate."""
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(SentimentOutbox.id, SentimentOutbox.entry_id)
+                .order_by(SentimentOutbox.id)
+                .limit(self.batch_size)
+                # più pod: ognuno prende righe diverse (UPDLOCK/READPAST su SQL Server)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                return 0
+            ids = [r.id for r in rows]
+            try:
+                self.producer.send([encode_message(r.entry_id) for r in rows])
+            except Exception as e:
+                db.rollback()
+                db.execute(
+                    update(SentimentOutbox)
+                    .where(SentimentOutbox.id.in_(ids))
+                    .values(attempts=SentimentOutbox.attempts + 1, last_error=str(e)[:512])
+                )
+                db.commit()
+                raise
+            db.execute(delete(SentimentOutbox).where(SentimentOutbox.id.in_(ids)))
+            db.commit()
+        self.dispatched += len(rows)
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "dispatched": self.dispatched,
+            "failures": self.failures,
+        }
+
+    def drain(self) -> int:
+        total = 0
+        while True:
+            n = self.drain_once()
+            total += n
+            if n < self.batch_size:
+                return total
+
+    # -- thread in background
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Sveglia il dispatcher (chiamato dopo il commit di nuove righe)."""
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        backoff = OUTBOX_BACKOFF_S
+        while not self._stop.is_set():
+            try:
+                self.drain()
+                backoff = OUTBOX_BACKOFF_S
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Dispatch outbox fallito: %s; retry tra %.1fs", e, backoff)
+                self._stop.wait(backoff)
+                backoff = min(OUTBOX_BACKOFF_MAX_S, backoff * 2)
+                continue
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+_dispatcher = OutboxDispatcher()
+
+
+def get_dispatcher() -> OutboxDispatcher:
+    return _dispatcher
+
+
+def notify_dispatcher():
+    if OUTBOX_DISPATCHER:
+        _dispatcher.notify()
+
+
+def start_dispatcher():
+    if OUTBOX_DISPATCHER:
+        _dispatcher.start()
+
+
+def stop_dispatcher(timeout: float = 5.0):
+    _dispatcher.stop(timeout)
+
+
+# ---------------------------------------------------------------- CLI
+
+def backlog_stats(db: Session) -> dict:
+    n, oldest, max_attempts = db.execute(
+        select(func.count(SentimentOutbox.id), func.min(SentimentOutbox.created_at), func.max(SentimentOutbox.attempts))
+    ).one()
+    return {"pending": n, "oldest_created_at": oldest, "max_attempts": max_attempts or 0}
+
+
+def replay(db: Session, ids: list[int] | None = None, unscored: bool = False, since_id: int | None = None) -> int:
+    """Rimette in outbox entry già esistenti (per id, oppure quelle senza mood)."""
+    q = select(Entry.id)
+    if ids:
+        q = q.where(Entry.id.in_(ids))
+    if unscored:
+        q = q.where(Entry.mood.is_(None))
+    if since_id is not None:
+        q = q.where(Entry.id >= since_id)
+    entry_ids = db.scalars(q.order_by(Entry.id)).all()
+    db.add_all([SentimentOutbox(entry_id=i) for i in entry_ids])
+    db.commit()
+    return len(entry_ids)
+
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.outbox", description="Backlog outbox di sentiment")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="righe in attesa, età della più vecchia")
+    p_list = sub.add_parser("list", help="prime righe in attesa")
+    p_list.add_argument("--limit", type=int, default=20)
+    sub.add_parser("drain", help="invia tutto il backlog e termina")
+    p_replay = sub.add_parser("replay", help="rimette in outbox entry esistenti")
+    p_replay.add_argument("--ids", type=int, nargs="*")
+    p_replay.add_argument("--unscored", action="store_true", help="solo entry con mood NULL")
+    p_replay.add_argument("--since-id", type=int)
+    args = ap.parse_args(argv)
+
+    with SessionLocal() as db:
+        if args.cmd == "stats":
+            print(backlog_stats(db))
+        elif args.cmd == "list":
+            for r in db.scalars(select(SentimentOutbox).order_by(SentimentOutbox.id).limit(args.limit)):
+                print(r.id, r.entry_id, r.created_at, r.attempts, r.last_error or "")
+        elif args.cmd == "replay":
+            if not (args.ids or args.unscored):
+                ap.error("replay: indica --ids oppure --unscored")
+            print(f"accodate {replay(db, args.ids, args.unscored, args.since_id)} entry")
+    if args.cmd == "drain":
+        t0 = time.perf_counter()
+        d = OutboxDispatcher()
+        n = d.drain()
+        print(f"inviati {n} job in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,226 @@
 # api/queueing.py
+"""
+Producer dei job di sentiment.
+
+Un solo client per processo; la POST /entries scrive solo la riga di
+sentiment_outbox e risponde subito, il dispatcher dell'outbox (outbox.py)
+invia gli id verso Storage attraverso il producer, a lotti con retry/backoff.
+
+Backend selezionabile con SENTIMENT_QUEUE_BACKEND:
+- azure  (default): Azure Storage Queue
+- memory: lista in memoria (test / sviluppo)
+- sqlite: tabella su file SQLite (test offline, ispezionabile)
+"""
 import base64
-import os
 import json
-from azure.storage.queue import QueueClient
+import logging
+import os
+import sqlite3
+import threading
+import time
 
 QUEUE_CONN_STR = os.getenv("AZURE_STORAGE_CONNECTION_STRING")  # per dev semplice
 QUEUE_NAME = os.getenv("SENTIMENT_QUEUE", "sentiment-jobs")
+QUEUE_BACKEND = os.getenv("SENTIMENT_QUEUE_BACKEND", "azure")
+QUEUE_SQLITE_PATH = os.getenv("SENTIMENT_QUEUE_SQLITE", "sentiment-queue.sqlite")
+
+BATCH_SIZE     = int(os.getenv("SENTIMENT_QUEUE_BATCH", "32"))         # messaggi per send_batch
+MAX_ATTEMPTS   = int(os.getenv("SENTIMENT_QUEUE_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_S = float(os.getenv("SENTIMENT_QUEUE_BACKOFF_S", "0.2"))
+BACKOFF_MAX_S  = 5.0
+
+logger = logging.getLogger("uvicorn.error")
 
-def enqueue_entry(entry_id: int):
-    q = QueueClient.from_connection_string(QUEUE_CONN_STR, QUEUE_NAME)
+
+def encode_message(entry_id: int) -> str:
     body = json.dumps({"entry_id": entry_id}).encode("utf-8")
-    encoded = base64.b64encode(body).decode("ascii")
-    q.send_message(encoded)
\ No newline at end of file
+    return base64.b64encode(body).decode("ascii")
+
+
+# ---------------------------------------------------------------- backend
+
+class AzureQueueBackend:
+    """QueueClient condiviso (connessione HTTP riusata tra un invio e l'altro)."""
+
+    def __init__(self, conn_str: str, queue_name: str):
+        from azure.storage.queue import QueueClient
+        self._client = QueueClient.from_connection_string(conn_str, queue_name)
+
+    def send_batch(self, messages: list[str]) -> None:
+        # Storage Queue non ha un invio multiplo: un send per messaggio sulla stessa connessione
+        for m in messages:
+            self._client.send_message(m)
+
+
+class MemoryQueueBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages: list[str] = []
+
+    def send_batch(self, messages: list[str]) -> None:
+        with self._lock:
+            self.messages.extend(messages)
+
+    def pop(self, n: int | None = None) -> list[str]:
+        with self._lock:
+            n = len(self.messages) if n is None else n
+            out, self.messages = self.messages[:n], self.messages[n:]
+            return out
+
+
+class SqliteQueueBackend:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL,"
+            " enqueued_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def send_batch(self, messages: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO queue_messages (body, enqueued_at) VALUES (?, ?)",
+                [(m, now) for m in messages],
+            )
+            self._conn.commit()
+
+    def pop(self, n: int | None = None) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, body FROM queue_messages ORDER BY id LIMIT ?", (-1 if n is None else n,)
+            ).fetchall()
+            if rows:
+                self._conn.execute("DELETE FROM queue_messages WHERE id <= ?", (rows[-1][0],))
+                self._conn.commit()
+            return [b for _, b in rows]
+
+
+def make_backend(name: str = QUEUE_BACKEND):
+    if name == "memory":
+        return MemoryQueueBackend()
+    if name == "sqlite":
+        return SqliteQueueBackend(QUEUE_SQLITE_PATH)
+    if name == "azure":
+        return AzureQueueBackend(QUEUE_CONN_STR, QUEUE_NAME)
+    raise ValueError(f"SENTIMENT_QUEUE_BACKEND sconosciuto: {name!r}")
+
+
+_send_latency = None
+
+
+def timed_send(backend, batch: list[str], source: str) -> None:
+    """backend.send_batch con la latenza registrata (moodtrack.sentiment_queue.send_latency)."""
+    global _send_latency
+    if _send_latency is None:
+        from opentelemetry import metrics
+        _send_latency = metrics.get_meter("moodtrack.queueing").create_histogram(
+            "moodtrack.sentiment_queue.send_latency", unit="ms",
+            description="Durata di un invio a lotti alla coda di sentiment",
+        )
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        backend.send_batch(batch)
+        ok = True
+    finally:
+        _send_latency.record((time.perf_counter() - t0) * 1000, {"source": source, "ok": ok})
+
+
+# ---------------------------------------------------------------- producer
+
+class QueueSendError(RuntimeError):
+    """Un lotto non è stato consegnato dopo max_attempts tentativi."""
+
+
+class QueueProducer:
+    """
+    Invio a lotti con retry ed exponential backoff su un solo backend per processo.
+    Il buffer dei messaggi in attesa è la tabella sentiment_outbox: send() è
+    sincrono e ritorna solo a consegna avvenuta (o solleva QueueSendError),
+    così il dispatcher cancella le righe dell'outbox solo dopo l'invio.
+    """
+
+    def __init__(self, backend, batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._stats_lock = threading.Lock()
+        self._stats = {"sent": 0, "failed": 0, "retries": 0, "batches": 0, "last_flush_ms": 0.0}
+
+    # -- API
+    def send(self, messages: list[str]) -> None:
+        """Invia a lotti di batch_size; al primo lotto fallito solleva (i precedenti restano inviati)."""
+        for i in range(0, len(messages), self.batch_size):
+            batch = messages[i:i + self.batch_size]
+            if not self._send_with_retry(batch):
+                raise QueueSendError(f"invio di {len(batch)} job di sentiment fallito dopo {self.max_attempts} tentativi")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    # -- interni
+    def _bump(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _send_with_retry(self, batch: list[str]) -> bool:
+        t0 = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                timed_send(self.backend, batch, "producer")
+                with self._stats_lock:
+                    self._stats["sent"] += len(batch)
+                    self._stats["batches"] += 1
+                    self._stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+                return True
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logger.warning("Invio di %d job di sentiment fallito dopo %d tentativi: %s", len(batch), attempt, e)
+                    self._bump("failed", len(batch))
+                    return False
+                self._bump("retries")
+                delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** (attempt - 1)))
+                logger.warning("Invio job di sentiment fallito (tentativo %d): %s; retry tra %.1fs", attempt, e, delay)
+                time.sleep(delay)
+        return False
+
+
+_producer: QueueProducer | None = None
+_producer_lock = threading.Lock()
+
+
+def get_producer() -> QueueProducer:
+    global _producer
+    if _producer: return _producer
+    with _producer_lock:
+        if _producer: return _producer
+        _producer = QueueProducer(make_backend())
+        _register_metrics(_producer)
+        return _producer
+
+
+def _register_metrics(producer: QueueProducer):
+    from opentelemetry import metrics
+    from opentelemetry.metrics import Observation
+
+    meter = metrics.get_meter("moodtrack.queueing")
+    meter.create_observable_counter(
+        "moodtrack.sentiment_queue.sent",
+        callbacks=[lambda _opts: [Observation(producer.stats()["sent"])]],
+        description="Messaggi di sentiment inviati alla coda",
+    )
+    meter.create_observable_counter(
+        "moodtrack.sentiment_queue.failed",
+        callbacks=[lambda _opts: [Observation(producer.stats()["failed"])]],
+        description="Messaggi di sentiment non consegnati dopo i retry (restano in outbox)",
+    )
+    meter.create_observable_counter(
+        "moodtrack.sentiment_queue.retries",
+        callbacks=[lambda _opts: [Observation(producer.stats()["retries"])]],
+        description="Tentativi di invio ripetuti dopo un errore del backend",
+    )
@@ -0,0 +1,317 @@
+# app/api/services/search.py
+"""
+Ricerca testuale sulle entries con un indice invertito gestito dall'app
+(tabella entry_terms): funziona uguale su SQL Server e SQLite, senza
+catalogo full-text da creare fuori da create_all.
+
+- indicizzazione: titolo + contenuto → termini normalizzati (minuscolo,
+  senza accenti, niente stopword) con le occorrenze (titolo pesato x3),
+  scritti nella stessa transazione dell'Entry (index_entries);
+- query: tutti i termini devono comparire (AND); "ans*" cerca per prefisso
+  (espanso ai termini dell'utente, max SEARCH_PREFIX_EXPANSIONS);
+- ranking: somma di min(tf, SEARCH_TF_CAP) * idf (idf BM25 sulle entries
+  dell'utente), calcolato in SQL come intero. Espansione dei prefissi e pesi
+  della prima pagina viaggiano nel cursore insieme a (score, id): le pagine
+  dopo usano gli stessi, quindi il keyset resta esatto anche se nel frattempo
+  entries aggiunte o cancellate cambiano gli idf;
+- highlight: offset dei termini trovati nel titolo e in uno snippet del contenuto.
+
+Backfill/riallineamento dell'indice:
+
+    python -m app.api.services.search reindex [--user mario] [--batch 500]
+    python -m app.api.services.search stats
+"""
+import argparse
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from app.db.models import Entry, EntryTerm, UserStats
+
+SEARCH_MAX_TERMS          = int(os.getenv("SEARCH_MAX_TERMS", "8"))
+SEARCH_PREFIX_EXPANSIONS  = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", "50"))
+SEARCH_TF_CAP             = int(os.getenv("SEARCH_TF_CAP", "6"))
+SEARCH_SNIPPET_CHARS      = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+TITLE_WEIGHT = 3
+MIN_TERM_LEN = 2
+MAX_TERM_LEN = 64   # = EntryTerm.term
+
+_TOKEN_RE = re.compile(r"\w+")
+_QUERY_RE = re.compile(r"(\w+)(\*?)")
+
+_STOPWORDS = frozenset("""
+a ad al allo ai agli all alla alle con col coi da dal dallo dai dagli dall dalla dalle di del dello dei
+degli dell della delle in nel nello nei negli nell nella nelle su sul sullo sui sugli sull sulla sulle
+per tra fra il lo la li gli le un uno una e ed o ma se che chi cui non mi ti si ci vi ne io tu lui lei
+noi voi loro mio mia miei mie tuo tua suo sua è era sono sei ho hai ha abbiamo avete hanno come anche
+più molto poi già
+an and are as at be but by for from has have he her his i if in is it its me my of on or our she so
+that the their them they this to was we were what when which who will with you your
+""".split())
+_STOPWORDS = frozenset(unicodedata.normalize("NFKD", w) for w in _STOPWORDS)
+
+
+def _fold(word: str) -> str:
+    # minuscolo + senza accenti ("Perché" → "perche"), stessa forma in indice e query
+    decomposed = unicodedata.normalize("NFKD", word.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))[:MAX_TERM_LEN]
+
+
+def _keep(term: str) -> bool:
+    return len(term) >= MIN_TERM_LEN and term not in _STOPWORDS
+
+
+def tokenize(text: str) -> list[str]:
+    out = []
+    for m in _TOKEN_RE.finditer(unicodedata.normalize("NFC", text or "")):
+        term = _fold(m.group())
+        if _keep(term):
+            out.append(term)
+    return out
+
+
+def entry_terms(title: str, content: str) -> Counter:
+    counts = Counter(tokenize(content))
+    for term in tokenize(title):
+        counts[term] += TITLE_WEIGHT
+    return counts
+
+
+def index_entries(db: Session, entries: list[Entry]) -> None:
+    """Aggiunge (nella transazione corrente) i termini delle entries all'indice."""
+    db.add_all([
+        EntryTerm(entry=e, user_id=e.user_id, term=term, tf=tf)
+        for e in entries
+        for term, tf in entry_terms(e.title, e.content).items()
+    ])
+
+
+def index_rows(db: Session, rows) -> None:
+    """Come index_entries, per righe già inserite (id, user_id, title, content): un solo executemany."""
+    params = [
+        {"user_id": r.user_id, "term": term, "entry_id": r.id, "tf": tf}
+        for r in rows
+        for term, tf in entry_terms(r.title, r.content).items()
+    ]
+    if params:
+        db.execute(insert(EntryTerm), params)
+
+
+def parse_query(q: str) -> list[tuple[str, bool]]:
+    """'ansia lavor*' → [("ansia", False), ("lavor", True)] (senza stopword e duplicati)."""
+    seen, out = set(), []
+    for m in _QUERY_RE.finditer(unicodedata.normalize("NFC", q)):
+        term, prefix = _fold(m.group(1)), bool(m.group(2))
+        if not _keep(term) and not (prefix and len(term) >= MIN_TERM_LEN):
+            continue
+        if (term, prefix) not in seen:
+            seen.add((term, prefix))
+            out.append((term, prefix))
+    return out[:SEARCH_MAX_TERMS]
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _expand(db: Session, username: str, parsed: list[tuple[str, bool]]) -> list[frozenset[str]] | None:
+    """Un gruppo di termini concreti per termine della query; None se un gruppo è vuoto."""
+    groups = []
+    for term, prefix in parsed:
+        if not prefix:
+            groups.append(frozenset([term]))
+            continue
+        expanded = db.scalars(
+            select(EntryTerm.term).distinct()
+            .where(EntryTerm.user_id == username, EntryTerm.term.like(_escape_like(term) + "%", escape="\\"))
+            .order_by(EntryTerm.term)
+            .limit(SEARCH_PREFIX_EXPANSIONS)
+        ).all()
+        if not expanded:
+            return None
+        groups.append(frozenset(expanded))
+    # "ansia ans*": il gruppo più largo è implicato da quello contenuto, basta il secondo
+    return list(dict.fromkeys(g for g in groups if not any(o < g for o in groups)))
+
+
+def _n_docs(db: Session, username: str) -> int:
+    # conteggio mantenuto da user_stats (lettura per PK); COUNT solo se la riga manca
+    n = db.scalar(select(UserStats.entries_count).where(UserStats.user_id == username))
+    if n is None:
+        n = db.scalar(select(func.count()).select_from(Entry).where(Entry.user_id == username)) or 0
+    return n
+
+
+def _weights(db: Session, username: str, terms: set[str]) -> dict[str, int]:
+    n_docs = _n_docs(db, username)
+    df = dict(db.execute(
+        select(EntryTerm.term, func.count())
+        .where(EntryTerm.user_id == username, EntryTerm.term.in_(terms))
+        .group_by(EntryTerm.term)
+    ).all())
+    out = {}
+    for t in terms:
+        d = df.get(t, 0)
+        idf = math.log(1 + (n_docs - d + 0.5) / (d + 0.5))
+        out[t] = max(1, round(idf * 1000))   # intero: score confrontabili esattamente nel cursore
+    return out
+
+
+def _marks(text: str, groups: list[frozenset[str]], prefixes: list[str]) -> list[tuple[int, int]]:
+    out = []
+    for m in _TOKEN_RE.finditer(text):
+        term = _fold(m.group())
+        if any(term in g for g in groups) or any(term.startswith(p) for p in prefixes):
+            out.append((m.start(), m.end()))
+    return out
+
+
+def _snippet(content: str, marks: list[tuple[int, int]]) -> tuple[str, list[tuple[int, int]]]:
+    width = SEARCH_SNIPPET_CHARS
+    if len(content) <= width:
+        return content, marks
+    start = 0
+    if marks:
+        # un po' di contesto prima del primo match, senza spezzare le parole
+        start = max(0, marks[0][0] - width // 4)
+        if start:
+            space = content.rfind(" ", 0, start)
+            start = space + 1 if space >= 0 and start - space < 20 else start
+    end = min(len(content), start + width)
+    if end < len(content):
+        space = content.rfind(" ", start, end)
+        end = space if space > start + width // 2 else end
+    prefix = "…" if start else ""
+    suffix = "…" if end < len(content) else ""
+    shift = len(prefix) - start
+    inside = [(s + shift, e + shift) for s, e in marks if s >= start and e <= end]
+    return prefix + content[start:end] + suffix, inside
+
+
+def search_plan(db: Session, username: str, parsed: list[tuple[str, bool]]) -> list[dict[str, int]] | None:
+    """Gruppi di termini concreti con il loro peso: [{termine: idf intero}, ...] (None: nessun risultato)."""
+    groups = _expand(db, username, parsed)
+    if not groups:
+        return None
+    weights = _weights(db, username, set().union(*groups))
+    return [{t: weights[t] for t in sorted(g)} for g in groups]
+
+
+def search_entries(db: Session, username: str, q: str, limit: int,
+                   after: tuple[int, int, list[dict[str, int]]] | None) -> dict:
+    """
+    Pagina di risultati ordinata per (score desc, id desc).
+    after = (score, id, piano) dall'ultimo next_cursor: il piano (search_plan)
+    è quello della prima pagina e non si ricalcola.
+    """
+    parsed = parse_query(q)
+    empty = {"count": 0, "items": [], "next_cursor": None}
+    if not parsed:
+        return empty
+    plan = after[2] if after is not None else search_plan(db, username, parsed)
+    if not plan:
+        return empty
+
+    groups = [frozenset(g) for g in plan]
+    terms = set().union(*groups)
+    weights = {t: w for g in plan for t, w in g.items()}
+    group_of = {}
+    for i, g in enumerate(plan):
+        for t in g:
+            group_of.setdefault(t, i)
+
+    tf = case((EntryTerm.tf > SEARCH_TF_CAP, SEARCH_TF_CAP), else_=EntryTerm.tf)
+    score = func.sum(tf * case(weights, value=EntryTerm.term, else_=0))
+    matched = func.count(case(group_of, value=EntryTerm.term).distinct())
+    stmt = (
+        select(EntryTerm.entry_id, score.label("score"))
+        .where(EntryTerm.user_id == username, EntryTerm.term.in_(terms))
+        .group_by(EntryTerm.entry_id)
+        .having(matched == len(groups))
+    )
+    if after is not None:
+        s, last_id, _ = after
+        stmt = stmt.having(or_(score < s, and_(score == s, EntryTerm.entry_id < last_id)))
+    rows = db.execute(stmt.order_by(score.desc(), EntryTerm.entry_id.desc()).limit(limit + 1)).all()
+    page = rows[:limit]
+
+    by_id = {e.id: e for e in db.scalars(select(Entry).where(Entry.id.in_([r.entry_id for r in page])))} if page else {}
+    prefixes = [t for t, p in parsed if p]
+    items = []
+    for r in page:
+        e = by_id.get(r.entry_id)
+        if e is None:       # cancellata tra le due query
+            continue
+        title = unicodedata.normalize("NFC", e.title)
+        content = unicodedata.normalize("NFC", e.content)
+        snippet, snippet_marks = _snippet(content, _marks(content, groups, prefixes))
+        items.append({
+            "entry": e,
+            "score": r.score / 1000,
+            "title_highlights": _marks(title, groups, prefixes),
+            "snippet": snippet,
+            "snippet_highlights": snippet_marks,
+        })
+    last = page[-1] if page else None
+    return {
+        "count": len(items),
+        "items": items,
+        "next_cursor": (int(last.score), last.entry_id, plan) if len(rows) > limit else None,
+    }
+
+
+# ---------------------------------------------------------------- CLI
+
+def reindex(db: Session, username: str | None = None, batch: int = 500) -> int:
+    """Ricostruisce l'indice a lotti per id (stessa logica di create_entry)."""
+    done, last_id = 0, 0
+    while True:
+        q = select(Entry).where(Entry.id > last_id)
+        if username:
+            q = q.where(Entry.user_id == username)
+        entries = db.scalars(q.order_by(Entry.id).limit(batch)).all()
+        if not entries:
+            return done
+        ids = [e.id for e in entries]
+        db.execute(delete(EntryTerm).where(EntryTerm.entry_id.in_(ids)).execution_options(synchronize_session=False))
+        index_entries(db, entries)
+        db.commit()
+        db.expunge_all()
+        done += len(entries)
+        last_id = ids[-1]
+
+
+def index_stats(db: Session) -> dict:
+    rows, terms, entries = db.execute(
+        select(func.count(), func.count(EntryTerm.term.distinct()), func.count(EntryTerm.entry_id.distinct()))
+    ).one()
+    return {"rows": rows, "distinct_terms": terms, "indexed_entries": entries,
+            "entries": db.scalar(select(func.count()).select_from(Entry))}
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.search", description="Indice di ricerca delle entries")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("reindex", help="ricostruisce l'indice (tutte le entries o di un utente)")
+    p.add_argument("--user")
+    p.add_argument("--batch", type=int, default=500)
+    sub.add_parser("stats", help="dimensione dell'indice")
+    args = ap.parse_args(argv)
+
+    with SessionLocal() as db:
+        if args.cmd == "reindex":
+            print(f"indicizzate {reindex(db, args.user, args.batch)} entries")
+        else:
+            for k, v in index_stats(db).items():
+                print(f"{k:>16}: {v}")
+
+
+if __name__ == "__main__":
+    main()
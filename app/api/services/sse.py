@@ -0,0 +1,83 @@
+# app/api/services/sse.py
+"""
+Relay SSE asincrono per le risposte in streaming del chatbot.
+
+Un task legge i pezzi di testo in una asyncio.Queue; il consumer li accorpa in
+frame "delta" (per dimensione o finestra temporale) e manda un "ping" solo se
+non è uscito nulla per HEARTBEAT_S. Il consumer si sveglia solo quando arriva
+un pezzo o scade un timer: niente thread per richiesta, niente polling.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator
+
+COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "64"))        # flush oltre questi caratteri
+COALESCE_MS    = float(os.getenv("SSE_COALESCE_MS", "40"))         # o dopo questa attesa dal primo pezzo
+HEARTBEAT_S    = float(os.getenv("SSE_HEARTBEAT_S", "15"))
+
+_END = object()
+
+
+def sse_event(name: str, data: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def relay(pieces: AsyncIterator[str], coalesce_chars: int = COALESCE_CHARS,
+                coalesce_ms: float = COALESCE_MS, heartbeat_s: float = HEARTBEAT_S) -> AsyncIterator[str]:
+    """Trasforma i pezzi di testo in frame SSE (delta/ping/error)."""
+    q: asyncio.Queue = asyncio.Queue(maxsize=512)
+
+    async def pump():
+        try:
+            async for piece in pieces:
+                if piece:
+                    await q.put(piece)
+            await q.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await q.put(e)
+
+    task = asyncio.create_task(pump())
+    buf: list[str] = []
+    buf_len = 0
+    buf_since = 0.0
+    last_sent = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if buf:
+                timeout = max(0.0, buf_since + coalesce_ms / 1000 - now)
+            else:
+                timeout = max(0.0, last_sent + heartbeat_s - now)
+            try:
+                item = await asyncio.wait_for(q.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if isinstance(item, str):
+                if not buf:
+                    buf_since = time.monotonic()
+                buf.append(item)
+                buf_len += len(item)
+                if buf_len < coalesce_chars:
+                    continue
+            elif item is None and not buf:
+                yield "event: ping\ndata: {}\n\n"
+                last_sent = time.monotonic()
+                continue
+
+            # flush: buffer pieno, finestra scaduta, fine stream o errore
+            if buf:
+                yield sse_event("delta", {"text": "".join(buf)})
+                buf, buf_len = [], 0
+                last_sent = time.monotonic()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                yield sse_event("error", {"detail": str(item)})
+                break
+    finally:
+        task.cancel()
@@ -0,0 +1,126 @@
+# app/api/services/stats.py
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import case, func, literal, select
+from sqlalchemy.orm import Session
+
+from app.db.models import Entry, UserSettings
+from app.db.sqlfuncs import as_date, shift_minutes
+
+DEFAULT_TZ = "Europe/Rome"
+GRANULARITIES = ("day", "week", "month")
+
+
+def user_tz(db: Session, username: str) -> ZoneInfo:
+    """Fuso dell'utente da UserSettings.tz_iana (fallback Europe/Rome)."""
+    tz_name = db.scalar(select(UserSettings.tz_iana).where(UserSettings.user_id == username))
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TZ)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TZ)
+
+
+def _offset_min(tz: ZoneInfo, at_utc: datetime) -> int:
+    return int(at_utc.replace(tzinfo=timezone.utc).astimezone(tz).utcoffset().total_seconds() // 60)
+
+
+def utc_offset_segments(tz: ZoneInfo, start_utc: datetime, end_utc: datetime) -> list[tuple[datetime | None, int]]:
+    """
+    Spezza [start_utc, end_utc) in tratti a offset costante.
+    Ritorna [(inizio_tratto_utc, offset_minuti), ...]; il primo inizio è None.
+    I datetime sono naive UTC, come Entry.created_at.
+    """
+    segments: list[tuple[datetime | None, int]] = [(None, _offset_min(tz, start_utc))]
+    cur = start_utc
+    while cur < end_utc:
+        nxt = min(cur + timedelta(days=1), end_utc)
+        if _offset_min(tz, nxt) != segments[-1][1]:
+            # ricerca binaria del cambio d'ora (precisione al minuto)
+            lo, hi = cur, nxt
+            while hi - lo > timedelta(minutes=1):
+                mid = lo + (hi - lo) / 2
+                if _offset_min(tz, mid) == segments[-1][1]:
+                    lo = mid
+                else:
+                    hi = mid
+            hi = hi.replace(second=0, microsecond=0)
+            segments.append((hi, _offset_min(tz, hi)))
+        cur = nxt
+    return segments
+
+
+def local_offset(tz: ZoneInfo, start_utc: datetime, end_utc: datetime):
+    """Offset (minuti) di Entry.created_at nel fuso tz, per righe in [start_utc, end_utc)."""
+    segments = utc_offset_segments(tz, start_utc, end_utc)
+    if len(segments) == 1:
+        return literal(segments[0][1])
+    # il CASE ha tanti rami quanti cambi d'ora nell'intervallo (~2 l'anno)
+    whens = [(Entry.created_at < segments[i + 1][0], segments[i][1]) for i in range(len(segments) - 1)]
+    return case(*whens, else_=segments[-1][1])
+
+
+def local_midnight_utc(d: date, tz: ZoneInfo) -> datetime:
+    return datetime.combine(d, time.min, tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _bucket_key(d: date, granularity: str) -> date:
+    if granularity == "week":
+        return d - timedelta(days=d.weekday())   # lunedì
+    if granularity == "month":
+        return d.replace(day=1)
+    return d
+
+
+def mood_timeseries(db: Session, username: str, granularity: str, date_from: date, date_to: date, tz: ZoneInfo) -> dict:
+    """
+    Aggrega conteggi e mood per giorno locale in SQL (un solo GROUP BY sull'indice
+    user_id/created_at) e poi accorpa i giorni in settimane/mesi.
+    date_from/date_to sono date locali, estremi inclusi.
+    """
+    start_utc = local_midnight_utc(date_from, tz)
+    end_utc = local_midnight_utc(date_to + timedelta(days=1), tz)
+
+    offset = local_offset(tz, start_utc, end_utc)
+
+    local = (
+        select(
+            as_date(shift_minutes(Entry.created_at, offset)).label("d"),
+            Entry.mood.label("mood"),
+        )
+        .where(
+            Entry.user_id == username,
+            Entry.created_at >= start_utc,
+            Entry.created_at < end_utc,
+        )
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            local.c.d,
+            func.count().label("n"),
+            func.count(local.c.mood).label("n_mood"),
+            func.sum(local.c.mood).label("mood_sum"),
+        )
+        .group_by(local.c.d)
+        .order_by(local.c.d)
+    ).all()
+
+    buckets: dict[date, list[int]] = {}
+    for d, n, n_mood, mood_sum in rows:
+        acc = buckets.setdefault(_bucket_key(d, granularity), [0, 0, 0])
+        acc[0] += n
+        acc[1] += n_mood
+        acc[2] += mood_sum or 0
+
+    keys = sorted(buckets)
+    return {
+        "granularity": granularity,
+        "tz": tz.key,
+        "from": date_from,
+        "to": date_to,
+        "buckets": keys,
+        "count": [buckets[k][0] for k in keys],
+        "mood_count": [buckets[k][1] for k in keys],
+        "mood_avg": [round(buckets[k][2] / buckets[k][1], 3) if buckets[k][1] else None for k in keys],
+    }
@@ -0,0 +1,194 @@
+# app/api/services/token_purge.py
+"""
+Pulizia della tabella refresh_tokens.
+
+Ogni login e ogni rotazione inseriscono una riga; qui si cancellano a lotti:
+- token scaduti da più di REFRESH_PURGE_GRACE_H ore;
+- token revocati (anelli già ruotati di una catena, logout) da più di
+  REFRESH_REVOKED_RETENTION_H ore.
+
+Gira in un thread del pod (REFRESH_PURGE=1) oppure da riga di comando:
+
+    python -m app.api.services.token_purge stats
+    python -m app.api.services.token_purge purge
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, delete, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.db import SessionLocal
+from app.db.models import RefreshToken
+
+REFRESH_PURGE               = os.getenv("REFRESH_PURGE", "1").strip().lower() in ("1", "true", "yes", "on")
+REFRESH_PURGE_BATCH         = int(os.getenv("REFRESH_PURGE_BATCH", "1000"))
+REFRESH_PURGE_INTERVAL_S    = float(os.getenv("REFRESH_PURGE_INTERVAL_S", "3600"))
+REFRESH_PURGE_GRACE_H       = float(os.getenv("REFRESH_PURGE_GRACE_H", "24"))
+REFRESH_REVOKED_RETENTION_H = float(os.getenv("REFRESH_REVOKED_RETENTION_H", "168"))   # 7 giorni
+REFRESH_PURGE_PAUSE_S       = 0.05   # pausa tra lotti: non monopolizzare log e lock
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _purgeable(now: datetime):
+    return or_(
+        RefreshToken.expires_at < now - timedelta(hours=REFRESH_PURGE_GRACE_H),
+        RefreshToken.revoked_at < now - timedelta(hours=REFRESH_REVOKED_RETENTION_H),
+    )
+
+
+def purge_once(db: Session, batch_size: int = REFRESH_PURGE_BATCH) -> int:
+    """Cancella un lotto; ritorna le righe cancellate."""
+    ids = db.scalars(
+        select(RefreshToken.id)
+        .where(_purgeable(_now()))
+        .limit(batch_size)
+        # più pod: ognuno prende righe diverse
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.rollback()
+        return 0
+    db.execute(delete(RefreshToken).where(RefreshToken.id.in_(ids)))
+    db.commit()
+    return len(ids)
+
+
+def table_stats(db: Session) -> dict:
+    now = _now()
+
+    def _n(cond):
+        # SUM(CASE ...) e non COUNT(...) FILTER: SQL Server non supporta FILTER
+        return func.coalesce(func.sum(case((cond, 1), else_=0)), 0)
+
+    total, active, expired, revoked = db.execute(
+        select(
+            func.count(RefreshToken.id),
+            _n(and_(RefreshToken.revoked_at.is_(None), RefreshToken.expires_at > now)),
+            _n(and_(RefreshToken.revoked_at.is_(None), RefreshToken.expires_at <= now)),
+            _n(RefreshToken.revoked_at.is_not(None)),
+        )
+    ).one()
+    return {"rows": total, "active": active, "expired": expired, "revoked": revoked}
+
+
+class TokenPurger:
+    def __init__(self, batch_size: int = REFRESH_PURGE_BATCH, interval: float = REFRESH_PURGE_INTERVAL_S,
+                 session_factory=SessionLocal):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.session_factory = session_factory
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.purged = 0
+        self.last_run_at: float | None = None
+        self.last_stats: dict = {}
+
+    def purge(self) -> int:
+        total = 0
+        while not self._stop.is_set():
+            with self.session_factory() as db:
+                n = purge_once(db, self.batch_size)
+            total += n
+            self.purged += n
+            if n < self.batch_size:
+                break
+            time.sleep(REFRESH_PURGE_PAUSE_S)
+        with self.session_factory() as db:
+            self.last_stats = table_stats(db)
+        self.last_run_at = time.time()
+        return total
+
+    # -- thread in background
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="refresh-token-purge", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                n = self.purge()
+                if n:
+                    logger.info("Purge refresh token: %d righe cancellate, %s", n, self.last_stats)
+            except Exception as e:
+                logger.warning("Purge refresh token fallito: %s", e)
+            self._stop.wait(self.interval)
+
+
+_purger = TokenPurger()
+
+
+def get_purger() -> TokenPurger:
+    return _purger
+
+
+def start_purger():
+    if REFRESH_PURGE:
+        _purger.start()
+
+
+def stop_purger(timeout: float = 5.0):
+    _purger.stop(timeout)
+
+
+def _register_metrics():
+    from opentelemetry import metrics
+    from opentelemetry.metrics import Observation
+
+    meter = metrics.get_meter("moodtrack.auth")
+    # dimensioni aggiornate ad ogni giro di purge (niente COUNT ad ogni export)
+    meter.create_observable_gauge(
+        "moodtrack.refresh_tokens.rows",
+        callbacks=[lambda _opts: [
+            Observation(v, {"state": k}) for k, v in _purger.last_stats.items() if k != "rows"
+        ]],
+        description="Righe della tabella refresh_tokens per stato",
+    )
+    meter.create_observable_counter(
+        "moodtrack.refresh_tokens.purged",
+        callbacks=[lambda _opts: [Observation(_purger.purged)]],
+        description="Refresh token cancellati dal purge",
+    )
+
+
+_register_metrics()
+
+
+# ---------------------------------------------------------------- CLI
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.token_purge", description="Pulizia refresh_tokens")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="righe totali, scadute, revocate")
+    sub.add_parser("purge", help="cancella a lotti scaduti e revocati e termina")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "stats":
+        with SessionLocal() as db:
+            print(table_stats(db))
+    elif args.cmd == "purge":
+        t0 = time.perf_counter()
+        p = TokenPurger()
+        n = p.purge()
+        print(f"cancellate {n} righe in {time.perf_counter() - t0:.2f}s; {p.last_stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# app/api/services/user_cache.py
+"""
+Cache read-through (TTL + LRU, per pod) dei metadati utente:
+
+- profilo + settings serializzati per GET /users/me;
+- thread_id dell'assistente per /chatbot.
+
+Il profilo è legato a users.data_version (vedi versioning): una voce di
+un'altra versione non vale, anche se scritta da un altro pod. Il thread_id
+invece si aggiorna nel pod corrente; gli altri lo vedono entro USER_CACHE_TTL.
+La creazione del thread è single-flight per utente (lock nel pod + UPDATE
+condizionale su DB tra pod), così messaggi concorrenti non creano thread doppi.
+"""
+import asyncio
+import os
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, joinedload
+
+from app.api.services.assistant import acreate_thread
+from app.core.cache import TTLCache
+from app.db import DbRunner
+from app.db.models import User
+from app.schemas.user import UserWithSettingsOut
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL  = float(os.getenv("USER_CACHE_TTL", "60"))     # secondi
+
+_profiles = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)   # username → (data_version, UserWithSettingsOut)
+_threads  = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)   # username → thread_id | None
+
+_thread_locks: dict[str, asyncio.Lock] = {}
+
+_MISSING = object()
+
+
+def _load_profile(db: Session, username: str) -> UserWithSettingsOut | None:
+    user = (
+        db.query(User)
+        .options(joinedload(User.settings))
+        .filter(User.username == username)
+        .first()
+    )
+    # si serializza dentro la sessione: in cache mai oggetti ORM detached
+    return UserWithSettingsOut.model_validate(user, from_attributes=True) if user else None
+
+
+def _load_thread_id(db: Session, username: str):
+    row = db.execute(select(User.thread_id).where(User.username == username)).first()
+    return _MISSING if row is None else row.thread_id
+
+
+def _claim_thread_id(db: Session, username: str, thread_id: str) -> str:
+    """Salva il thread solo se l'utente non ne ha già uno; ritorna quello valido."""
+    res = db.execute(
+        update(User)
+        .where(User.username == username, User.thread_id.is_(None))
+        .values(thread_id=thread_id)
+    )
+    db.commit()
+    if res.rowcount:
+        return thread_id
+    # un altro pod è arrivato prima: vale il suo
+    return db.scalar(select(User.thread_id).where(User.username == username))
+
+
+async def get_profile(db: DbRunner, username: str, version: int | None = None) -> UserWithSettingsOut | None:
+    """
+    Profilo dalla cache. Con version (users.data_version già letta dal chiamante)
+    la voce vale solo se è della stessa versione: coerente anche tra pod.
+    """
+    item = _profiles.get(username)
+    if item is not None and (version is None or item[0] == version):
+        return item[1]
+    profile = await db.run(_load_profile, username)
+    if profile is not None:
+        _profiles.set(username, (version, profile))
+    return profile
+
+
+async def get_thread_id(db: DbRunner, username: str) -> str | None:
+    """thread_id (None se non ancora creato). LookupError se l'utente non esiste."""
+    thread_id = _threads.get(username, _MISSING)
+    if thread_id is _MISSING:
+        thread_id = await db.run(_load_thread_id, username)
+        if thread_id is _MISSING:
+            raise LookupError(username)
+        _threads.set(username, thread_id)
+    return thread_id
+
+
+async def get_or_create_thread_id(db: DbRunner, username: str) -> str | None:
+    """thread_id dell'utente, creandolo al primo messaggio. None se l'utente non esiste."""
+    try:
+        thread_id = await get_thread_id(db, username)
+    except LookupError:
+        return None
+    if thread_id:
+        return thread_id
+
+    lock = _thread_locks.setdefault(username, asyncio.Lock())
+    try:
+        async with lock:
+            # chi aspettava il lock trova il thread già creato dal primo
+            thread_id = _threads.get(username)
+            if thread_id:
+                return thread_id
+            thread_id = await db.run(_claim_thread_id, username, await acreate_thread())
+            _threads.set(username, thread_id)
+            return thread_id
+    finally:
+        if not lock.locked():
+            _thread_locks.pop(username, None)
+
+
+def invalidate_user(username: str) -> None:
+    _profiles.invalidate(username)
+    _threads.invalidate(username)
+
+
+def cache_stats() -> dict:
+    return {"profiles": _profiles.stats(), "threads": _threads.stats()}
@@ -0,0 +1,373 @@
+# app/api/services/user_stats.py
+"""
+Statistiche del diario per utente (GET /users/me/stats), mantenute in una
+riga di user_stats invece di ricalcolarle a ogni apertura della dashboard.
+
+Aggiornamento incrementale, nella stessa transazione della scrittura e dopo
+bump_version (la riga utente è bloccata: niente aggiornamenti persi):
+- nuova entry (record_entries): conteggi, giorno della settimana, streak
+  (il giorno locale è uguale, successivo o dopo un buco rispetto all'ultimo)
+  e, se ha un mood, istogramma e somme del giorno;
+- mood cambiato dal sentiment (record_mood_changes): serve il mood
+  precedente, letto dopo il lock e prima dell'UPDATE (altrimenti due
+  consegne sovrapposte vedono lo stesso mood e contano il cambio due volte);
+- delete (record_deletion): si sottraggono conteggi, istogramma e somme del
+  giorno; streak e prima/ultima data cambiano solo se il giorno resta vuoto
+  (una query sull'indice user_id/created_at lo dice);
+- i casi che non si aggiornano in O(1) ricalcolano l'utente (rebuild_user):
+  entries con una data locale precedente all'ultima, delete dell'ultima entry
+  di un giorno, cambio di fuso. L'import di storico ricalcola una volta alla
+  fine (journal_io).
+
+Le medie mobili 7/30 giorni vengono da daily_moods, gli ultimi 30 giorni
+locali fino a last_entry_date; streak corrente e finestre si riferiscono
+a "oggi" solo in lettura (stats_view).
+
+Backfill e correzione di eventuali derive:
+
+    python -m app.api.services.user_stats rebuild [--user mario] [--batch 200]
+    python -m app.api.services.user_stats check [--user mario]
+"""
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.api.services.stats import DEFAULT_TZ, local_midnight_utc, local_offset, user_tz
+from app.db.models import Entry, User, UserStats
+from app.db.sqlfuncs import as_date, shift_minutes
+
+RING_DAYS = 30
+WINDOWS = (7, 30)
+MOODS = 6   # 0..5
+
+
+def _tz(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TZ)
+
+
+def _local_date(at_utc: datetime, tz: ZoneInfo) -> date:
+    return at_utc.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+
+def _bucket(mood) -> int:
+    # come score_to_mood (schemas/internal.py) e la colonna INT: un punteggio decimale si tronca
+    return min(MOODS - 1, max(0, int(mood)))
+
+
+def _empty(username: str, tz: str) -> UserStats:
+    return UserStats(
+        user_id=username, tz=tz, entries_count=0, mood_count=0, mood_sum=0,
+        mood_hist=[0] * MOODS, weekday_counts=[0] * 7, daily_moods=[[0, 0] for _ in range(RING_DAYS)],
+        first_entry_date=None, last_entry_date=None, current_streak=0, longest_streak=0,
+    )
+
+
+# ---------------------------------------------------------------- ricalcolo
+
+def _compute(db: Session, username: str, tz: ZoneInfo) -> UserStats:
+    """Tutte le statistiche da zero: due GROUP BY sulle entries dell'utente."""
+    st = _empty(username, tz.key)
+    lo, hi = db.execute(
+        select(func.min(Entry.created_at), func.max(Entry.created_at)).where(Entry.user_id == username)
+    ).one()
+    if lo is None:
+        return st
+
+    offset = local_offset(tz, lo, hi + timedelta(seconds=1))
+    local = (
+        select(as_date(shift_minutes(Entry.created_at, offset)).label("d"), Entry.mood.label("mood"))
+        .where(Entry.user_id == username)
+        .subquery()
+    )
+    days = db.execute(
+        select(local.c.d, func.count(), func.count(local.c.mood), func.sum(local.c.mood))
+        .group_by(local.c.d)
+        .order_by(local.c.d)
+    ).all()
+    hist = db.execute(
+        select(Entry.mood, func.count()).where(Entry.user_id == username, Entry.mood.is_not(None)).group_by(Entry.mood)
+    ).all()
+
+    mood_hist = [0] * MOODS
+    for mood, n in hist:
+        mood_hist[_bucket(mood)] += n
+    weekday = [0] * 7
+    ring = [[0, 0] for _ in range(RING_DAYS)]
+    last = days[-1][0]
+    run = longest = 0
+    prev = None
+    for d, n, n_mood, mood_sum in days:
+        weekday[d.weekday()] += n
+        run = run + 1 if prev is not None and d == prev + timedelta(days=1) else 1
+        longest = max(longest, run)
+        prev = d
+        age = (last - d).days
+        if age < RING_DAYS:
+            ring[RING_DAYS - 1 - age] = [n_mood, int(mood_sum or 0)]
+
+    st.entries_count = sum(r[1] for r in days)
+    st.mood_count = sum(r[2] for r in days)
+    st.mood_sum = sum(int(r[3] or 0) for r in days)
+    st.mood_hist, st.weekday_counts, st.daily_moods = mood_hist, weekday, ring
+    st.first_entry_date, st.last_entry_date = days[0][0], last
+    st.current_streak, st.longest_streak = run, longest
+    return st
+
+
+def lock_user(db: Session, username: str) -> None:
+    # stessa riga bloccata da bump_version: serializza con le scritture dell'utente
+    db.execute(select(User.username).where(User.username == username).with_for_update())
+
+
+def rebuild_user(db: Session, username: str, tz: ZoneInfo | None = None) -> UserStats:
+    """Ricalcola e salva (senza commit) la riga dell'utente."""
+    fresh = _compute(db, username, tz or user_tz(db, username))
+    fresh.rebuilt_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    return db.merge(fresh)
+
+
+def _get(db: Session, username: str) -> tuple[UserStats, bool]:
+    """(riga, appena ricalcolata): il ricalcolo conta già le scritture della transazione."""
+    st = db.get(UserStats, username)
+    return (st, False) if st is not None else (rebuild_user(db, username), True)
+
+
+# ---------------------------------------------------------------- incrementale
+
+def _ring_shift(st: UserStats, d: date) -> None:
+    """Porta la finestra daily_moods a finire in d (d > last_entry_date)."""
+    k = min((d - st.last_entry_date).days, RING_DAYS)
+    st.daily_moods = st.daily_moods[k:] + [[0, 0] for _ in range(k)]
+
+
+def _ring_add(st: UserStats, d: date, n_mood: int, mood_sum: int) -> None:
+    age = (st.last_entry_date - d).days
+    if 0 <= age < RING_DAYS:
+        ring = [list(x) for x in st.daily_moods]   # lista nuova: il tipo JSON non traccia le modifiche in place
+        ring[RING_DAYS - 1 - age][0] += n_mood
+        ring[RING_DAYS - 1 - age][1] += mood_sum
+        st.daily_moods = ring
+
+
+def record_entries(db: Session, username: str, items: list[tuple[datetime, int | None]]) -> None:
+    """
+    Nuove entries (created_at UTC naive, mood) già scritte nella transazione.
+    O(1) per entry; un giorno locale precedente all'ultimo richiede il ricalcolo.
+    """
+    if not items:
+        return
+    st, rebuilt = _get(db, username)
+    if rebuilt:
+        return
+    tz = _tz(st.tz)
+    dated = sorted(((_local_date(at, tz), mood) for at, mood in items), key=lambda x: x[0])
+    if st.last_entry_date is not None and dated[0][0] < st.last_entry_date:
+        rebuild_user(db, username, tz)
+        return
+
+    hist, weekday = list(st.mood_hist), list(st.weekday_counts)
+    for d, mood in dated:
+        if st.last_entry_date is None:
+            st.first_entry_date, st.last_entry_date, st.current_streak = d, d, 1
+        elif d > st.last_entry_date:
+            st.current_streak = st.current_streak + 1 if d == st.last_entry_date + timedelta(days=1) else 1
+            _ring_shift(st, d)
+            st.last_entry_date = d
+        st.longest_streak = max(st.longest_streak, st.current_streak)
+        st.entries_count += 1
+        weekday[d.weekday()] += 1
+        if mood is not None:
+            st.mood_count += 1
+            st.mood_sum += int(mood)
+            hist[_bucket(mood)] += 1
+            _ring_add(st, d, 1, int(mood))
+    st.mood_hist, st.weekday_counts = hist, weekday
+
+
+def record_mood_changes(db: Session, changes: list[tuple[str, datetime, int | None, int | None]]) -> None:
+    """(user_id, created_at, mood precedente, mood nuovo) per entry, dopo l'UPDATE del mood."""
+    by_user: dict[str, list] = {}
+    for user_id, at, old, new in changes:
+        by_user.setdefault(user_id, []).append((at, old, new))
+    for user_id in sorted(by_user):
+        st, rebuilt = _get(db, user_id)
+        if rebuilt:
+            continue
+        tz = _tz(st.tz)
+        hist = list(st.mood_hist)
+        for at, old, new in by_user[user_id]:
+            old = None if old is None else int(old)
+            new = None if new is None else int(new)
+            if old == new:
+                continue
+            d = _local_date(at, tz)
+            if old is not None:
+                st.mood_count -= 1
+                st.mood_sum -= old
+                hist[_bucket(old)] -= 1
+                _ring_add(st, d, -1, -old)
+            if new is not None:
+                st.mood_count += 1
+                st.mood_sum += new
+                hist[_bucket(new)] += 1
+                _ring_add(st, d, 1, new)
+        st.mood_hist = hist
+
+
+def record_deletion(db: Session, username: str, created_at: datetime, mood: int | None) -> None:
+    """Entry cancellata (created_at, mood letti prima della DELETE), dopo la DELETE."""
+    st, rebuilt = _get(db, username)
+    if rebuilt:
+        return
+    tz = _tz(st.tz)
+    d = _local_date(created_at, tz)
+    same_day = db.scalar(
+        select(Entry.id).where(
+            Entry.user_id == username,
+            Entry.created_at >= local_midnight_utc(d, tz),
+            Entry.created_at < local_midnight_utc(d + timedelta(days=1), tz),
+        ).limit(1)
+    )
+    if same_day is None:
+        # giorno rimasto vuoto: streak e prima/ultima data vanno ricalcolate
+        rebuild_user(db, username, tz)
+        return
+    st.entries_count -= 1
+    weekday = list(st.weekday_counts)
+    weekday[d.weekday()] -= 1
+    st.weekday_counts = weekday
+    if mood is not None:
+        hist = list(st.mood_hist)
+        hist[_bucket(mood)] -= 1
+        st.mood_hist = hist
+        st.mood_count -= 1
+        st.mood_sum -= int(mood)
+        _ring_add(st, d, -1, -int(mood))
+
+
+def tz_changed(db: Session, username: str, tz_name: str) -> None:
+    """Dopo un cambio di UserSettings.tz_iana: i giorni locali vanno ricalcolati."""
+    st = db.get(UserStats, username)
+    if st is not None and st.tz != _tz(tz_name).key:
+        rebuild_user(db, username, _tz(tz_name))
+
+
+# ---------------------------------------------------------------- lettura
+
+def _avg(n: int, total: int) -> float | None:
+    return round(total / n, 3) if n else None
+
+
+def stats_view(st: UserStats, now_utc: datetime | None = None) -> dict:
+    """Valori per la risposta, riferiti al giorno locale corrente."""
+    tz = _tz(st.tz)
+    today = (now_utc or datetime.now(timezone.utc)).astimezone(tz).date()
+    last = st.last_entry_date
+    out = {
+        "tz": tz.key,
+        "entries": st.entries_count,
+        "mood_count": st.mood_count,
+        "mood_avg": _avg(st.mood_count, st.mood_sum),
+        "mood_histogram": list(st.mood_hist),
+        "weekday_counts": list(st.weekday_counts),
+        "first_entry_date": st.first_entry_date,
+        "last_entry_date": last,
+        # la streak resta "in corso" finché oggi non è finito
+        "current_streak": st.current_streak if last is not None and (today - last).days <= 1 else 0,
+        "longest_streak": st.longest_streak,
+        "updated_at": st.updated_at,
+    }
+    for w in WINDOWS:
+        n = total = 0
+        if last is not None:
+            for i, (n_mood, mood_sum) in enumerate(st.daily_moods):
+                age = (today - (last - timedelta(days=RING_DAYS - 1 - i))).days
+                if 0 <= age < w:
+                    n += n_mood
+                    total += mood_sum
+        out[f"mood_avg_{w}d"] = _avg(n, total)
+    return out
+
+
+def get_stats(db: Session, username: str) -> dict:
+    """Una lettura per PK; la prima volta (o dopo una migrazione) calcola e salva la riga."""
+    st = db.get(UserStats, username)
+    if st is None:
+        lock_user(db, username)
+        st = db.get(UserStats, username, populate_existing=True) or rebuild_user(db, username)
+        db.commit()
+    return stats_view(st)
+
+
+# ---------------------------------------------------------------- CLI
+
+def rebuild(db: Session, username: str | None = None, batch: int = 200) -> int:
+    """Ricalcola gli utenti indicati (o tutti, a blocchi per username): una transazione per utente."""
+    done, last = 0, ""
+    while True:
+        names = [username] if username else db.scalars(
+            select(User.username).where(User.username > last).order_by(User.username).limit(batch)
+        ).all()
+        for name in names:
+            lock_user(db, name)
+            rebuild_user(db, name)
+            db.commit()
+            done += 1
+        db.expunge_all()
+        if username or len(names) < batch:
+            return done
+        last = names[-1]
+
+
+_COMPARED = ("entries_count", "mood_count", "mood_sum", "mood_hist", "weekday_counts", "daily_moods",
+             "first_entry_date", "last_entry_date", "current_streak", "longest_streak")
+
+
+def check(db: Session, username: str | None = None, batch: int = 200) -> list[tuple[str, list[str]]]:
+    """Confronta le righe salvate con un ricalcolo (senza scrivere): [(utente, campi diversi)]."""
+    drift, last = [], ""
+    while True:
+        q = select(UserStats)
+        q = q.where(UserStats.user_id == username) if username else q.where(UserStats.user_id > last)
+        rows = db.scalars(q.order_by(UserStats.user_id).limit(batch)).all()
+        for st in rows:
+            fresh = _compute(db, st.user_id, _tz(st.tz))
+            diff = [f for f in _COMPARED if getattr(st, f) != getattr(fresh, f)]
+            if diff:
+                drift.append((st.user_id, diff))
+        db.expunge_all()
+        if username or len(rows) < batch:
+            return drift
+        last = rows[-1].user_id
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.user_stats", description="Statistiche per utente")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name, help_ in (("rebuild", "ricalcola user_stats (backfill o correzione)"),
+                        ("check", "confronta user_stats con un ricalcolo")):
+        p = sub.add_parser(name, help=help_)
+        p.add_argument("--user")
+        p.add_argument("--batch", type=int, default=200)
+    args = ap.parse_args(argv)
+
+    with SessionLocal() as db:
+        if args.cmd == "rebuild":
+            print(f"ricalcolati {rebuild(db, args.user, args.batch)} utenti")
+        else:
+            drift = check(db, args.user, args.batch)
+            for user_id, fields in drift:
+                print(f"{user_id}: {', '.join(fields)}")
+            print(f"{len(drift)} utenti con statistiche diverse dal ricalcolo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# app/api/services/versioning.py
+"""
+Versione per utente (users.data_version) ed ETag delle GET.
+
+Ogni scrittura su entries/settings incrementa la versione nella stessa
+transazione; le GET leggono solo la versione (lookup per PK) e, se l'ETag
+del client corrisponde, rispondono 304 senza eseguire altre query.
+"""
+import hashlib
+
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.db.models import Entry, User
+
+
+def bump_version(db: Session, username: str) -> int | None:
+    """
+    Incrementa la versione (nella transazione corrente, niente commit) e la
+    ritorna: è il change_seq da scrivere sulle entry toccate. Il lock sulla
+    riga dell'utente fino al commit ordina le scritture dello stesso utente.
+    """
+    return db.scalar(
+        update(User).where(User.username == username)
+        .values(data_version=User.data_version + 1)
+        .returning(User.data_version)
+    )
+
+
+def bump_versions(db: Session, usernames: list[str]) -> None:
+    """Come bump_version per più utenti, con un solo UPDATE (niente commit)."""
+    if usernames:
+        db.execute(
+            update(User).where(User.username.in_(usernames)).values(data_version=User.data_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def bump_versions_for_entries(db: Session, entry_ids: list[int]) -> None:
+    """
+    Incrementa la versione dei proprietari delle entry indicate (un solo
+    UPDATE) e la copia nel change_seq delle entry (un secondo UPDATE).
+    """
+    owners = select(Entry.user_id).where(Entry.id.in_(entry_ids))
+    db.execute(
+        update(User).where(User.username.in_(owners)).values(data_version=User.data_version + 1)
+    )
+    owner_version = select(User.data_version).where(User.username == Entry.user_id).scalar_subquery()
+    db.execute(
+        update(Entry).where(Entry.id.in_(entry_ids)).values(change_seq=owner_version)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def current_version(db: Session, username: str) -> int | None:
+    return db.scalar(select(User.data_version).where(User.username == username))
+
+
+def make_etag(kind: str, username: str, version: int, *params) -> str:
+    # parametri della richiesta nell'hash: pagine diverse → ETag diversi
+    raw = "|".join([kind, username, str(version), *map(str, params)])
+    return 'W/"%s"' % hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """Response 304 se If-None-Match contiene l'ETag (confronto debole), altrimenti None."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    wanted = _strip_weak(etag)
+    if header.strip() == "*" or any(_strip_weak(t) == wanted for t in header.split(",")):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+
+def etag_headers(etag: str) -> dict:
+    # private: risposte per utente; no-cache: il client rivalida sempre
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
@@ -0,0 +1,167 @@
+# app/api/services/warmup.py
+"""
+Warm-up del processo API, in background dopo lo startup: uvicorn accetta
+subito connessioni (liveness ok) e la readiness resta 503 finché i passi
+obbligatori non sono pronti.
+
+Passi (in parallelo tra loro):
+- db:       apre WARMUP_DB_CONNECTIONS connessioni del pool in contemporanea
+            (riprova con backoff se il DB non risponde; obbligatorio);
+- flags:    primo caricamento dei feature flag e log dello stato;
+- password: avvia i processi del pool bcrypt;
+- openai:   import dell'SDK e creazione dei client Azure OpenAI.
+
+WARMUP=0 salta tutto e dichiara subito il processo pronto.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from app.obs.startup import report
+
+logger = logging.getLogger("uvicorn.error")
+
+WARMUP = os.getenv("WARMUP", "1").strip().lower() in ("1", "true", "yes", "on")
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "4"))
+WARMUP_DB_RETRY_MAX_S = float(os.getenv("WARMUP_DB_RETRY_MAX_S", "30"))
+_REQUIRED = ("db",)
+
+_state: dict[str, dict] = {}
+_task: asyncio.Task | None = None
+
+
+def _pool_target(engine) -> int:
+    # non oltre la capienza del pool: le connessioni in più verrebbero chiuse subito
+    pool = engine.pool
+    size = pool.size() if hasattr(pool, "size") else WARMUP_DB_CONNECTIONS
+    return max(1, min(WARMUP_DB_CONNECTIONS, size))
+
+
+async def _open_async(engine):
+    from sqlalchemy import text
+
+    async def one():
+        conn = await engine.connect()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    conns = await asyncio.gather(*(one() for _ in range(_pool_target(engine))), return_exceptions=True)
+    for c in conns:
+        if not isinstance(c, BaseException):
+            await c.close()      # torna nel pool, resta aperta
+    for c in conns:
+        if isinstance(c, BaseException):
+            raise c
+    return len(conns)
+
+
+def _open_sync_one(engine):
+    from sqlalchemy import text
+
+    conn = engine.connect()
+    conn.execute(text("SELECT 1"))
+    return conn
+
+
+async def _open_sync(engine):
+    conns = await asyncio.gather(
+        *(asyncio.to_thread(_open_sync_one, engine) for _ in range(_pool_target(engine))),
+        return_exceptions=True,
+    )
+    for c in conns:
+        if not isinstance(c, BaseException):
+            c.close()
+    for c in conns:
+        if isinstance(c, BaseException):
+            raise c
+    return len(conns)
+
+
+async def _warm_db():
+    from app.db.models import DB_ASYNC, async_engine, engine
+
+    delay = 0.5
+    while True:
+        try:
+            # il pool sync serve le route interne e i worker: qualche connessione anche lì
+            opened = await asyncio.gather(_open_sync(engine), *([_open_async(async_engine)] if DB_ASYNC else []))
+            return {"connections": sum(opened)}
+        except Exception as e:
+            logger.warning("Warm-up DB fallito (%r), nuovo tentativo tra %.1fs", e, delay)
+            _state["db"]["error"] = repr(e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_DB_RETRY_MAX_S)
+
+
+def _warm_flags():
+    from app.core.feature_flags import refresh_now, snapshot
+
+    refresh_now()
+    for k, v in snapshot()["flags"].items():
+        logger.info("Feature flag: %s = %s", k, v)
+
+
+def _warm_password_pool():
+    from app.core.password_pool import get_password_pool
+
+    get_password_pool().warm_up()
+
+
+def _warm_openai():
+    from app.api.services import assistant
+
+    assistant.get_client()
+    assistant.get_aclient()
+
+
+async def _step(name: str, coro):
+    _state[name] = {"status": "running"}
+    t0 = time.perf_counter()
+    try:
+        info = await coro
+    except Exception as e:
+        ms = (time.perf_counter() - t0) * 1000
+        _state[name] = {"status": "failed", "ms": round(ms, 1), "error": repr(e)}
+        report.record(name, "warmup", ms, "failed", repr(e))
+        logger.exception("Warm-up %s fallito", name)
+        return
+    ms = (time.perf_counter() - t0) * 1000
+    _state[name] = {"status": "ok", "ms": round(ms, 1), **(info or {})}
+    report.record(name, "warmup", ms)
+
+
+async def run_warmup():
+    await asyncio.gather(
+        _step("db", _warm_db()),
+        _step("flags", asyncio.to_thread(_warm_flags)),
+        _step("password", asyncio.to_thread(_warm_password_pool)),
+        _step("openai", asyncio.to_thread(_warm_openai)),
+    )
+    report.log()
+
+
+def start_warmup():
+    """Da chiamare nello startup (serve un event loop attivo)."""
+    global _task
+    if not WARMUP:
+        return
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(run_warmup(), name="warmup")
+
+
+async def stop_warmup():
+    if _task is not None and not _task.done():
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+
+def warmup_state() -> dict:
+    """{"ready": bool, "steps": {...}} per la readiness."""
+    if not WARMUP:
+        return {"ready": True, "steps": {}}
+    ready = all(_state.get(n, {}).get("status") == "ok" for n in _REQUIRED)
+    return {"ready": ready, "steps": dict(_state)}
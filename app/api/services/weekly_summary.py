@@ -0,0 +1,413 @@
+# app/api/services/weekly_summary.py
+"""
+Riepilogo settimanale via email per gli utenti con email_opt_in.
+
+Gira fuori dai pod dell'API (CronJob o processo dedicato), a ogni giro:
+
+1. utenti "dovuti": per ogni fuso presente in user_settings si calcola
+   l'istante d'invio di questa settimana (weekly_summary_day, 0 = lunedì,
+   alle WEEKLY_SEND_HOUR locali) e si cercano, con l'indice
+   ix_user_settings_weekly_due, gli utenti di quel (fuso, giorno) con
+   weekly_last_sent_at_utc precedente;
+2. a blocchi di WEEKLY_CHUNK: claim con un UPDATE bulk di
+   weekly_last_sent_at_utc (solo chi è ancora dovuto: due worker non
+   mandano la stessa email), statistiche della settimana con due GROUP BY
+   sul blocco, rendering nel process pool, consegna al sink; chi fallisce
+   torna al valore precedente e riprova al giro dopo.
+
+Sink (WEEKLY_SINK): "file:<dir>" (un .eml per messaggio, default),
+"smtp://host:port", "log", oppure "modulo:factory" per uno custom.
+
+    python -m app.api.services.weekly_summary due
+    python -m app.api.services.weekly_summary run [--dry-run] [--now 2025-01-06T08:30:00Z]
+    python -m app.api.services.weekly_summary loop
+"""
+import argparse
+import importlib
+import logging
+import os
+import smtplib
+import threading
+import time as _time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+from email.message import EmailMessage
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.api.services.stats import DEFAULT_TZ, local_midnight_utc, local_offset
+from app.api.services.versioning import bump_versions
+from app.db.models import Entry, User, UserSettings
+from app.db.sqlfuncs import as_date, shift_minutes
+
+WEEKLY_SEND_HOUR     = int(os.getenv("WEEKLY_SEND_HOUR", "8"))          # ora locale d'invio
+WEEKLY_CATCHUP_H     = float(os.getenv("WEEKLY_CATCHUP_H", "36"))       # invio in ritardo ammesso
+WEEKLY_CHUNK         = int(os.getenv("WEEKLY_CHUNK", "1000"))           # utenti per blocco
+WEEKLY_RENDER_PROCS  = int(os.getenv("WEEKLY_RENDER_PROCS", str(min(4, os.cpu_count() or 1))))
+WEEKLY_SINK          = os.getenv("WEEKLY_SINK", "file:./weekly_out")
+WEEKLY_FROM          = os.getenv("WEEKLY_FROM", "MoodTrack <no-reply@moodtrack.app>")
+WEEKLY_INTERVAL_S    = float(os.getenv("WEEKLY_INTERVAL_S", "900"))     # modalità loop
+
+logger = logging.getLogger("uvicorn.error")
+
+_WEEKDAYS = ("lunedì", "martedì", "mercoledì", "giovedì", "venerdì", "sabato", "domenica")
+
+
+def _zone(name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TZ)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TZ)
+
+
+def _naive_utc(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------------------------------------------------------- chi è dovuto
+
+def due_slots(now_utc: datetime, tz_names: list[str | None]) -> list[dict]:
+    """
+    Un elemento per (fuso, giorno) con un invio aperto adesso:
+    istante d'invio e settimana riepilogata [7 giorni locali prima del giorno d'invio).
+    """
+    slots = []
+    for name in tz_names:
+        tz = _zone(name)
+        local_now = now_utc.astimezone(tz)
+        for back in range(int(WEEKLY_CATCHUP_H // 24) + 2):
+            send_date = local_now.date() - timedelta(days=back)
+            due_local = datetime.combine(send_date, time(WEEKLY_SEND_HOUR), tzinfo=tz)
+            if due_local > local_now or local_now - due_local > timedelta(hours=WEEKLY_CATCHUP_H):
+                continue
+            slots.append({
+                "tz_name": name, "tz": tz.key, "day": send_date.weekday(), "send_date": send_date,
+                "due_utc": _naive_utc(due_local),
+                "period_start_utc": local_midnight_utc(send_date - timedelta(days=7), tz),
+                "period_end_utc": local_midnight_utc(send_date, tz),
+            })
+    return slots
+
+
+def _opted_in():
+    return and_(UserSettings.email_opt_in.is_(True), UserSettings.weekly_summary_day.is_not(None))
+
+
+def _due_filter(slot: dict):
+    tz_cond = UserSettings.tz_iana.is_(None) if slot["tz_name"] is None else UserSettings.tz_iana == slot["tz_name"]
+    return and_(
+        _opted_in(), tz_cond,
+        UserSettings.weekly_summary_day == slot["day"],
+        or_(UserSettings.weekly_last_sent_at_utc.is_(None), UserSettings.weekly_last_sent_at_utc < slot["due_utc"]),
+    )
+
+
+def due_user_chunks(db: Session, slot: dict, chunk: int = WEEKLY_CHUNK):
+    """Id degli utenti dovuti per lo slot, a blocchi (keyset su user_id)."""
+    last = ""
+    while True:
+        ids = db.scalars(
+            select(UserSettings.user_id)
+            .where(_due_filter(slot), UserSettings.user_id > last)
+            .order_by(UserSettings.user_id)
+            .limit(chunk)
+        ).all()
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def _claim(db: Session, slot: dict, user_ids: list[str], now: datetime) -> dict[str, datetime | None]:
+    """Segna il blocco come inviato (solo chi è ancora dovuto); ritorna {user_id: valore precedente}."""
+    previous = dict(db.execute(
+        select(UserSettings.user_id, UserSettings.weekly_last_sent_at_utc)
+        .where(UserSettings.user_id.in_(user_ids), _due_filter(slot))
+        .with_for_update(skip_locked=True)
+    ).all())
+    if previous:
+        db.execute(
+            update(UserSettings)
+            .where(UserSettings.user_id.in_(list(previous)), _due_filter(slot))
+            .values(weekly_last_sent_at_utc=now)
+            .execution_options(synchronize_session=False)
+        )
+        # weekly_last_sent_at_utc è nel profilo (GET /users/me): ETag e user_cache seguono data_version
+        bump_versions(db, list(previous))
+    db.commit()
+    return previous
+
+
+def _release(db: Session, previous: dict[str, datetime | None], failed: list[str], now: datetime):
+    """Rimette dovuti gli utenti la cui consegna è fallita (raggruppati per valore precedente)."""
+    by_value: dict[datetime | None, list[str]] = {}
+    for uid in failed:
+        by_value.setdefault(previous[uid], []).append(uid)
+    for value, uids in by_value.items():
+        db.execute(
+            update(UserSettings)
+            .where(UserSettings.user_id.in_(uids), UserSettings.weekly_last_sent_at_utc == now)
+            .values(weekly_last_sent_at_utc=value)
+            .execution_options(synchronize_session=False)
+        )
+    bump_versions(db, failed)
+    db.commit()
+
+
+# ---------------------------------------------------------------- statistiche (set-based)
+
+def weekly_stats(db: Session, slot: dict, user_ids: list[str]) -> dict[str, dict]:
+    """Statistiche della settimana e di quella prima per un blocco di utenti (stesso fuso)."""
+    start, end = slot["period_start_utc"], slot["period_end_utc"]
+    prev_start = start - timedelta(days=7)
+    in_week = Entry.created_at >= start
+
+    def _count_if(cond, expr=None):
+        return func.sum(case((cond, 1 if expr is None else expr), else_=0))
+
+    totals = db.execute(
+        select(
+            Entry.user_id,
+            _count_if(in_week).label("n"),
+            _count_if(and_(in_week, Entry.mood.is_not(None))).label("n_mood"),
+            _count_if(in_week, func.coalesce(Entry.mood, 0)).label("mood_sum"),
+            _count_if(~in_week).label("prev_n"),
+            _count_if(and_(~in_week, Entry.mood.is_not(None))).label("prev_n_mood"),
+            _count_if(~in_week, func.coalesce(Entry.mood, 0)).label("prev_mood_sum"),
+        )
+        .where(Entry.user_id.in_(user_ids), Entry.created_at >= prev_start, Entry.created_at < end)
+        .group_by(Entry.user_id)
+    ).all()
+
+    tz = ZoneInfo(slot["tz"])
+    local_day = as_date(shift_minutes(Entry.created_at, local_offset(tz, start, end))).label("d")
+    days = db.execute(
+        select(Entry.user_id, local_day, func.count().label("n"), func.avg(Entry.mood * 1.0).label("mood_avg"))
+        .where(Entry.user_id.in_(user_ids), Entry.created_at >= start, Entry.created_at < end)
+        .group_by(Entry.user_id, local_day)
+    ).all()
+
+    out = {uid: {"n": 0, "n_mood": 0, "mood_sum": 0, "prev_n": 0, "prev_n_mood": 0, "prev_mood_sum": 0, "days": {}}
+           for uid in user_ids}
+    for r in totals:
+        out[r.user_id].update({k: int(getattr(r, k) or 0) for k in
+                               ("n", "n_mood", "mood_sum", "prev_n", "prev_n_mood", "prev_mood_sum")})
+    for r in days:
+        d = r.d if isinstance(r.d, date) else date.fromisoformat(str(r.d))
+        out[r.user_id]["days"][d.isoformat()] = {"n": r.n, "mood_avg": None if r.mood_avg is None else float(r.mood_avg)}
+    return out
+
+
+# ---------------------------------------------------------------- rendering (process pool)
+
+def render_summary(payload: dict) -> dict:
+    """Funzione pura (gira nei processi del pool): stats → messaggio."""
+    s = payload["stats"]
+    name = payload.get("display_name") or payload["user_id"]
+    start = date.fromisoformat(payload["period_start"])
+    end = date.fromisoformat(payload["period_end"])
+    lines = [f"Ciao {name},", "", f"ecco la tua settimana ({start:%d/%m} – {end:%d/%m}):", ""]
+    if not s["n"]:
+        lines.append("Questa settimana non hai scritto nel diario. Anche due righe fanno la differenza!")
+    else:
+        lines.append(f"• {s['n']} pagine di diario in {len(s['days'])} giorni su 7")
+        if s["n_mood"]:
+            avg = s["mood_sum"] / s["n_mood"]
+            trend = ""
+            if s["prev_n_mood"]:
+                delta = avg - s["prev_mood_sum"] / s["prev_n_mood"]
+                trend = " (stabile rispetto alla settimana prima)" if abs(delta) < 0.25 else (
+                    f" ({'+' if delta > 0 else ''}{delta:.1f} rispetto alla settimana prima)")
+            lines.append(f"• umore medio {avg:.1f}/5{trend}")
+            rated = {d: v["mood_avg"] for d, v in s["days"].items() if v["mood_avg"] is not None}
+            if len(rated) > 1:
+                best = max(rated, key=rated.get)
+                lines.append(f"• giorno migliore: {_WEEKDAYS[date.fromisoformat(best).weekday()]}")
+    lines += ["", "A presto,", "MoodTrack"]
+    return {
+        "user_id": payload["user_id"],
+        "to": payload["email"],
+        "subject": f"La tua settimana su MoodTrack ({start:%d/%m} – {end:%d/%m})",
+        "text": "\n".join(lines),
+    }
+
+
+# ---------------------------------------------------------------- sink
+
+def _email(msg: dict) -> EmailMessage:
+    m = EmailMessage()
+    m["From"] = WEEKLY_FROM
+    m["To"] = msg["to"]
+    m["Subject"] = msg["subject"]
+    m.set_content(msg["text"])
+    return m
+
+
+class FileSink:
+    """Un file .eml per messaggio (sviluppo/test, o da raccogliere con un relay)."""
+
+    def __init__(self, directory: str):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def deliver(self, messages: list[dict]) -> dict[str, str | None]:
+        out = {}
+        for msg in messages:
+            try:
+                (self.dir / f"{msg['user_id']}.eml").write_bytes(bytes(_email(msg)))
+                out[msg["user_id"]] = None
+            except OSError as e:
+                out[msg["user_id"]] = repr(e)
+        return out
+
+
+class SmtpSink:
+    """Una connessione SMTP per blocco (SMTP_USER/SMTP_PASSWORD opzionali, STARTTLS se SMTP_STARTTLS=1)."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+
+    def deliver(self, messages: list[dict]) -> dict[str, str | None]:
+        out = {}
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if os.getenv("SMTP_STARTTLS", "0") == "1":
+                smtp.starttls()
+            if os.getenv("SMTP_USER"):
+                smtp.login(os.environ["SMTP_USER"], os.getenv("SMTP_PASSWORD", ""))
+            for msg in messages:
+                try:
+                    smtp.send_message(_email(msg))
+                    out[msg["user_id"]] = None
+                except smtplib.SMTPException as e:
+                    out[msg["user_id"]] = repr(e)
+        return out
+
+
+class LogSink:
+    def deliver(self, messages: list[dict]) -> dict[str, str | None]:
+        for msg in messages:
+            logger.info("Weekly summary → %s: %s", msg["to"], msg["subject"])
+        return {msg["user_id"]: None for msg in messages}
+
+
+def make_sink(spec: str = WEEKLY_SINK):
+    if spec == "log":
+        return LogSink()
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec.startswith("smtp://"):
+        host, _, port = spec[len("smtp://"):].partition(":")
+        return SmtpSink(host, int(port or 25))
+    module, _, factory = spec.partition(":")
+    return getattr(importlib.import_module(module), factory)()
+
+
+# ---------------------------------------------------------------- giro completo
+
+def run_once(session_factory=None, sink=None, now: datetime | None = None, dry_run: bool = False,
+             pool: ProcessPoolExecutor | None = None) -> dict:
+    from app.db import SessionLocal
+
+    session_factory = session_factory or SessionLocal
+    now_aware = now or datetime.now(timezone.utc)
+    now_naive = _naive_utc(now_aware).replace(microsecond=0)
+    sink = sink or (None if dry_run else make_sink())
+    result = {"slots": 0, "due": 0, "sent": 0, "failed": 0, "skipped": 0, "no_email": 0}
+    t0 = _time.perf_counter()
+
+    own_pool = pool is None and WEEKLY_RENDER_PROCS > 1
+    if own_pool:
+        pool = ProcessPoolExecutor(WEEKLY_RENDER_PROCS)
+    try:
+        with session_factory() as db:
+            tz_names = db.scalars(select(UserSettings.tz_iana).distinct().where(_opted_in())).all()
+            for slot in due_slots(now_aware, tz_names):
+                result["slots"] += 1
+                for user_ids in due_user_chunks(db, slot):
+                    result["due"] += len(user_ids)
+                    if dry_run:
+                        continue
+                    previous = _claim(db, slot, user_ids, now_naive)
+                    result["skipped"] += len(user_ids) - len(previous)   # presi da un altro worker
+                    if not previous:
+                        continue
+                    claimed = list(previous)
+                    stats = weekly_stats(db, slot, claimed)
+                    users = db.execute(
+                        select(User.username, User.email, User.display_name).where(User.username.in_(claimed))
+                    ).all()
+                    db.rollback()   # fine letture: niente transazione aperta durante rendering e invio
+                    payloads = [{
+                        "user_id": u.username, "email": u.email, "display_name": u.display_name,
+                        "period_start": (slot["send_date"] - timedelta(days=7)).isoformat(),
+                        "period_end": (slot["send_date"] - timedelta(days=1)).isoformat(),
+                        "stats": stats[u.username],
+                    } for u in users if u.email]
+                    result["no_email"] += len(claimed) - len(payloads)
+                    if pool is not None:
+                        messages = list(pool.map(render_summary, payloads, chunksize=64))
+                    else:
+                        messages = [render_summary(p) for p in payloads]
+                    try:
+                        outcome = sink.deliver(messages)
+                    except Exception as e:
+                        logger.warning("Consegna weekly summary fallita per il blocco: %r", e)
+                        outcome = {m["user_id"]: repr(e) for m in messages}
+                    failed = [uid for uid, err in outcome.items() if err]
+                    if failed:
+                        _release(db, previous, failed, now_naive)
+                    result["sent"] += len(outcome) - len(failed)
+                    result["failed"] += len(failed)
+    finally:
+        if own_pool:
+            pool.shutdown()
+    result["elapsed_s"] = round(_time.perf_counter() - t0, 2)
+    return result
+
+
+def due_report(session_factory=None, now: datetime | None = None) -> list[dict]:
+    from app.db import SessionLocal
+
+    now_aware = now or datetime.now(timezone.utc)
+    with (session_factory or SessionLocal)() as db:
+        tz_names = db.scalars(select(UserSettings.tz_iana).distinct().where(_opted_in())).all()
+        out = []
+        for slot in due_slots(now_aware, tz_names):
+            n = db.scalar(select(func.count()).select_from(UserSettings).where(_due_filter(slot)))
+            out.append({"tz": slot["tz_name"], "day": slot["day"], "due_utc": slot["due_utc"], "users": n})
+        return out
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+    ap = argparse.ArgumentParser(prog="python -m app.api.services.weekly_summary", description="Riepilogo settimanale")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_due = sub.add_parser("due", help="utenti dovuti adesso, per fuso/giorno")
+    p_run = sub.add_parser("run", help="un giro completo e termina (CronJob)")
+    p_run.add_argument("--dry-run", action="store_true", help="conta i dovuti senza inviare né aggiornare")
+    for p in (p_due, p_run):
+        p.add_argument("--now", type=datetime.fromisoformat, help="istante simulato (ISO, con fuso)")
+    sub.add_parser("loop", help=f"un giro ogni WEEKLY_INTERVAL_S ({WEEKLY_INTERVAL_S:.0f}s)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "due":
+        for row in due_report(now=args.now):
+            print(row)
+    elif args.cmd == "run":
+        print(run_once(now=args.now, dry_run=args.dry_run))
+    else:
+        stop = threading.Event()
+        with ProcessPoolExecutor(WEEKLY_RENDER_PROCS) as pool:
+            while not stop.is_set():
+                try:
+                    logger.info("Weekly summary: %s", run_once(pool=pool))
+                except Exception:
+                    logger.exception("Giro weekly summary fallito")
+                stop.wait(WEEKLY_INTERVAL_S)
+
+
+if __name__ == "__main__":
+    main()
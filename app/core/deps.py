@@ -1,4 +1,6 @@
+import hashlib
 import os
+import time
 
 from fastapi import Depends, HTTPException, status, Security, Request
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
@@ -6,8 +8,14 @@ from typing import List
 from jose import jwt
 from opentelemetry import trace
 
+from app.core.cache import TTLCache
 from app.core.users import SECRET_KEY, ALGORITHM
 
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+JWT_CACHE_TTL  = float(os.getenv("JWT_CACHE_TTL", "300"))     # secondi, comunque mai oltre exp
+
+# hash del token → claims già verificati
+_verified_tokens = TTLCache(JWT_CACHE_SIZE, JWT_CACHE_TTL)
 
 oauth2 = OAuth2PasswordBearer(
     tokenUrl="auth/login",
@@ -19,6 +27,34 @@ oauth2 = OAuth2PasswordBearer(
     }
 )
 
+def _verified_claims(request: Request, token: str) -> dict:
+    """
+    Claims del token, verificando la firma al massimo una volta:
+    - memo su request.state (get_current_user gira più volte per richiesta);
+    - LRU con TTL per hash del token, mai oltre l'exp del JWT.
+    Solleva se il token non è valido.
+    """
+    memo = getattr(request.state, "jwt_claims", None)
+    if memo is not None and memo[0] == token:
+        return memo[1]
+
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = _verified_tokens.get(key)
+    if claims is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username = payload.get("sub") or payload.get("username") or payload.get("uid")
+        if not username:
+            raise ValueError("token senza subject")
+        claims = {"username": str(username), "scopes": list(payload.get("scopes", []))}
+        exp = payload.get("exp")
+        ttl = JWT_CACHE_TTL if exp is None else min(JWT_CACHE_TTL, float(exp) - time.time())
+        if ttl > 0:
+            _verified_tokens.set(key, claims, ttl)
+
+    request.state.jwt_claims = (token, claims)
+    return claims
+
+
 async def get_current_user(request: Request, security_scopes: SecurityScopes, token: str = Security(oauth2)):
     cred_exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,19 +62,17 @@ async def get_current_user(request: Request, security_scopes: SecurityScopes, to
         headers={"WWW-Authenticate": f'Bearer scope="{security_scopes.scope_str}"'},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub") or payload.get("username") or payload.get("uid")
-        token_scopes: List[str] = payload.get("scopes", [])
-        if not username:
-            raise cred_exc
+        claims = _verified_claims(request, token)
     except Exception:
         raise cred_exc
+    username: str = claims["username"]
+    token_scopes: List[str] = claims["scopes"]
 
-    request.state.user_id = str(username)
+    request.state.user_id = username
 
     span = trace.get_current_span()
     if span:
-        span.set_attribute("user.id", str(username))
+        span.set_attribute("user.id", username)
 
     for s in security_scopes.scopes:
         if s not in token_scopes:
@@ -46,6 +80,30 @@ async def get_current_user(request: Request, security_scopes: SecurityScopes, to
     return {"username": username, "scopes": token_scopes}
 
 
+def verified_token_cache_stats() -> dict:
+    return _verified_tokens.stats()
+
+
+def _register_metrics():
+    from opentelemetry import metrics
+    from opentelemetry.metrics import Observation
+
+    meter = metrics.get_meter("moodtrack.auth")
+    meter.create_observable_counter(
+        "moodtrack.jwt_cache.hits",
+        callbacks=[lambda _opts: [Observation(_verified_tokens.hits)]],
+        description="Token JWT trovati nella cache dei token verificati",
+    )
+    meter.create_observable_counter(
+        "moodtrack.jwt_cache.misses",
+        callbacks=[lambda _opts: [Observation(_verified_tokens.misses)]],
+        description="Token JWT verificati con jwt.decode",
+    )
+
+
+_register_metrics()
+
+
 def require_scope(scope: str):
     return Depends(lambda user=Depends(get_current_user): user)  # semplice wrapper
 
@@ -1,39 +1,54 @@
 # app/core/feature_flags.py
-import os, json, threading, time
+"""
+Feature flag da Azure App Configuration (o da file locale) con cache in-process.
+
+- le letture (get_value/get_bool/...) non fanno mai I/O né attese: servono la
+  cache anche se scaduta (stale-while-revalidate) e, al massimo, avviano un
+  refresh; prima del primo caricamento (warm-up) valgono i default;
+- un solo refresh alla volta per processo (single-flight), in background;
+- se App Configuration è lento o giù si continua a servire l'ultimo stato
+  buono (anche persistito su file con APP_CONFIG_LKG_PATH, per i riavvii);
+- APP_CONFIG_FILE=flags.json usa un file locale al posto di Azure (test/dev).
+"""
+import os, json, logging, threading, time
 from typing import Optional, Any
-from azure.appconfiguration import AzureAppConfigurationClient
 
 # Config di base
 _APP_CONF_CS   = os.getenv("APP_CONFIG_CONNECTION_STRING")          # per ora: connection string
 _APP_CONF_EP   = os.getenv("APP_CONFIG_ENDPOINT", "")                   # in futuro: endpoint + Managed Identity
 _APP_CONF_LABEL= os.getenv("APP_CONFIG_LABEL", "dev")               # dev|prod
+_APP_CONF_FILE = os.getenv("APP_CONFIG_FILE")                       # backend locale (json)
+_LKG_PATH      = os.getenv("APP_CONFIG_LKG_PATH")                   # ultimo stato buono su disco (opzionale)
 _TTL_SECONDS   = int(os.getenv("APP_CONFIG_TTL", "30"))             # cache refresh
+_TIMEOUT_S     = float(os.getenv("APP_CONFIG_TIMEOUT_S", "5"))      # timeout HTTP verso App Configuration
+_RETRY_MAX_S   = 300
+
+logger = logging.getLogger("uvicorn.error")
 
 # Client singleton
 _client_lock = threading.Lock()
-_client: Optional[AzureAppConfigurationClient] = None
+_client = None
 
-def _get_client() -> AzureAppConfigurationClient:
+def _get_client():
     global _client
     if _client: return _client
     with _client_lock:
         if _client: return _client
+        from azure.appconfiguration import AzureAppConfigurationClient
+        timeouts = {"connection_timeout": _TIMEOUT_S, "read_timeout": _TIMEOUT_S}
         if _APP_CONF_CS:
-            _client = AzureAppConfigurationClient.from_connection_string(_APP_CONF_CS)
+            _client = AzureAppConfigurationClient.from_connection_string(_APP_CONF_CS, **timeouts)
         else:
             # Futuro: DefaultAzureCredential con endpoint
             from azure.identity import DefaultAzureCredential
             cred = DefaultAzureCredential()
-            _client = AzureAppConfigurationClient(_APP_CONF_EP, cred)  # richiede APP_CONFIG_ENDPOINT
+            _client = AzureAppConfigurationClient(_APP_CONF_EP, cred, **timeouts)  # richiede APP_CONFIG_ENDPOINT
         return _client
 
-# Cache semplice in-process
-_cache = {}
-_cache_expiry = 0
-_cache_lock = threading.Lock()
 
-def _refresh_cache():
-    global _cache, _cache_expiry
+# ---------------------------------------------------------------- sorgenti
+
+def _fetch_app_config() -> dict:
     client = _get_client()
     new_cache = {}
     # Prendiamo solo i namespace che ci interessano
@@ -45,13 +60,162 @@ def _refresh_cache():
     for s in selectors:
         for kv in client.list_configuration_settings(key_filter=s["key_filter"], label_filter=s["label_filter"]):
             new_cache[(kv.key, kv.label)] = kv.value
+    return new_cache
+
+
+def _read_json_flags(path: str) -> dict:
+    """
+    {"features:x": "true", ...}  → label attiva
+    {"dev": {"features:x": "true"}, "prod": {...}}  → per label
+    """
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    out = {}
+    for k, v in raw.items():
+        if isinstance(v, dict):
+            for kk, vv in v.items():
+                out[(kk, k)] = None if vv is None else str(vv)
+        else:
+            out[(k, _APP_CONF_LABEL)] = None if v is None else str(v)
+    return out
+
+
+def _fetch() -> dict:
+    if _APP_CONF_FILE:
+        return _read_json_flags(_APP_CONF_FILE)
+    return _fetch_app_config()
+
+
+def _save_lkg(data: dict):
+    if not _LKG_PATH:
+        return
+    try:
+        by_label: dict[str, dict] = {}
+        for (k, lb), v in data.items():
+            by_label.setdefault(lb, {})[k] = v
+        tmp = _LKG_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(by_label, f)
+        os.replace(tmp, _LKG_PATH)
+    except Exception as e:
+        logger.warning("Impossibile salvare i feature flag last-known-good: %s", e)
+
+
+# ---------------------------------------------------------------- cache
+
+_cache = {}
+_cache_expiry = 0.0          # oltre questo istante la cache è stale
+_cache_source = "empty"      # empty | remote | file | lkg
+_last_error: Optional[str] = None
+_failures = 0
+_cache_lock = threading.Lock()
+_loaded = threading.Event()          # primo caricamento riuscito (o LKG)
+_refresh_lock = threading.Lock()     # single-flight
+_refresher: Optional[threading.Thread] = None
+_refresher_stop = threading.Event()
+
+
+def _load_lkg():
+    global _cache, _cache_source
+    if not _LKG_PATH or not os.path.exists(_LKG_PATH):
+        return
+    try:
+        data = _read_json_flags(_LKG_PATH)
+    except Exception as e:
+        logger.warning("Feature flag last-known-good illeggibili: %s", e)
+        return
+    with _cache_lock:
+        if _cache_source == "empty":
+            _cache = data
+            _cache_source = "lkg"
+    _loaded.set()
+
+
+def _refresh_cache():
+    """Un refresh (bloccante). Chiamare con _refresh_lock acquisito."""
+    global _cache, _cache_expiry, _cache_source, _last_error, _failures
+    if not _loaded.is_set():
+        _load_lkg()     # intanto l'ultimo stato buono, se la sorgente è lenta o giù
+    try:
+        new_cache = _fetch()
+    except Exception as e:
+        # si tiene l'ultimo stato buono; retry con backoff (mai oltre _RETRY_MAX_S)
+        with _cache_lock:
+            _failures += 1
+            _last_error = str(e)[:300]
+            _cache_expiry = time.time() + min(_RETRY_MAX_S, _TTL_SECONDS * (2 ** min(_failures - 1, 4)))
+        logger.warning("Refresh feature flag fallito (%d di fila), uso l'ultimo stato buono: %s", _failures, e)
+        return False
     with _cache_lock:
         _cache = new_cache
         _cache_expiry = time.time() + _TTL_SECONDS
+        _cache_source = "file" if _APP_CONF_FILE else "remote"
+        _last_error = None
+        _failures = 0
+    _loaded.set()
+    if not _APP_CONF_FILE:
+        _save_lkg(new_cache)
+    return True
+
+
+def _refresh_in_background() -> bool:
+    """Avvia un refresh se nessuno è già in corso (single-flight)."""
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+
+    def _run():
+        try:
+            _refresh_cache()
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=_run, name="feature-flags-refresh", daemon=True).start()
+    return True
+
 
 def _maybe_refresh():
-    if time.time() >= _cache_expiry:
-        _refresh_cache()
+    # mai bloccante (anche dalle route async): finché il primo caricamento del
+    # warm-up non è concluso le letture rispondono con i default
+    if time.time() < _cache_expiry:
+        return
+    _refresh_in_background()
+
+
+def refresh_now(timeout: Optional[float] = None) -> bool:
+    """Refresh sincrono single-flight (startup, test). False se già in corso o fallito."""
+    if not _refresh_lock.acquire(timeout=-1 if timeout is None else timeout):
+        return False
+    try:
+        return _refresh_cache()
+    finally:
+        _refresh_lock.release()
+
+
+def start_refresher():
+    """Thread che rinfresca la cache ogni TTL: le richieste non trovano quasi mai dati stale."""
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return
+    _refresher_stop.clear()
+
+    def _loop():
+        while not _refresher_stop.is_set():
+            if time.time() >= _cache_expiry and _refresh_lock.acquire(blocking=False):
+                try:
+                    _refresh_cache()
+                finally:
+                    _refresh_lock.release()
+            _refresher_stop.wait(max(1.0, min(_TTL_SECONDS, _cache_expiry - time.time())))
+
+    _refresher = threading.Thread(target=_loop, name="feature-flags-refresher", daemon=True)
+    _refresher.start()
+
+
+def stop_refresher():
+    _refresher_stop.set()
+
+
+# ---------------------------------------------------------------- API
 
 def get_value(key: str, default: Optional[str] = None, label: Optional[str] = None) -> Optional[str]:
     _maybe_refresh()
@@ -80,4 +244,11 @@ def snapshot(label: str | None = None) -> dict:
         # filtra per label attiva
         lb = label or _APP_CONF_LABEL
         data = {k: v for (k, l), v in _cache.items() if l == lb}
-        return {"label": lb, "ttl_remaining": ttl_remaining, "flags": data}
+        return {
+            "label": lb,
+            "ttl_remaining": ttl_remaining,
+            "source": _cache_source,
+            "stale": time.time() >= _cache_expiry,
+            "last_error": _last_error,
+            "flags": data,
+        }
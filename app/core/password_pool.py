@@ -0,0 +1,139 @@
+# app/core/password_pool.py
+"""
+Process pool dedicato a bcrypt (verify + rehash) con controllo di ammissione.
+
+Il login non occupa più il threadpool condiviso da tutte le route: al massimo
+AUTH_POOL_SIZE verifiche girano in parallelo e altre AUTH_POOL_QUEUE attendono;
+oltre, PasswordPoolSaturated → 503 con Retry-After.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.core.passwords import verify_and_rehash
+
+AUTH_POOL_SIZE    = int(os.getenv("AUTH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+AUTH_POOL_QUEUE   = int(os.getenv("AUTH_POOL_QUEUE", "32"))     # verifiche in attesa oltre a quelle in corso
+AUTH_RETRY_AFTER  = int(os.getenv("AUTH_RETRY_AFTER_S", "1"))
+
+
+class PasswordPoolSaturated(Exception):
+    def __init__(self, retry_after: int = AUTH_RETRY_AFTER):
+        super().__init__("password pool saturated")
+        self.retry_after = retry_after
+
+
+class PasswordPool:
+    def __init__(self, size: int = AUTH_POOL_SIZE, max_waiting: int = AUTH_POOL_QUEUE):
+        self.size = size
+        self.max_waiting = max_waiting
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._stats = {"completed": 0, "rejected": 0}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.size <= 0:
+                        # AUTH_POOL_SIZE=0: niente processi (test/sviluppo), un thread
+                        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bcrypt")
+                    else:
+                        # spawn: il processo padre ha già thread attivi (producer, dispatcher...)
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.size, mp_context=multiprocessing.get_context("spawn")
+                        )
+        return self._executor
+
+    def _admit(self):
+        with self._lock:
+            if self._outstanding >= max(self.size, 1) + self.max_waiting:
+                self._stats["rejected"] += 1
+                raise PasswordPoolSaturated()
+            self._outstanding += 1
+
+    def _release(self, _fut=None):
+        with self._lock:
+            self._outstanding -= 1
+            self._stats["completed"] += 1
+
+    async def verify_and_rehash(self, plain: str, hashed: str) -> tuple[bool, str | None]:
+        self._admit()
+        try:
+            fut = self._get_executor().submit(verify_and_rehash, plain, hashed)
+        except BaseException:
+            self._release()
+            raise
+        # il posto si libera quando il job finisce davvero: se la richiesta viene
+        # cancellata il job già partito continua a occupare un worker
+        fut.add_done_callback(self._release)
+        return await asyncio.wrap_future(fut)
+
+    def warm_up(self):
+        """Avvia i processi worker (altrimenti partono alla prima login)."""
+        if self.size <= 0:
+            return
+        ex = self._get_executor()
+        for f in [ex.submit(int) for _ in range(self.size)]:
+            f.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = min(self._outstanding, max(self.size, 1))
+            return {
+                "size": self.size,
+                "max_waiting": self.max_waiting,
+                "in_flight": in_flight,
+                "waiting": self._outstanding - in_flight,
+                "utilisation": round(in_flight / max(self.size, 1), 3),
+                **self._stats,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool: PasswordPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_password_pool() -> PasswordPool:
+    global _pool
+    if _pool: return _pool
+    with _pool_lock:
+        if _pool: return _pool
+        _pool = PasswordPool()
+        _register_metrics(_pool)
+        return _pool
+
+
+def _register_metrics(pool: PasswordPool):
+    from opentelemetry import metrics
+    from opentelemetry.metrics import Observation
+
+    meter = metrics.get_meter("moodtrack.auth")
+    meter.create_observable_gauge(
+        "moodtrack.auth_pool.in_flight",
+        callbacks=[lambda _opts: [Observation(pool.stats()["in_flight"])]],
+        description="Verifiche bcrypt in esecuzione",
+    )
+    meter.create_observable_gauge(
+        "moodtrack.auth_pool.waiting",
+        callbacks=[lambda _opts: [Observation(pool.stats()["waiting"])]],
+        description="Verifiche bcrypt in coda",
+    )
+    meter.create_observable_gauge(
+        "moodtrack.auth_pool.utilisation",
+        callbacks=[lambda _opts: [Observation(pool.stats()["utilisation"])]],
+        description="Frazione dei worker bcrypt occupati",
+    )
+    meter.create_observable_counter(
+        "moodtrack.auth_pool.rejected",
+        callbacks=[lambda _opts: [Observation(pool.stats()["rejected"])]],
+        description="Login rifiutate con 503 per pool saturo",
+    )
@@ -0,0 +1,50 @@
+# app/core/passwords.py
+"""
+Primitive bcrypt senza dipendenze dal DB: importabili (ed eseguibili) anche
+nei processi del pool di verifica (vedi app/core/password_pool.py).
+"""
+import logging
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger("uvicorn.error")
+
+# Use bcrypt for existing hashes, consider adding argon2 later
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify(plain: str, hashed: str) -> tuple[bool, str]:
+    """
+    pwd_context.verify con fallback bcrypt-style: se passlib lancia ValueError
+    per password >72 bytes, riprova troncando ai primi 72 bytes.
+    Ritorna (ok, password effettivamente verificata); rilancia gli altri errori.
+    """
+    plain_bytes = plain.encode("utf-8", errors="ignore")
+    try:
+        return pwd_context.verify(plain, hashed), plain
+    except ValueError as ve:
+        # probabilmente password >72 bytes (bcrypt)
+        logger.warning("pwd_context.verify raised ValueError: %s; trying bcrypt-style truncation (len=%d)", ve, len(plain_bytes))
+        if len(plain_bytes) <= 72:
+            # non ci sono bytes in eccesso: rilancia per essere sicuri
+            raise
+        # tronca ai primi 72 bytes (bcrypt behaviour)
+        truncated = plain_bytes[:72].decode("utf-8", errors="ignore")
+        return pwd_context.verify(truncated, hashed), truncated
+
+
+def verify_and_rehash(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """
+    Verifica e, se la policy lo richiede, calcola il nuovo hash.
+    Ritorna (ok, nuovo_hash | None). Non solleva: in caso di errore (False, None).
+    """
+    if plain is None or hashed is None:
+        return False, None
+    try:
+        ok, tried = verify(plain, hashed)
+        if ok and pwd_context.needs_update(hashed):
+            return True, pwd_context.hash(tried)
+        return ok, None
+    except Exception as e:
+        logger.exception("Error verifying password (pass_bytes_len=%d): %s", len(plain.encode("utf-8", errors="ignore")), e)
+        return False, None
@@ -8,10 +8,12 @@ from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
 from jose import jwt
-from passlib.context import CryptContext
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
+from app.core.passwords import pwd_context, verify as verify_bcrypt
+from app.core.password_pool import get_password_pool
+from app.db import SessionLocal, DbRunner
 from app.db.models import User, RefreshToken
 
 load_dotenv()
@@ -19,9 +21,6 @@ load_dotenv()
 # Logging
 logger = logging.getLogger("uvicorn.error")
 
-# Use bcrypt for existing hashes, consider adding argon2 later
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
@@ -43,6 +42,42 @@ def authenticate_user(db: Session, username: str, password: str):
     return {"username": user.username, "scopes": scopes}
 
 
+async def authenticate_user_async(db: DbRunner, username: str, password: str):
+    """
+    Come authenticate_user, ma per le route async: l'accesso al DB passa dal
+    DbRunner e bcrypt (CPU-bound) gira nel process pool dedicato, mai sull'event
+    loop né nel threadpool condiviso dalle altre route.
+    """
+    # la transazione si chiude subito: la connessione torna al pool prima dell'attesa di bcrypt
+    row = await db.run(_password_hash, username)
+    if row is None:
+        return None
+    username, password_hash = row   # username come salvato (collation case-insensitive)
+    # verify (+ eventuale rehash) nel process pool; PasswordPoolSaturated se la coda è piena
+    ok, new_hash = await get_password_pool().verify_and_rehash(password, password_hash)
+    if not ok:
+        return None
+    if new_hash:
+        try:
+            logger.info("Rehashing password for user=%s (pwd_context needs update)", username)
+            await db.run(_update_password_hash, username, new_hash)   # transazione breve a parte
+        except Exception as re:
+            logger.exception("Failed to rehash & update password for user %s: %s", username, re)
+    scopes = ["entries:read", "entries:write", "chatbot:read", "chatbot:write"]
+    return {"username": username, "scopes": scopes}
+
+
+def _password_hash(db: Session, username: str) -> tuple[str, str] | None:
+    row = db.execute(select(User.username, User.password_hash).where(User.username == username)).first()
+    db.commit()
+    return tuple(row) if row else None
+
+
+def _update_password_hash(db: Session, username: str, new_hash: str):
+    db.query(User).filter(User.username == username).update({User.password_hash: new_hash})
+    db.commit()
+
+
 def _now():
     return datetime.now(timezone.utc)
 
@@ -75,24 +110,32 @@ def create_refresh_token(db: Session, user_id: str, device: str | None = None) -
 
 
 def rotate_refresh_token(db: Session, raw_old: str, device: str | None = None) -> tuple[str, RefreshToken]:
-    h = _sha256(raw_old)
-    old = db.query(RefreshToken).filter(
-        RefreshToken.token_hash == h,
-        RefreshToken.revoked_at.is_(None),
-        RefreshToken.expires_at > _now(),
+    now = _now()
+    # single-use: revoca condizionale + RETURNING (OUTPUT su SQL Server) in un solo
+    # round trip sull'indice unico di token_hash; due refresh concorrenti dello
+    # stesso token → solo uno trova la riga ancora valida
+    old = db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == _sha256(raw_old),
+            RefreshToken.revoked_at.is_(None),
+            RefreshToken.expires_at > now,
+        )
+        .values(revoked_at=now)
+        .returning(RefreshToken.id, RefreshToken.user_id)
+        .execution_options(synchronize_session=False)
     ).first()
     if not old:
+        db.rollback()
         raise ValueError("invalid refresh token")
 
-    # single-use: revoca l’attuale e creane uno nuovo legato allo stesso utente
-    old.revoked_at = _now()
     new_raw = secrets.token_urlsafe(48)
     new_tok = RefreshToken(
         id=str(uuid.uuid4()),
         user_id=old.user_id,
         token_hash=_sha256(new_raw),
-        created_at=_now(),
-        expires_at=_now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
         device=device,
         rotated_from=old.id,
     )
@@ -121,23 +164,9 @@ def verify_password(plain: str, hashed: str, db: Session | None = None, user_obj
 
     # byte-length effettiva (bcrypt conta bytes)
     plain_bytes = plain.encode("utf-8", errors="ignore")
-    tried_plain_for_verify = plain  # value we will pass to pwd_context.verify
 
     try:
-        # primo tentativo diretto
-        ok = False
-        try:
-            ok = pwd_context.verify(tried_plain_for_verify, hashed)
-        except ValueError as ve:
-            # probabilmente password >72 bytes (bcrypt)
-            logger.warning("pwd_context.verify raised ValueError: %s; trying bcrypt-style truncation (len=%d)", ve, len(plain_bytes))
-            if len(plain_bytes) > 72:
-                # tronca ai primi 72 bytes (bcrypt behaviour)
-                tried_plain_for_verify = plain_bytes[:72].decode("utf-8", errors="ignore")
-                ok = pwd_context.verify(tried_plain_for_verify, hashed)
-            else:
-                # non ci sono bytes in eccesso: rilancia per essere sicuri
-                raise
+        ok, tried_plain_for_verify = verify_bcrypt(plain, hashed)
 
         if ok:
             # rehash on login se policy lo richiede (e se abbiamo accesso al DB / user_obj)
@@ -1,4 +1,5 @@
-from .models import Base, engine, SessionLocal
+from .models import Base, engine, SessionLocal, async_engine, AsyncSessionLocal
+from .runner import DbRunner, get_db_runner
 
 def get_db():
     from sqlalchemy.orm import Session
@@ -6,4 +7,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -1,17 +1,39 @@
 import os
-from datetime import datetime
+from datetime import date, datetime
 from sqlalchemy import (
-    create_engine, String, Integer, DateTime, Boolean, func, ForeignKey,
-    CheckConstraint, Index
+    create_engine, String, Integer, BigInteger, Date, DateTime, Boolean, JSON, func, ForeignKey,
+    CheckConstraint, Index, text
 )
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column, relationship
 from dotenv import load_dotenv
 load_dotenv()
 
+# driver async corrispondente al driver sync di SQL_URL
+_ASYNC_DRIVERS = {"mssql": "aioodbc", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _async_url(url: str | None):
+    if not url:
+        return url
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"nessun driver async noto per {backend!r}: imposta SQL_ASYNC_URL")
+    return u.set(drivername=f"{backend}+{_ASYNC_DRIVERS[backend]}")
+
+
 SQL_URL = os.getenv("SQL_URL")
 engine = create_engine(SQL_URL, pool_pre_ping=True, pool_recycle=300)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
+# percorso async per le route "calde"; DB_ASYNC=0 torna al threadpool + sessione sync (per confronto)
+DB_ASYNC = os.getenv("DB_ASYNC", "1").strip().lower() in ("1", "true", "yes", "on")
+SQL_ASYNC_URL = os.getenv("SQL_ASYNC_URL") or (_async_url(SQL_URL) if DB_ASYNC else None)
+async_engine = create_async_engine(SQL_ASYNC_URL, pool_pre_ping=True, pool_recycle=300) if DB_ASYNC else None
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False) if DB_ASYNC else None
+
 class Base(DeclarativeBase):
     pass
 
@@ -25,6 +47,8 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), server_default=func.sysutcdatetime())
     last_login_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=False))
     thread_id: Mapped[str | None] = mapped_column(String(64))
+    # incrementato ad ogni scrittura su entries/settings dell'utente (ETag)
+    data_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
     entries: Mapped[list["Entry"]] = relationship(back_populates="user", cascade="all, delete-orphan")
     settings: Mapped["UserSettings | None"] = relationship(back_populates="user", uselist=False, cascade="all, delete-orphan")
@@ -55,6 +79,44 @@ class UserSettings(Base):
 
     user: Mapped["User"] = relationship(back_populates="settings")
 
+    __table_args__ = (
+        # weekly summary: WHERE email_opt_in = 1 AND tz_iana = ? AND weekly_summary_day = ?
+        # AND user_id > ? ORDER BY user_id (keyset), last_sent filtrato dall'indice stesso
+        Index(
+            "ix_user_settings_weekly_due", "email_opt_in", "tz_iana", "weekly_summary_day", "user_id",
+            mssql_include=["weekly_last_sent_at_utc"],
+        ),
+    )
+
+
+
+class UserStats(Base):
+    """
+    Statistiche del diario per utente (app/api/services/user_stats.py),
+    aggiornate in O(1) dalle scritture sulle entries: la dashboard legge
+    solo questa riga. I giorni sono locali nel fuso tz (quello di UserSettings
+    al momento del calcolo); le liste JSON sono a lunghezza fissa.
+    """
+    __tablename__ = "user_stats"
+    user_id: Mapped[str] = mapped_column(
+        String(64), ForeignKey("users.username", ondelete="CASCADE"), primary_key=True
+    )
+    tz: Mapped[str] = mapped_column(String(64), nullable=False)
+    entries_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    mood_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    mood_sum: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    mood_hist: Mapped[list] = mapped_column(JSON, nullable=False)        # [n mood 0, ..., n mood 5]
+    weekday_counts: Mapped[list] = mapped_column(JSON, nullable=False)   # [lun, ..., dom]
+    # ultimi 30 giorni locali fino a last_entry_date compreso: [[n_mood, mood_sum], ...]
+    daily_moods: Mapped[list] = mapped_column(JSON, nullable=False)
+    first_entry_date: Mapped[date | None] = mapped_column(Date)
+    last_entry_date: Mapped[date | None] = mapped_column(Date)
+    current_streak: Mapped[int] = mapped_column(Integer, default=0, nullable=False)   # finisce a last_entry_date
+    longest_streak: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    rebuilt_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=False))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.sysutcdatetime(), onupdate=func.sysutcdatetime()
+    )
 
 
 class Entry(Base):
@@ -65,13 +127,90 @@ class Entry(Base):
     content: Mapped[str] = mapped_column(String(2000))
     mood: Mapped[int | None] = mapped_column(Integer, nullable=True)  # 0–5
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), server_default=func.sysutcdatetime())
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), server_default=func.sysutcdatetime(), onupdate=func.sysutcdatetime()
+    )
+    # users.data_version dell'ultima scrittura (insert o sentiment): cursore di /entries/changes
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", nullable=False)
+    # id generato dal client per le bozze offline: il replay della stessa bozza non la duplica
+    client_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
     user: Mapped["User"] = relationship(back_populates="entries")
 
+    # created_at torna con l'INSERT (OUTPUT/RETURNING), niente refresh dopo il commit
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # keyset pagination: WHERE user_id = ? AND id < ? ORDER BY id DESC
+        Index("ix_entries_user_id_id", "user_id", "id"),
+        # statistiche per intervallo di date
+        Index("ix_entries_user_id_created_at", "user_id", "created_at"),
+        # delta sync: WHERE user_id = ? AND change_seq > ? ORDER BY change_seq, id
+        Index("ix_entries_user_id_change_seq", "user_id", "change_seq", "id"),
+        # unico solo se valorizzato (su SQL Server un indice unico ammetterebbe un solo NULL)
+        Index(
+            "ux_entries_user_id_client_id", "user_id", "client_id", unique=True,
+            mssql_where=text("client_id IS NOT NULL"), sqlite_where=text("client_id IS NOT NULL"),
+            postgresql_where=text("client_id IS NOT NULL"),
+        ),
+        # come IDENTITY su SQL Server: id mai riusati dopo una delete (tombstone per id)
+        {"sqlite_autoincrement": True},
+    )
+
+
+class EntryTombstone(Base):
+    """Entry cancellata: serve a /entries/changes per propagare la delete ai device."""
+    __tablename__ = "entry_tombstones"
+    entry_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    user_id: Mapped[str] = mapped_column(String(64), ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
+    change_seq: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), server_default=func.sysutcdatetime(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_entry_tombstones_user_id_change_seq", "user_id", "change_seq", "entry_id"),
+        # purge dei tombstone vecchi
+        Index("ix_entry_tombstones_deleted_at", "deleted_at"),
+    )
+
+class SentimentOutbox(Base):
+    """
+    Outbox transazionale: una riga per ogni entry da mandare in coda al sentiment,
+    scritta nella stessa transazione dell'Entry e svuotata dal dispatcher.
+    """
+    __tablename__ = "sentiment_outbox"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    entry_id: Mapped[int] = mapped_column(Integer, ForeignKey("entries.id", ondelete="CASCADE"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), server_default=func.sysutcdatetime(), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_error: Mapped[str | None] = mapped_column(String(512))
+
+    entry: Mapped["Entry"] = relationship()
+
+
+class EntryTerm(Base):
+    """
+    Indice invertito per la ricerca testuale (app/api/services/search.py):
+    una riga per (utente, termine normalizzato, entry), scritta con l'Entry.
+    La PK è anche l'indice di lookup: WHERE user_id = ? AND term IN (...) / LIKE 'pre%'.
+    """
+    __tablename__ = "entry_terms"
+    user_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    term: Mapped[str] = mapped_column(String(64), primary_key=True)
+    entry_id: Mapped[int] = mapped_column(Integer, ForeignKey("entries.id", ondelete="CASCADE"), primary_key=True)
+    tf: Mapped[int] = mapped_column(Integer, nullable=False)   # occorrenze pesate (titolo x3)
+
+    entry: Mapped["Entry"] = relationship()
+
+    __table_args__ = (
+        # reindex/cancellazione per entry
+        Index("ix_entry_terms_entry_id", "entry_id"),
+    )
+
+
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
     id: Mapped[str] = mapped_column(String(64), primary_key=True)
     user_id: Mapped[str] = mapped_column(String(64), ForeignKey("users.username", ondelete="CASCADE"), index=True, nullable=False)
-    token_hash: Mapped[str] = mapped_column(String(128), nullable=False)
+    token_hash: Mapped[str] = mapped_column(String(128), nullable=False)  # indice unico: lookup di /auth/refresh
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), server_default=func.sysutcdatetime(), nullable=False)
     expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False)
     revoked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=False))
@@ -79,6 +218,13 @@ class RefreshToken(Base):
     rotated_from: Mapped[str | None] = mapped_column(String(64))
     user: Mapped["User"] = relationship(back_populates="refresh_tokens")
 
+    __table_args__ = (
+        Index("ux_refresh_tokens_token_hash", "token_hash", unique=True),
+        # purge batched di scaduti/revocati
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+        Index("ix_refresh_tokens_revoked_at", "revoked_at"),
+    )
+
 
 
 
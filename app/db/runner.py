@@ -0,0 +1,77 @@
+# app/db/runner.py
+import time
+from typing import Any, Callable, TypeVar
+
+from opentelemetry import metrics
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .models import DB_ASYNC, AsyncSessionLocal, SessionLocal, async_engine, engine
+
+T = TypeVar("T")
+
+_meter = metrics.get_meter("moodtrack.db")
+# attesa per avere una connessione dal pool (include un eventuale connect/pre-ping)
+_checkout_wait = _meter.create_histogram(
+    "moodtrack.db.pool.checkout_wait", unit="ms", description="Attesa per una connessione dal pool"
+)
+
+
+class DbRunner:
+    """
+    Esegue funzioni ORM scritte in stile sync (fn(session, *args)) senza
+    bloccare l'event loop:
+    - async (DB_ASYNC=1): AsyncSession.run_sync, l'I/O passa dal driver async
+      e la richiesta non occupa un worker del threadpool di anyio;
+    - sync  (DB_ASYNC=0): Session classica eseguita nel threadpool, come prima.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.is_async = not isinstance(session, Session)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.is_async:
+            if not self.session.in_transaction():
+                t0 = time.perf_counter()
+                await self.session.connection()
+                _checkout_wait.record((time.perf_counter() - t0) * 1000, {"mode": "async"})
+            return await self.session.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(self._run_sync, fn, *args, **kwargs)
+
+    def _run_sync(self, fn, *args, **kwargs):
+        if not self.session.in_transaction():
+            t0 = time.perf_counter()
+            self.session.connection()
+            _checkout_wait.record((time.perf_counter() - t0) * 1000, {"mode": "sync"})
+        return fn(self.session, *args, **kwargs)
+
+    async def close(self):
+        if self.is_async:
+            await self.session.close()
+        else:
+            await run_in_threadpool(self.session.close)
+
+
+async def get_db_runner():
+    runner = DbRunner(AsyncSessionLocal() if DB_ASYNC else SessionLocal())
+    try:
+        yield runner
+    finally:
+        await runner.close()
+
+
+def _pool_observations(_opts):
+    from opentelemetry.metrics import Observation
+
+    out = []
+    for name, pool in (("sync", engine.pool), ("async", async_engine.pool if async_engine is not None else None)):
+        if pool is not None and hasattr(pool, "checkedout"):
+            out.append(Observation(pool.checkedout(), {"engine": name}))
+    return out
+
+
+_meter.create_observable_gauge(
+    "moodtrack.db.pool.checked_out", callbacks=[_pool_observations],
+    description="Connessioni del pool in uso",
+)
@@ -0,0 +1,51 @@
+# app/db/sqlfuncs.py
+"""
+Piccole funzioni SQL portabili (SQL Server in prod, SQLite/Postgres in locale).
+"""
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Date, DateTime
+
+
+class shift_minutes(FunctionElement):
+    """expr + N minuti (N può essere un'espressione, es. un CASE)."""
+    type = DateTime()
+    inherit_cache = True
+    name = "shift_minutes"
+
+
+@compiles(shift_minutes)
+def _shift_minutes_default(element, compiler, **kw):
+    expr, minutes = list(element.clauses)
+    return "DATEADD(minute, %s, %s)" % (compiler.process(minutes, **kw), compiler.process(expr, **kw))
+
+
+@compiles(shift_minutes, "sqlite")
+def _shift_minutes_sqlite(element, compiler, **kw):
+    expr, minutes = list(element.clauses)
+    return "datetime(%s, printf('%%+d minutes', %s))" % (compiler.process(expr, **kw), compiler.process(minutes, **kw))
+
+
+@compiles(shift_minutes, "postgresql")
+def _shift_minutes_pg(element, compiler, **kw):
+    expr, minutes = list(element.clauses)
+    return "(%s + make_interval(mins => %s))" % (compiler.process(expr, **kw), compiler.process(minutes, **kw))
+
+
+class as_date(FunctionElement):
+    """Tronca un datetime alla data (senza conversioni di fuso)."""
+    type = Date()
+    inherit_cache = True
+    name = "as_date"
+
+
+@compiles(as_date)
+def _as_date_default(element, compiler, **kw):
+    (expr,) = list(element.clauses)
+    return "CAST(%s AS DATE)" % compiler.process(expr, **kw)
+
+
+@compiles(as_date, "sqlite")
+def _as_date_sqlite(element, compiler, **kw):
+    (expr,) = list(element.clauses)
+    return "date(%s)" % compiler.process(expr, **kw)
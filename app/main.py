@@ -1,14 +1,24 @@
 import os
 
-import app.obs.otel_init
-from fastapi import FastAPI, Depends
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-
-from app.api.routes import health
-from app.api.routes import internal, chatbot
-from app.db import Base, engine
-from app.api.routes import auth, entries, user
-from app.core.feature_flags import snapshot
+from app.obs.startup import report as startup
+with startup.timed("otel", "import"):
+    import app.obs.otel_init
+with startup.timed("fastapi", "import"):
+    from fastapi import FastAPI, Depends
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+with startup.timed("db", "import"):
+    from app.db import Base, engine
+with startup.timed("routes", "import"):
+    from app.api.routes import health
+    from app.api.routes import internal, chatbot
+    from app.api.routes import auth, entries, user
+with startup.timed("workers", "import"):
+    from app.core.feature_flags import start_refresher, stop_refresher
+    from app.api.services.outbox import start_dispatcher, stop_dispatcher
+    from app.api.services.token_purge import start_purger, stop_purger
+    from app.api.services.warmup import start_warmup, stop_warmup
+    from app.core.password_pool import get_password_pool
 import logging
 from app.obs.enrich import TelemetryEnricher
 from app.core.deps import stamp_user
@@ -21,13 +31,32 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s | %(message)s"
 )
 app = FastAPI(title="MoodTrack API")
-FastAPIInstrumentor.instrument_app(app)
+# probe di liveness/readiness fuori dalle tracce (arrivano ogni pochi secondi)
+# niente span interni "http send/receive": uno span per richiesta
+FastAPIInstrumentor.instrument_app(
+    app,
+    excluded_urls=os.getenv("OTEL_EXCLUDED_URLS", "health"),
+    exclude_spans=["receive", "send"],
+)
 
 @app.on_event("startup")
-def log_flags_on_startup():
-    snap = snapshot()
-    for k, v in snap["flags"].items():
-        logging.info("Feature flag: %s = %s", k, v)
+async def start_background_workers():
+    # niente I/O bloccante qui: connessioni DB, flag, pool bcrypt e client
+    # OpenAI si preparano nel warm-up (readiness 503 finché non è finito)
+    with startup.timed("workers", "init"):
+        start_dispatcher()
+        start_refresher()
+        start_purger()
+    start_warmup()
+
+@app.on_event("shutdown")
+async def flush_queue_on_shutdown():
+    # ferma il dispatcher (l'ultimo lotto in invio finisce; il resto resta in outbox) prima che il pod termini
+    await stop_warmup()
+    stop_dispatcher()
+    stop_refresher()
+    stop_purger()
+    get_password_pool().shutdown()
 
 # crea le tabelle (solo dev)
 # Base.metadata.create_all(bind=engine)
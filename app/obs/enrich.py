@@ -1,15 +1,54 @@
 # app/obs/enrich.py
-from starlette.middleware.base import BaseHTTPMiddleware
-from opentelemetry import trace
 import os
+import time
+
+from opentelemetry import trace
+
+from app.obs.metrics import route_latency
+
+APP_ENV = os.getenv("APP_ENV", "dev")
+
+
+class TelemetryEnricher:
+    """
+    Middleware ASGI puro (niente BaseHTTPMiddleware: nessun task o stream in
+    più per richiesta, StreamingResponse/SSE passano invariate).
+
+    Gli attributi si scrivono su http.response.start, cioè dopo il routing e
+    le dipendenze: user.id (request.state.user_id, messo da stamp_user o
+    check_job_key) e http.route ci sono già. Nello stesso giro registra la
+    latenza per route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-class TelemetryEnricher(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        # Prendi l’utente dal tuo layer auth (es. request.state.user_id impostato dal JWT)
-        uid = getattr(request.state, "user_id", None)
         span = trace.get_current_span()
-        if span is not None:
-            if uid:
-                span.set_attribute("user.id", str(uid))
-            span.set_attribute("env", os.getenv("APP_ENV", "dev"))
-        return await call_next(request)
+        recording = span.is_recording()   # richieste non campionate: nessun attributo da scrivere
+        status = 500
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if recording:
+                    span.set_attribute("env", APP_ENV)
+                    uid = scope.get("state", {}).get("user_id")
+                    if uid:
+                        span.set_attribute("user.id", str(uid))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_latency.record((time.perf_counter() - t0) * 1000, {
+                "http.route": getattr(route, "path", "unmatched"),
+                "http.method": scope["method"],
+                "http.status_code": status,
+            })
@@ -0,0 +1,10 @@
+# app/obs/metrics.py
+from opentelemetry import metrics
+
+_meter = metrics.get_meter("moodtrack.http")
+
+# registrata da TelemetryEnricher (app/obs/enrich.py)
+route_latency = _meter.create_histogram(
+    "moodtrack.http.server.duration", unit="ms",
+    description="Latenza per route (template, non path: cardinalità limitata)",
+)
@@ -1,21 +1,130 @@
 # app/obs/otel_init.py
+"""
+Pipeline OpenTelemetry (tracce + metriche), configurata da env:
+
+- OTEL_EXPORTERS: lista separata da virgole tra azure, otlp, console, memory, none.
+  Default: azure se c'è APPLICATIONINSIGHTS_CONNECTION_STRING, altrimenti none.
+  console (stdout, solo debug locale) è ignorato con APP_ENV=prod.
+- OTEL_TRACES_SAMPLE_RATIO: sampling parent-based a rapporto
+  (default 1.0, 0.1 in prod). Le richieste non campionate non creano span
+  registrati: l'overhead per richiesta resta limitato.
+- memory: exporter/reader in-memory per i test (memory_spans, memory_metrics).
+
+Gli span vanno sempre in BatchSpanProcessor (coda limitata, export fuori dal
+percorso della richiesta); le metriche in PeriodicExportingMetricReader.
+"""
+import logging
 import os
-from opentelemetry import trace
+
+from opentelemetry import metrics, trace
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    ConsoleMetricExporter,
+    InMemoryMetricReader,
+    PeriodicExportingMetricReader,
+)
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from azure.monitor.opentelemetry.exporter import AzureMonitorTraceExporter
-from opentelemetry.sdk.trace.export import ConsoleSpanExporter, SimpleSpanProcessor
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 
+logger = logging.getLogger("uvicorn.error")
 
+APP_ENV = os.getenv("APP_ENV", "dev")
 cs = os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING")
-if cs:
+OTEL_EXPORTERS = [
+    e.strip().lower()
+    for e in os.getenv("OTEL_EXPORTERS", "azure" if cs else "none").split(",")
+    if e.strip()
+]
+OTEL_TRACES_SAMPLE_RATIO = float(os.getenv("OTEL_TRACES_SAMPLE_RATIO", "0.1" if APP_ENV == "prod" else "1.0"))
+OTEL_METRIC_EXPORT_INTERVAL_MS = int(os.getenv("OTEL_METRIC_EXPORT_INTERVAL_MS", "60000"))
+
+# per i test (OTEL_EXPORTERS=memory)
+memory_spans: InMemorySpanExporter | None = None
+memory_metrics: InMemoryMetricReader | None = None
+
+
+def _otlp(kind: str):
+    # opentelemetry-exporter-otlp è opzionale (sviluppo / collector locale)
+    try:
+        if kind == "traces":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            return OTLPSpanExporter()      # OTEL_EXPORTER_OTLP_ENDPOINT
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        return OTLPMetricExporter()
+    except ImportError as e:
+        logger.warning("Exporter OTLP non disponibile (%s): installare opentelemetry-exporter-otlp", e)
+        return None
+
+
+def _span_exporters(names: list[str]) -> list:
+    global memory_spans
+    out = []
+    for name in names:
+        if name == "azure":
+            if not cs:
+                logger.warning("OTEL_EXPORTERS=azure senza APPLICATIONINSIGHTS_CONNECTION_STRING: ignorato")
+                continue
+            from azure.monitor.opentelemetry.exporter import AzureMonitorTraceExporter
+            out.append(BatchSpanProcessor(AzureMonitorTraceExporter.from_connection_string(cs)))
+        elif name == "otlp":
+            exporter = _otlp("traces")
+            if exporter is not None:
+                out.append(BatchSpanProcessor(exporter))
+        elif name == "console":
+            out.append(BatchSpanProcessor(ConsoleSpanExporter()))
+        elif name == "memory":
+            memory_spans = InMemorySpanExporter()
+            # sincrono: i test leggono gli span appena chiusa la richiesta
+            out.append(SimpleSpanProcessor(memory_spans))
+    return out
+
+
+def _metric_readers(names: list[str]) -> list:
+    global memory_metrics
+    out = []
+    for name in names:
+        if name == "azure" and cs:
+            from azure.monitor.opentelemetry.exporter import AzureMonitorMetricExporter
+            exporter = AzureMonitorMetricExporter.from_connection_string(cs)
+        elif name == "otlp":
+            exporter = _otlp("metrics")
+            if exporter is None:
+                continue
+        elif name == "console":
+            exporter = ConsoleMetricExporter()
+        elif name == "memory":
+            memory_metrics = InMemoryMetricReader()
+            out.append(memory_metrics)
+            continue
+        else:
+            continue
+        out.append(PeriodicExportingMetricReader(exporter, export_interval_millis=OTEL_METRIC_EXPORT_INTERVAL_MS))
+    return out
+
+
+def setup(names: list[str] = OTEL_EXPORTERS):
+    names = [n for n in names if n != "none"]
+    if APP_ENV == "prod" and "console" in names:
+        logger.warning("Export console delle tracce disabilitato in prod")
+        names.remove("console")
+    if not names:
+        return   # provider no-op: nessun costo sul percorso della richiesta
+
+    processors = _span_exporters(names)
+    readers = _metric_readers(names)
     resource = Resource.create({
         "service.name": "moodtrack-api",       # finisce come cloud_RoleName
-        "deployment.environment": os.getenv("APP_ENV", "dev"),
+        "deployment.environment": APP_ENV,
     })
-    provider = TracerProvider(resource=resource)
+    provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(OTEL_TRACES_SAMPLE_RATIO)))
+    for p in processors:
+        provider.add_span_processor(p)
     trace.set_tracer_provider(provider)
-    provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
-    exporter = AzureMonitorTraceExporter.from_connection_string(cs)
-    provider.add_span_processor(BatchSpanProcessor(exporter))
\ No newline at end of file
+    if readers:
+        metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=readers))
+
+
+setup()
@@ -0,0 +1,59 @@
+# app/obs/startup.py
+"""
+Report dei tempi di avvio del processo API: import dei moduli (main.py) e
+inizializzazione/warm-up dei componenti (app/api/services/warmup.py).
+
+Va importato per primo: il riferimento t=0 è l'import di questo modulo.
+
+    with report.timed("routes", "import"):
+        from app.api.routes import ...
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("uvicorn.error")
+
+_T0 = time.perf_counter()
+
+
+class StartupReport:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps: list[dict] = []
+
+    def record(self, name: str, phase: str, ms: float, status: str = "ok", error: str | None = None):
+        step = {"name": name, "phase": phase, "ms": round(ms, 1), "status": status,
+                "at_ms": round((time.perf_counter() - _T0) * 1000, 1)}
+        if error:
+            step["error"] = error
+        with self._lock:
+            self._steps.append(step)
+
+    @contextmanager
+    def timed(self, name: str, phase: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.record(name, phase, (time.perf_counter() - t0) * 1000, "failed", repr(e))
+            raise
+        self.record(name, phase, (time.perf_counter() - t0) * 1000)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            steps = list(self._steps)
+        totals: dict[str, float] = {}
+        for s in steps:
+            totals[s["phase"]] = round(totals.get(s["phase"], 0.0) + s["ms"], 1)
+        return {"since_start_ms": round((time.perf_counter() - _T0) * 1000, 1), "totals": totals, "steps": steps}
+
+    def log(self):
+        data = self.as_dict()
+        for s in data["steps"]:
+            logger.info("Startup %-7s %-16s %8.1f ms  %s", s["phase"], s["name"], s["ms"], s["status"])
+        logger.info("Startup totale: %s (%.0f ms dall'avvio)", data["totals"], data["since_start_ms"])
+
+
+report = StartupReport()
@@ -1,5 +1,7 @@
+import os
 from pydantic import BaseModel, Field, ConfigDict, field_validator
-from datetime import datetime
+from datetime import date, datetime
+from typing import Literal
 from zoneinfo import ZoneInfo
 
 def to_local(dt: datetime, tz: str = "Europe/Rome") -> datetime:
@@ -7,10 +9,48 @@ def to_local(dt: datetime, tz: str = "Europe/Rome") -> datetime:
         return None
     return dt.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo(tz))
 
+ENTRIES_BATCH_MAX = int(os.getenv("ENTRIES_BATCH_MAX", "50"))
+
 class EntryCreate(BaseModel):
     title: str = Field(min_length=1, max_length=100)
     content: str = Field(min_length=1, max_length=2_000)
     mood: int | None = Field(default=None, ge=0, le=5)
+    client_id: str | None = Field(default=None, min_length=1, max_length=64)  # chiave di idempotenza (bozze offline)
+
+class EntryImport(EntryCreate):
+    """Riga di /entries/import: created_at opzionale (UTC se senza fuso), gli altri campi come EntryCreate."""
+    created_at: datetime | None = None
+
+    @field_validator("created_at")
+    @classmethod
+    def _to_utc_naive(cls, v):
+        # in DB created_at è UTC naive (sysutcdatetime)
+        if v is not None and v.tzinfo is not None:
+            v = v.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+        return v
+
+class EntryBatchIn(BaseModel):
+    # item validati uno per uno nella route: un item non valido non fa fallire gli altri
+    items: list[dict] = Field(min_length=1, max_length=ENTRIES_BATCH_MAX)
+
+
+class EntryBatchResult(BaseModel):
+    index: int                      # posizione nella richiesta
+    status: Literal["created", "duplicate", "invalid"]
+    id: int | None = None
+    client_id: str | None = None
+    created_at: datetime | None = None
+    error: str | None = None
+
+    @field_validator("created_at", mode="before")
+    @classmethod
+    def _convert_tz(cls, v):
+        return to_local(v, "Europe/Rome")
+
+
+class EntryBatchOut(BaseModel):
+    created: int
+    results: list[EntryBatchResult]
 
 class EntryOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)  # ← importante per SQLAlchemy
@@ -27,6 +67,48 @@ class EntryOut(BaseModel):
 
 
 class PaginatedEntries(BaseModel):
-    total: int          # totale entries per quell’utente
-    count: int          # numero di elementi in questa pagina
-    items: list[EntryOut]
\ No newline at end of file
+    total: int | None = None        # totale entries per quell’utente (None se non calcolato)
+    count: int                      # numero di elementi in questa pagina
+    items: list[EntryOut]
+    next_cursor: str | None = None  # da passare come ?after= per la pagina successiva
+
+
+class EntryChange(BaseModel):
+    op: Literal["upsert", "delete"]
+    id: int
+    entry: EntryOut | None = None   # solo per upsert
+
+
+class EntryChanges(BaseModel):
+    changes: list[EntryChange]
+    next_cursor: str                # da passare come ?since= alla prossima sync
+    has_more: bool                  # True: richiamare subito con next_cursor
+    reset: bool = False             # True: cursore scaduto, scartare la copia locale e applicare da zero
+
+
+class MoodTimeseries(BaseModel):
+    """Serie compatta: array paralleli, un elemento per bucket non vuoto."""
+    granularity: Literal["day", "week", "month"]
+    tz: str
+    from_: date = Field(alias="from")
+    to: date
+    buckets: list[date]                 # inizio del bucket (data locale)
+    count: list[int]                    # entries nel bucket
+    mood_count: list[int]               # entries con mood valorizzato
+    mood_avg: list[float | None]        # media mood (None se nessun mood)
+
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class SearchHit(BaseModel):
+    entry: EntryOut
+    score: float
+    title_highlights: list[tuple[int, int]]     # [inizio, fine) dei termini trovati in entry.title
+    snippet: str                                # estratto del contenuto attorno al primo match
+    snippet_highlights: list[tuple[int, int]]   # [inizio, fine) nello snippet
+
+
+class SearchResults(BaseModel):
+    count: int
+    items: list[SearchHit]
+    next_cursor: str | None = None
@@ -0,0 +1,35 @@
+import math
+import os
+
+from pydantic import BaseModel, Field
+
+INTERNAL_BATCH_MAX = int(os.getenv("INTERNAL_BATCH_MAX", "100"))
+MOOD_MIN, MOOD_MAX = 0, 5   # range di Entry.mood
+
+
+def score_in_range(score: int | float) -> bool:
+    return MOOD_MIN <= score <= MOOD_MAX    # False anche per NaN
+
+
+def score_to_mood(score):
+    """
+    Punteggio del worker → valore di Entry.mood. Unica conversione per tutte le
+    scritture del sentiment: la parte decimale si tronca, come fa la colonna INT
+    su SQL Server e come la conta user_stats (_bucket). Il resto passa invariato.
+    """
+    if isinstance(score, float) and math.isfinite(score):
+        return int(score)
+    return score
+
+
+class BatchGetIn(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=INTERNAL_BATCH_MAX)
+
+
+class SentimentItem(BaseModel):
+    entry_id: int
+    sentiment_score: int | float | None = None
+
+
+class BatchSentimentIn(BaseModel):
+    items: list[SentimentItem] = Field(min_length=1, max_length=INTERNAL_BATCH_MAX)
@@ -1,7 +1,7 @@
 from typing import Optional
 
 from pydantic import BaseModel, Field, ConfigDict, SecretStr
-from datetime import datetime
+from datetime import date, datetime
 
 class UserCreate(BaseModel):
     username: str = Field(min_length=3, max_length=50)
@@ -17,7 +17,7 @@ class UserSettingsOut(BaseModel):
     tz_iana: str
     weekly_summary_day: Optional[int]  # 0–6
     email_opt_in: bool
-    weekly_last_sent_at_utc: datetime
+    weekly_last_sent_at_utc: Optional[datetime]
 
     # reminder_enabled: bool
     # reminder_minute: Optional[int]     # 0..1439, può essere None
@@ -49,4 +49,19 @@ class UserWithSettingsOut(BaseModel):
     settings: Optional[UserSettingsOut]
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class UserStatsOut(BaseModel):
+    tz: str
+    entries: int
+    mood_count: int
+    mood_avg: Optional[float]
+    mood_avg_7d: Optional[float]     # giorni locali, oggi compreso
+    mood_avg_30d: Optional[float]
+    mood_histogram: list[int]        # indice = mood 0..5
+    weekday_counts: list[int]        # 0 = lunedì
+    first_entry_date: Optional[date]
+    last_entry_date: Optional[date]
+    current_streak: int              # giorni consecutivi fino a oggi (o ieri)
+    longest_streak: int
+    updated_at: Optional[datetime]
@@ -7,7 +7,7 @@ import {
   saveRefreshToken,
   clearAllTokens,
 } from '../lib/keychain';
-import type { ChatbotResponse, UserProfile } from './types';
+import type { ChatbotResponse, EntryChanges, MoodTimeseries, SearchResults, UserProfile, UserStats } from './types';
 
 const TIMEOUT_MS = 15000;
 
@@ -44,16 +44,24 @@ async function parseJsonSafe<T>(res: Response): Promise<T> {
 
 type Method = 'GET' | 'POST' | 'PUT' | 'PATCH' | 'DELETE';
 
+// GET condizionali: ultimo ETag + corpo per URL; 304 → si riusa il corpo
+const etagCache = new Map<string, { etag: string; body: unknown }>();
+export function clearEtagCache() {
+  etagCache.clear();
+}
+
 async function request<T>(
   method: Method,
   path: string,
   body?: unknown,
-  opts?: { auth?: boolean; retry?: boolean }
+  opts?: { auth?: boolean; retry?: boolean; conditional?: boolean }
 ): Promise<T> {
-  const { auth = true, retry = true } = opts ?? {};
+  const { auth = true, retry = true, conditional = false } = opts ?? {};
   const url = joinUrl(API_BASE, path);
 
   const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  const cached = conditional ? etagCache.get(url) : undefined;
+  if (cached) headers['If-None-Match'] = cached.etag;
 
   if (auth) {
     const t = memoryAccess ?? (await getAccessToken());
@@ -94,9 +102,12 @@ async function request<T>(
       }
     } catch {
       await clearAllTokens();
+      clearEtagCache();
     }
   }
 
+  if (res.status === 304 && cached) return cached.body as T;
+
   if (!res.ok) {
     const errBody = await parseJsonSafe<any>(res);
     const msg =
@@ -106,11 +117,15 @@ async function request<T>(
     throw new Error(msg);
   }
 
-  return parseJsonSafe<T>(res);
+  const data = await parseJsonSafe<T>(res);
+  const etag = conditional ? res.headers.get('ETag') : null;
+  if (etag) etagCache.set(url, { etag, body: data });
+  return data;
 }
 
 // ------------ AUTH ------------
 export async function login(username: string, password: string) {
+  clearEtagCache();
   return request<{ access_token: string; refresh_token?: string }>(
     'POST',
     '/auth/login',
@@ -120,24 +135,67 @@ export async function login(username: string, password: string) {
 }
 
 // ------------ ENTRIES ------------
-export async function getEntries(params?: { skip?: number; limit?: number }) {
+export async function getEntries(params?: { skip?: number; limit?: number; after?: string | null }) {
   const skip = params?.skip ?? 0;
   const limit = params?.limit ?? 20;
-  const q = `/entries?skip=${encodeURIComponent(skip)}&limit=${encodeURIComponent(limit)}`;
-  return request<any>('GET', q);
+  const q = params?.after
+    ? `/entries?after=${encodeURIComponent(params.after)}&limit=${encodeURIComponent(limit)}`
+    : `/entries?skip=${encodeURIComponent(skip)}&limit=${encodeURIComponent(limit)}`;
+  return request<any>('GET', q, undefined, { conditional: true });
+}
+
+// delta sync: solo inserimenti/modifiche/cancellazioni dopo il cursore (vedi lib/dataCache)
+export async function getEntryChanges(since?: string | null, limit = 200) {
+  const qs = new URLSearchParams({ limit: String(limit) });
+  if (since) qs.set('since', since);
+  return request<EntryChanges>('GET', `/entries/changes?${qs.toString()}`, undefined, { conditional: true });
+}
+
+export async function deleteEntry(id: number) {
+  return request<void>('DELETE', `/entries/${id}`);
+}
+
+// ricerca lato server (indice per utente): niente download di tutte le entries
+export async function searchEntries(q: string, params?: { limit?: number; after?: string | null }) {
+  const qs = new URLSearchParams({ q, limit: String(params?.limit ?? 20) });
+  if (params?.after) qs.set('after', params.after);
+  return request<SearchResults>('GET', `/entries/search?${qs.toString()}`, undefined, { conditional: true });
+}
+
+export async function getMoodTimeseries(params?: {
+  granularity?: 'day' | 'week' | 'month';
+  from?: string;
+  to?: string;
+}) {
+  const qs = new URLSearchParams({ granularity: params?.granularity ?? 'day' });
+  if (params?.from) qs.set('from', params.from);
+  if (params?.to) qs.set('to', params.to);
+  return request<MoodTimeseries>('GET', `/entries/stats/timeseries?${qs.toString()}`);
 }
 
 export async function createEntry(dto: { title?: string; content: string }) {
   return request<any>('POST', '/entries', dto);
 }
 
+// coda offline: fino a 50 bozze per richiesta; client_id rende il replay idempotente
+export async function createEntriesBatch(items: { title?: string; content: string; mood?: number | null; client_id?: string }[]) {
+  return request<{
+    created: number;
+    results: { index: number; status: 'created' | 'duplicate' | 'invalid'; id?: number | null; client_id?: string | null; created_at?: string | null; error?: string | null }[];
+  }>('POST', '/entries:batch', { items });
+}
+
 export async function getEntryById(id: number) {
   return request<any>('GET', `/entries/${id}`);
 }
 
 // ------------ PROFILE ------------
 export async function getProfile() {
-  return request<UserProfile>('GET', '/users/me');
+  return request<UserProfile>('GET', '/users/me', undefined, { conditional: true });
+}
+
+export async function getMyStats() {
+  return request<UserStats>('GET', '/users/me/stats');
 }
 
 export async function updateProfileSettings(patch: {
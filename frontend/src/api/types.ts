@@ -34,4 +34,55 @@ export type UserProfile = {
     created_at?: string;
     updated_at?: string | null;
   };
-};
\ No newline at end of file
+};
+export type MoodTimeseries = {
+  granularity: 'day' | 'week' | 'month';
+  tz: string;
+  from: string;
+  to: string;
+  buckets: string[];          // YYYY-MM-DD (inizio bucket, ora locale)
+  count: number[];
+  mood_count: number[];
+  mood_avg: (number | null)[];
+};
+
+export type SearchHit = {
+  entry: Entry;
+  score: number;
+  title_highlights: [number, number][];    // [inizio, fine) in entry.title
+  snippet: string;
+  snippet_highlights: [number, number][];  // [inizio, fine) nello snippet
+};
+
+export type SearchResults = {
+  count: number;
+  items: SearchHit[];
+  next_cursor: string | null;
+};
+
+export type EntryChange =
+  | { op: 'upsert'; id: number; entry: Entry }
+  | { op: 'delete'; id: number; entry?: null };
+
+export type EntryChanges = {
+  changes: EntryChange[];
+  next_cursor: string;   // da ripassare come since alla prossima sync
+  has_more: boolean;
+  reset: boolean;        // cursore scaduto: ripartire da una lista vuota
+};
+
+export type UserStats = {
+  tz: string;
+  entries: number;
+  mood_count: number;
+  mood_avg: number | null;
+  mood_avg_7d: number | null;   // giorni locali, oggi compreso
+  mood_avg_30d: number | null;
+  mood_histogram: number[];     // indice = mood 0..5
+  weekday_counts: number[];     // 0 = lunedì
+  first_entry_date: string | null;
+  last_entry_date: string | null;
+  current_streak: number;
+  longest_streak: number;
+  updated_at: string | null;
+};
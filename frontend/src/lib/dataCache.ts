@@ -1,8 +1,11 @@
 // Semplice cache in-memory per dati prefetcha ti post-login
+import { getEntryChanges } from '../api/client';
 import type { Entry, UserProfile } from '../api/types';
 
 let _entries: Entry[] | null = null;
 let _profile: UserProfile | null = null;
+// cursore di /entries/changes: dopo la prima sync completa si scaricano solo le differenze
+let _syncCursor: string | null = null;
 
 export function primeEntries(list: Entry[] | null) {
   _entries = list;
@@ -18,7 +21,33 @@ export function getCachedProfile(): UserProfile | null {
   return _profile;
 }
 
+function byNewest(a: Entry, b: Entry) {
+  return new Date(b.created_at).getTime() - new Date(a.created_at).getTime();
+}
+
+// Applica le modifiche dal server alla lista in cache e la ritorna (più recenti prima)
+export async function syncEntries(): Promise<Entry[]> {
+  const byId = new Map<number, Entry>();
+  // senza cursore la prima risposta è la lista completa: le pagine già in cache restano valide
+  (_entries ?? []).forEach(e => byId.set(e.id, e));
+  let cursor = _syncCursor;
+  while (true) {
+    const res = await getEntryChanges(cursor);
+    if (res.reset) byId.clear();
+    for (const c of res.changes) {
+      if (c.op === 'delete') byId.delete(c.id);
+      else byId.set(c.id, c.entry);
+    }
+    cursor = res.next_cursor;
+    if (!res.has_more) break;
+  }
+  _syncCursor = cursor;
+  _entries = Array.from(byId.values()).sort(byNewest);
+  return _entries;
+}
+
 export function clearAllCache() {
   _entries = null;
   _profile = null;
-}
\ No newline at end of file
+  _syncCursor = null;
+}
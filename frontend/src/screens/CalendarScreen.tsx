@@ -10,7 +10,7 @@ import EntryCard from '../components/EntryCard';
 import { useTheme, spacing, fonts } from '../theme';
 import { onEntryCreated } from '../lib/events';
 import { EntryDetailView } from './EntryDetailScreen';
-import { getCachedEntries, primeEntries } from '../lib/dataCache';
+import { getCachedEntries, primeEntries, syncEntries } from '../lib/dataCache';
 
 const PAGE_SIZE = 20;
 
@@ -32,24 +32,10 @@ export default function CalendarScreen() {
     return { arr: res?.items ?? [], total: res?.total, count: res?.count ?? (res?.items?.length ?? 0) };
   };
 
+  // prima volta: lista completa; poi solo le differenze (vedi syncEntries)
   const prefetchAll = useCallback(async () => {
     try {
-      let skip = 0;
-      const limit = PAGE_SIZE;
-      const byId = new Map<number, Entry>();
-      (getCachedEntries() ?? []).forEach(e => byId.set(e.id, e));
-      while (true) {
-        const res = await getEntries({ skip, limit });
-        const { arr, count } = normalizeItems(res);
-        if (arr.length === 0) break;
-        arr.forEach(e => byId.set(e.id, e));
-        skip += arr.length;
-        if ((count ?? arr.length) < limit) break;
-      }
-      const merged = Array.from(byId.values())
-        .sort((a, b) => new Date(b.created_at).getTime() - new Date(a.created_at).getTime());
-      setAll(merged);
-      primeEntries(merged);
+      setAll(await syncEntries());
     } catch {}
   }, []);
 
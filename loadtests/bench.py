@@ -0,0 +1,326 @@
+# loadtests/bench.py
+"""
+Load test offline e in-process: lo stesso scenario di Azure Load Testing
+(requests.json: login → post-entry → get-entries) contro l'app ASGI, senza cloud.
+
+- utenti da users.csv seminati in SQLite (o in un DB indicato con --db-url);
+- coda di sentiment, App Configuration e OpenAI sostituiti da fake locali;
+- N utenti virtuali concorrenti, per iterazioni o per durata;
+- report p50/p95/p99, media e throughput per requestName;
+- exit code 1 se è violato uno dei failureCriteria di config.yaml.
+
+    python loadtests/bench.py --vus 20 --iterations 10
+    python loadtests/bench.py --vus 50 --duration 60 --db-url postgresql://...
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Load test offline dello scenario di loadtests/requests.json")
+    ap.add_argument("--vus", type=int, default=10, help="utenti virtuali concorrenti")
+    ap.add_argument("--iterations", type=int, default=5, help="scenari per utente virtuale (ignorato con --duration)")
+    ap.add_argument("--duration", type=float, help="durata in secondi (al posto di --iterations)")
+    ap.add_argument("--db-url", help="SQL_URL del DB di prova (default: SQLite temporaneo)")
+    ap.add_argument("--config", default=str(HERE / "config.yaml"))
+    ap.add_argument("--plan", default=str(HERE / "requests.json"))
+    ap.add_argument("--users", default=str(HERE / "users.csv"))
+    ap.add_argument("--json", dest="json_out", help="salva anche il report in JSON")
+    return ap.parse_args(argv)
+
+
+# ---------------------------------------------------------------- ambiente
+
+def setup_env(db_url: str | None, workdir: str) -> str:
+    """Env dei fake locali; va fatto PRIMA di importare app.*"""
+    db_url = db_url or f"sqlite:///{workdir}/bench.sqlite"
+    flags = Path(workdir) / "flags.json"
+    flags.write_text(json.dumps({"features:chatbot_enabled": "true"}))
+    env = {
+        "SQL_URL": db_url,
+        "APP_CONFIG_FILE": str(flags),           # App Configuration → file locale
+        "SENTIMENT_QUEUE_BACKEND": "memory",     # Azure Storage Queue → memoria
+        "SECRET_KEY": "bench-secret",
+        "AZURE_OPENAI_API_KEY": "bench",
+        "AZURE_OPENAI_ENDPOINT": "http://openai.invalid",
+        "ASSISTANT_ID": "asst_bench",
+        "JOB_KEY": "bench",
+        "REFRESH_PURGE": "0",
+    }
+    for k, v in env.items():
+        os.environ.setdefault(k, v)
+    sys.path.insert(0, str(ROOT))
+    return os.environ["SQL_URL"]
+
+
+class FakeAssistant:
+    """Stand-in di AsyncAzureOpenAI per le poche chiamate usate dal chatbot."""
+
+    def __init__(self):
+        from types import SimpleNamespace as NS
+
+        async def _thread_create():
+            return NS(id="thread_bench")
+
+        async def _noop(**_kw):
+            return None
+
+        async def _run_create(**_kw):
+            return NS(id="run_bench", status="completed")
+
+        async def _list(**_kw):
+            return NS(data=[NS(role="assistant", content=[NS(type="text", text=NS(value="ok"))])])
+
+        runs = NS(create=_run_create, retrieve=_run_create, cancel=_noop)
+        messages = NS(create=_noop, list=_list)
+        self.beta = NS(threads=NS(create=_thread_create, messages=messages, runs=runs))
+
+
+def prepare_db(users: list[tuple[str, str]]):
+    from sqlalchemy import event, select
+    import app.db.models as m
+    from app.core.users import hash_password
+
+    if m.engine.dialect.name == "sqlite":
+        # su SQL Server è una funzione di sistema
+        def _sysutcdatetime(dbapi, _rec):
+            import datetime
+            dbapi.create_function("sysutcdatetime", 0,
+                                  lambda: datetime.datetime.utcnow().isoformat(sep=" "))
+        event.listen(m.engine, "connect", _sysutcdatetime)
+        if m.async_engine is not None:
+            event.listen(m.async_engine.sync_engine, "connect", _sysutcdatetime)
+
+    m.Base.metadata.create_all(m.engine)
+    hashes: dict[str, str] = {}   # bcrypt una volta per password distinta
+    with m.SessionLocal() as db:
+        existing = set(db.scalars(select(m.User.username)).all())
+        for username, password in users:
+            if username in existing:
+                continue
+            if password not in hashes:
+                hashes[password] = hash_password(password)
+            db.add(m.User(username=username, password_hash=hashes[password]))
+        db.commit()
+
+
+def read_users(path: str) -> list[tuple[str, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(r[0].strip(), r[1].strip()) for r in csv.reader(f) if r and r[0].strip()]
+
+
+# ---------------------------------------------------------------- scenario
+
+_VAR = re.compile(r"\$\{(\w+)\}")
+
+
+def _subst(s: str, variables: dict) -> str:
+    return _VAR.sub(lambda mt: str(variables.get(mt.group(1), mt.group(0))), s)
+
+
+def _extract(doc, expression: str):
+    # JSONExtractor: solo percorsi semplici $.a.b
+    cur = doc
+    for part in expression.lstrip("$").strip(".").split("."):
+        if not part:
+            continue
+        cur = cur.get(part) if isinstance(cur, dict) else None
+    return cur
+
+
+def load_plan(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    scenario = next(iter(plan["scenarios"].values()))
+    return scenario["requests"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.ended = self.started
+
+    def add(self, name: str, ms: float, ok: bool):
+        self.latencies[name].append(ms)
+        if not ok:
+            self.errors[name] += 1
+
+
+async def virtual_user(client, steps, next_user, rec: Recorder, iterations: int, deadline: float | None):
+    i = 0
+    while (deadline is None and i < iterations) or (deadline is not None and time.perf_counter() < deadline):
+        username, password = next_user()   # righe di users.csv in ordine, recycleOnEOF
+        variables = {"API_BASE": "", "USER": username, "PASS": password}
+        for step in steps:
+            url = _subst(step["endpoint"], variables)
+            headers = {k: _subst(v, variables) for k, v in step.get("headers", {}).items()}
+            body = _subst(step["body"], variables) if step.get("body") else None
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(step["method"], url, headers=headers, content=body)
+                ok = r.status_code < 400
+            except Exception:
+                r, ok = None, False
+            rec.add(step["requestName"], (time.perf_counter() - t0) * 1000, ok)
+            if ok and step.get("responseVariables"):
+                doc = r.json()
+                for rv in step["responseVariables"]:
+                    variables[rv["variableName"]] = _extract(doc, rv["expression"])
+            if not ok:
+                break   # come il load test: senza token il resto dello scenario non ha senso
+        i += 1
+
+
+# ---------------------------------------------------------------- report e criteri
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def samples_by_name(rec: Recorder) -> dict[str, list[float]]:
+    out = {name: sorted(lat) for name, lat in rec.latencies.items()}
+    out["TOTAL"] = sorted(itertools.chain.from_iterable(rec.latencies.values()))
+    return out
+
+
+def summarize(rec: Recorder, samples: dict[str, list[float]]) -> dict:
+    elapsed = max(rec.ended - rec.started, 1e-9)
+    out = {}
+    for name, s in samples.items():
+        errors = sum(rec.errors.values()) if name == "TOTAL" else rec.errors.get(name, 0)
+        out[name] = {
+            "count": len(s),
+            "errors": errors,
+            "avg": sum(s) / len(s) if s else 0.0,
+            "p50": percentile(s, 50),
+            "p95": percentile(s, 95),
+            "p99": percentile(s, 99),
+            "rps": len(s) / elapsed,
+        }
+    return out
+
+
+def read_failure_criteria(path: str) -> list[str]:
+    """Righe di failureCriteria da config.yaml (parser minimo, niente PyYAML)."""
+    criteria, inside = [], False
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if not line.startswith((" ", "-")):
+            inside = line.split(":")[0].strip() == "failureCriteria"
+            continue
+        if inside and line.lstrip().startswith("- "):
+            criteria.append(line.lstrip()[2:].strip().strip('"').strip("'"))
+    return criteria
+
+
+_CRIT = re.compile(r"^(?:(?P<req>[\w-]+):\s*)?(?P<agg>\w+)\((?P<metric>\w+)\)\s*(?P<op>[<>]=?)\s*(?P<val>[\d.]+)$")
+
+
+def evaluate(criteria: list[str], summary: dict, samples: dict[str, list[float]]) -> list[str]:
+    """Criteri violati (sintassi di failureCriteria di Azure Load Testing)."""
+    failed = []
+    for c in criteria:
+        m = _CRIT.match(c)
+        if not m:
+            print(f"  ? criterio non riconosciuto, ignorato: {c}")
+            continue
+        name = m["req"] or "TOTAL"
+        row, s = summary.get(name), samples.get(name)
+        if row is None:
+            print(f"  ? nessuna richiesta '{name}' nello scenario: {c}")
+            continue
+        agg = m["agg"]
+        if agg == "percentage" and m["metric"] == "error":
+            value = 100 * row["errors"] / max(row["count"], 1)
+        elif agg == "avg":
+            value = row["avg"]
+        elif agg in ("min", "max"):
+            value = (s[0] if agg == "min" else s[-1]) if s else 0.0
+        elif re.fullmatch(r"p\d+(\.\d+)?", agg):
+            value = percentile(s, float(agg[1:]))
+        else:
+            print(f"  ? aggregazione non supportata, ignorato: {c}")
+            continue
+        limit = float(m["val"])
+        violated = {">": value > limit, ">=": value >= limit, "<": value < limit, "<=": value <= limit}[m["op"]]
+        print(f"  {'FAIL' if violated else 'ok  '} {c}  (misurato {value:.1f})")
+        if violated:
+            failed.append(c)
+    return failed
+
+
+def print_report(summary: dict):
+    print(f"\n{'request':<14}{'count':>7}{'err':>6}{'avg':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}")
+    for name, r in summary.items():
+        print(f"{name:<14}{r['count']:>7}{r['errors']:>6}{r['avg']:>9.1f}{r['p50']:>9.1f}"
+              f"{r['p95']:>9.1f}{r['p99']:>9.1f}{r['rps']:>9.1f}")
+
+
+# ---------------------------------------------------------------- main
+
+async def run(args) -> int:
+    import httpx
+    from app.main import app
+    from app.api.services import assistant
+
+    assistant.aclient = FakeAssistant()
+
+    steps = load_plan(args.plan)
+    users = read_users(args.users)
+    prepare_db(users)
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            rec = Recorder()
+            deadline = time.perf_counter() + args.duration if args.duration else None
+            rows = itertools.cycle(users)
+            await asyncio.gather(*[
+                virtual_user(client, steps, lambda: next(rows), rec, args.iterations, deadline)
+                for _ in range(args.vus)
+            ])
+            rec.ended = time.perf_counter()
+    finally:
+        await app.router.shutdown()
+
+    samples = samples_by_name(rec)
+    summary = summarize(rec, samples)
+    print_report(summary)
+    print(f"\n{args.vus} VU, {rec.ended - rec.started:.1f}s\nfailureCriteria ({args.config}):")
+    failed = evaluate(read_failure_criteria(args.config), summary, samples)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps({"summary": summary, "failed": failed}, indent=2))
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="moodtrack-bench-") as workdir:
+        setup_env(args.db_url, workdir)
+        return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# loadtests/bench_middleware.py
+"""
+Micro-benchmark dell'overhead per richiesta di TelemetryEnricher.
+
+Chiama direttamente l'app ASGI (niente rete né client HTTP) su una route
+minima e confronta:
+- none:      nessun middleware
+- basehttp:  la vecchia versione su BaseHTTPMiddleware (copiata qui come riferimento)
+- asgi:      app.obs.enrich.TelemetryEnricher (ASGI puro)
+
+    python loadtests/bench_middleware.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from opentelemetry import trace
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.obs.enrich import TelemetryEnricher
+
+
+class BaseHTTPEnricher(BaseHTTPMiddleware):
+    # versione precedente, solo per confronto
+    async def dispatch(self, request, call_next):
+        uid = getattr(request.state, "user_id", None)
+        span = trace.get_current_span()
+        if span is not None:
+            if uid:
+                span.set_attribute("user.id", str(uid))
+            span.set_attribute("env", os.getenv("APP_ENV", "dev"))
+        return await call_next(request)
+
+
+def build(variant: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping(request: Request):
+        request.state.user_id = "bench"
+        return PlainTextResponse("ok")
+
+    @app.get("/stream")
+    async def stream():
+        async def gen():
+            for _ in range(10):
+                yield "data: x\n\n"
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    if variant == "basehttp":
+        app.add_middleware(BaseHTTPEnricher)
+    elif variant == "asgi":
+        app.add_middleware(TelemetryEnricher)
+    return app
+
+
+def _scope(path: str) -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+
+_never = asyncio.Event()   # mai settato: il client non si disconnette
+
+
+async def _one(app, path: str):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await _never.wait()
+        sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(_message):
+        pass
+
+    await app(_scope(path), receive, send)
+
+
+async def measure(app, path: str, n: int, rounds: int) -> list[float]:
+    for _ in range(min(n, 500)):          # warm-up
+        await _one(app, path)
+    per_round = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await _one(app, path)
+        per_round.append((time.perf_counter() - t0) / n * 1e6)   # µs per richiesta
+    return per_round
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Overhead per richiesta di TelemetryEnricher")
+    ap.add_argument("--requests", type=int, default=5000, help="richieste per round")
+    ap.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    for path in ("/ping", "/stream"):
+        print(f"\n{path}  ({args.rounds} round x {args.requests} richieste, mediana)")
+        base = None
+        for variant in ("none", "basehttp", "asgi"):
+            us = statistics.median(await measure(build(variant), path, args.requests, args.rounds))
+            base = us if base is None else base
+            print(f"  {variant:<9} {us:8.1f} µs/req   overhead {us - base:+7.1f} µs")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
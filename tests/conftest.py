@@ -0,0 +1,50 @@
+# tests/conftest.py
+"""
+Test dei servizi su SQLite in memoria con i fake locali (come loadtests/bench.py).
+L'env va impostato PRIMA di importare app.*: models.py crea gli engine all'import.
+"""
+import datetime
+import os
+
+import pytest
+
+for _k, _v in {
+    "SQL_URL": "sqlite://",
+    "DB_ASYNC": "0",                        # i servizi si testano con la Session sync
+    "SENTIMENT_QUEUE_BACKEND": "memory",
+    "SECRET_KEY": "test-secret",
+    "AZURE_OPENAI_API_KEY": "test",
+    "AZURE_OPENAI_ENDPOINT": "http://openai.invalid",
+    "JOB_KEY": "test",
+}.items():
+    os.environ.setdefault(_k, _v)
+
+from sqlalchemy import create_engine, event          # noqa: E402
+from sqlalchemy.orm import Session                   # noqa: E402
+from sqlalchemy.pool import StaticPool               # noqa: E402
+
+from app.db.models import Base, User, UserSettings   # noqa: E402
+
+
+def _sysutcdatetime(dbapi, _rec):
+    # su SQL Server è una funzione di sistema
+    dbapi.create_function("sysutcdatetime", 0, lambda: datetime.datetime.utcnow().isoformat(sep=" "))
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    event.listen(engine, "connect", _sysutcdatetime)
+    Base.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def user(db):
+    """Utente 'mario' con fuso Europe/Rome (ha i cambi d'ora)."""
+    db.add(User(username="mario", password_hash="x"))
+    db.add(UserSettings(user_id="mario", tz_iana="Europe/Rome"))
+    db.commit()
+    return "mario"
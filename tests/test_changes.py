@@ -0,0 +1,95 @@
+# tests/test_changes.py
+"""
+Delta sync: il feed unisce entries vive e tombstone in ordine (change_seq, id)
+e, pagina dopo pagina, consegna ogni modifica una volta sola.
+"""
+import time
+
+import pytest
+from sqlalchemy import delete, insert, update
+
+from app.api.services.changes import CHANGES_TOMBSTONE_RETENTION_D, changes_since, cursor_expired
+from app.db.models import Entry, EntryTombstone, User
+
+
+def _seed(db, username, upserts: list[tuple[int, int]], deletes: list[tuple[int, int]]):
+    """upserts/deletes = [(change_seq, id)]; data_version = seq più alto."""
+    if upserts:
+        db.execute(insert(Entry), [
+            {"id": i, "user_id": username, "title": "t", "content": "c", "change_seq": seq} for seq, i in upserts
+        ])
+    if deletes:
+        db.execute(delete(Entry).where(Entry.id.in_([i for _, i in deletes])))
+        db.execute(insert(EntryTombstone), [
+            {"entry_id": i, "user_id": username, "change_seq": seq} for seq, i in deletes
+        ])
+    version = max(seq for seq, _ in upserts + deletes)
+    db.execute(update(User).where(User.username == username).values(data_version=version))
+    db.commit()
+    return version
+
+
+def _drain(db, username, after, limit, version):
+    seen, pages = [], 0
+    while True:
+        page = changes_since(db, username, after, limit, version)
+        seen += [(c["op"], c["id"]) for c in page["changes"]]
+        after = page["next"]
+        pages += 1
+        assert pages < 50
+        if not page["has_more"]:
+            return seen, after
+
+
+UPSERTS = [(1, 1), (2, 2), (2, 3), (3, 4)]
+DELETES = [(2, 5), (4, 6)]
+FEED = [("upsert", 1), ("upsert", 2), ("upsert", 3), ("delete", 5), ("upsert", 4), ("delete", 6)]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_paging_over_upserts_and_tombstones(db, user, limit):
+    version = _seed(db, user, UPSERTS, DELETES)
+    seen, cursor = _drain(db, user, (0, 0), limit, version)
+    assert seen == FEED                 # change_seq condivisi (2) spezzati tra pagine senza doppioni
+    assert cursor == (version + 1, 0)   # "completo fino a version"
+
+
+def test_initial_sync(db, user):
+    version = _seed(db, user, UPSERTS, DELETES)
+    first = changes_since(db, user, None, 10, version)
+    assert [(c["op"], c["id"]) for c in first["changes"]] == [("upsert", i) for i in (1, 2, 3, 4)]
+
+    # a pagine: le pagine dopo la prima possono riportare delete di entries mai inviate
+    seen, cursor = _drain(db, user, None, 2, version)
+    assert [c for c in seen if c[0] == "upsert"] == [("upsert", i) for i in (1, 2, 3, 4)]
+    assert {i for op, i in seen if op == "delete"} <= {5, 6}
+    assert cursor == (version + 1, 0)
+
+
+def test_resume_after_new_writes(db, user):
+    version = _seed(db, user, UPSERTS, DELETES)
+    _, cursor = _drain(db, user, None, 10, version)
+    idle = changes_since(db, user, cursor, 10, version)
+    assert idle["changes"] == [] and not idle["has_more"] and idle["next"] == cursor
+
+    # stesso change_seq per insert e delete (un lotto), id sotto e sopra i precedenti
+    version = _seed(db, user, [(5, 7)], [(5, 1), (6, 2)])
+    seen, cursor = _drain(db, user, cursor, 1, version)
+    assert seen == [("delete", 1), ("upsert", 7), ("delete", 2)]
+    assert cursor == (7, 0)
+
+
+def test_cursor_expiry():
+    assert not cursor_expired(int(time.time()))
+    assert cursor_expired(int(time.time()) - (CHANGES_TOMBSTONE_RETENTION_D + 1) * 86400)
+
+
+def test_writes_after_version_wait_for_next_sync(db, user):
+    version = _seed(db, user, UPSERTS, DELETES)
+    # scrittura committata dopo la lettura di version: change_seq version + 1
+    later = _seed(db, user, [(version + 1, 8)], [(version + 1, 3)])
+    page = changes_since(db, user, (0, 0), 100, version)
+    assert [(c["op"], c["id"]) for c in page["changes"]] == [c for c in FEED if c != ("upsert", 3)]
+    assert page["next"] == (version + 1, 0)
+    seen, _ = _drain(db, user, page["next"], 1, later)
+    assert seen == [("delete", 3), ("upsert", 8)]
@@ -0,0 +1,69 @@
+# tests/test_outbox.py
+"""
+Dispatcher dell'outbox: invio attraverso il producer (lotti, retry, contatori)
+e DELETE delle righe solo a consegna avvenuta.
+"""
+import base64
+import json
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.api.services import queueing
+from app.api.services.outbox import OutboxDispatcher
+from app.api.services.queueing import MemoryQueueBackend, QueueProducer, QueueSendError
+from app.db.models import Entry, SentimentOutbox
+
+
+class FlakyBackend(MemoryQueueBackend):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def send_batch(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("storage down")
+        super().send_batch(messages)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(queueing, "BACKOFF_BASE_S", 0)
+
+
+def _pending(db, user, n):
+    ids = db.scalars(insert(Entry).returning(Entry.id), [
+        {"user_id": user, "title": "t", "content": "c"} for _ in range(n)
+    ]).all()
+    db.execute(insert(SentimentOutbox), [{"entry_id": i} for i in ids])
+    db.commit()
+    return ids
+
+
+def _dispatcher(db, backend):
+    producer = QueueProducer(backend, batch_size=2, max_attempts=3)
+    return producer, OutboxDispatcher(producer, batch_size=5, session_factory=lambda: Session(db.get_bind()))
+
+
+def test_drain_batches_and_retries_through_producer(db, user):
+    ids = _pending(db, user, 7)
+    backend = FlakyBackend(failures=2)
+    producer, d = _dispatcher(db, backend)
+    assert d.drain() == 7
+    assert [json.loads(base64.b64decode(m))["entry_id"] for m in backend.messages] == ids
+    assert producer.stats()["retries"] == 2
+    assert producer.stats()["batches"] == 4            # lotti di outbox da 5 e 2, lotti di invio da 2
+    assert db.scalars(select(SentimentOutbox.id)).all() == []
+    assert d.stats()["dispatched"] == 7
+
+
+def test_failed_send_keeps_rows(db, user):
+    _pending(db, user, 3)
+    producer, d = _dispatcher(db, FlakyBackend(failures=10))
+    with pytest.raises(QueueSendError):
+        d.drain_once()
+    rows = db.scalars(select(SentimentOutbox)).all()
+    assert len(rows) == 3 and all(r.attempts == 1 and r.last_error for r in rows)
+    assert producer.stats()["failed"] == 2             # il primo lotto; il secondo non si tenta
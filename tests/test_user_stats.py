@@ -0,0 +1,212 @@
+# tests/test_user_stats.py
+"""
+Invariante di user_stats: dopo ogni scrittura la riga aggiornata in modo
+incrementale è uguale a un ricalcolo da zero (_compute).
+"""
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import delete, func, insert, select, update
+
+from app.api.services import user_stats as us
+from app.api.services.versioning import bump_version, bump_versions_for_entries
+from app.db.models import Entry, EntryTombstone, UserStats
+
+ROME = ZoneInfo("Europe/Rome")
+
+
+def _add(db, username, at: datetime, mood=None) -> int:
+    """Come create_entry: INSERT + record_entries nella stessa transazione."""
+    entry_id = db.execute(
+        insert(Entry).values(user_id=username, title="t", content="c", mood=mood, created_at=at).returning(Entry.id)
+    ).scalar_one()
+    us.record_entries(db, username, [(at, mood)])
+    db.commit()
+    return entry_id
+
+
+def _set_mood(db, entry_id: int, mood):
+    """Come patch_sentiment: lock sul proprietario, poi mood precedente, poi UPDATE."""
+    bump_versions_for_entries(db, [entry_id])
+    before = db.execute(select(Entry.user_id, Entry.created_at, Entry.mood).where(Entry.id == entry_id)).one()
+    db.execute(update(Entry).where(Entry.id == entry_id).values(mood=mood))
+    us.record_mood_changes(db, [(before.user_id, before.created_at, before.mood, mood)])
+    db.commit()
+
+
+def _delete(db, username, entry_id: int):
+    """Come _delete_entry: lock sull'utente, poi created_at/mood, poi DELETE."""
+    bump_version(db, username)
+    gone = db.execute(select(Entry.user_id, Entry.created_at, Entry.mood).where(Entry.id == entry_id)).one()
+    db.execute(delete(Entry).where(Entry.id == entry_id))
+    us.record_deletion(db, gone.user_id, gone.created_at, gone.mood)
+    db.commit()
+
+
+def _assert_consistent(db, username):
+    st = db.get(UserStats, username)
+    fresh = us._compute(db, username, ZoneInfo(st.tz))
+    for field in us._COMPARED:
+        assert getattr(st, field) == getattr(fresh, field), field
+
+
+def _utc(local: datetime) -> datetime:
+    """Ora locale di Roma → UTC naive, come Entry.created_at."""
+    return local.replace(tzinfo=ROME).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def test_day_gaps_and_ring_reset(db, user):
+    start = datetime(2025, 1, 1, 9)
+    # stesso giorno, giorni consecutivi, buco breve, buco oltre la finestra di 30 giorni
+    for days, mood in [(0, 3), (0, None), (1, 4), (2, 5), (5, 1), (6, 2), (50, 0), (51, 5)]:
+        _add(db, user, _utc(start + timedelta(days=days)), mood)
+        _assert_consistent(db, user)
+    st = db.get(UserStats, user)
+    assert (st.current_streak, st.longest_streak) == (2, 3)
+    assert st.entries_count == 8 and st.mood_count == 7
+    assert st.daily_moods[-1] == [1, 5] and st.daily_moods[-2] == [1, 0]
+    assert sum(n for n, _ in st.daily_moods) == 2   # il resto è uscito dalla finestra
+
+
+def test_backdated_insert_rebuilds(db, user):
+    for days in (10, 11, 12):
+        _add(db, user, _utc(datetime(2025, 2, 1, 12) + timedelta(days=days)), 3)
+    # prima dell'ultima data locale: niente O(1), ricalcolo
+    _add(db, user, _utc(datetime(2025, 2, 10, 12)), 1)
+    _add(db, user, _utc(datetime(2025, 2, 1, 12)), None)
+    _assert_consistent(db, user)
+    st = db.get(UserStats, user)
+    assert st.first_entry_date == date(2025, 2, 1)
+    assert st.longest_streak == 4 and st.current_streak == 4
+
+
+def test_mood_changes(db, user):
+    base = datetime(2025, 3, 1, 20)
+    old = _add(db, user, _utc(base), 2)                      # poi fuori dalla finestra
+    ids = [_add(db, user, _utc(base + timedelta(days=40 + d))) for d in range(3)]
+    _set_mood(db, ids[0], 4)          # None → valore
+    _set_mood(db, ids[0], 1)          # valore → valore
+    _set_mood(db, ids[1], 5)
+    _set_mood(db, ids[1], 5)          # nessun cambio
+    _set_mood(db, old, 0)             # fuori dalla finestra: solo istogramma e somme
+    _assert_consistent(db, user)
+    st = db.get(UserStats, user)
+    assert st.mood_hist == [1, 1, 0, 0, 0, 1]
+    assert (st.mood_count, st.mood_sum) == (3, 6)
+
+
+def test_deletes(db, user):
+    base = datetime(2025, 4, 1, 10)
+    ids = {}
+    for days, hour, mood in [(0, 0, 1), (1, 0, 2), (1, 5, 3), (2, 0, 4), (3, 0, 5), (3, 2, None)]:
+        ids[(days, hour)] = _add(db, user, _utc(base + timedelta(days=days, hours=hour)), mood)
+    _delete(db, user, ids[(1, 5)])       # il giorno resta con un'altra entry: O(1)
+    _assert_consistent(db, user)
+    _delete(db, user, ids[(1, 0)])       # giorno svuotato in mezzo alla streak
+    _assert_consistent(db, user)
+    assert db.get(UserStats, user).longest_streak == 2
+    _delete(db, user, ids[(3, 2)])
+    _delete(db, user, ids[(3, 0)])       # ultima data
+    _delete(db, user, ids[(0, 0)])       # prima data
+    _assert_consistent(db, user)
+    st = db.get(UserStats, user)
+    assert st.first_entry_date == st.last_entry_date == date(2025, 4, 3)
+
+
+@pytest.mark.parametrize("local_times", [
+    # primavera: alle 02:00 si salta alle 03:00 (UTC+1 → UTC+2)
+    [datetime(2025, 3, 29, 23, 30), datetime(2025, 3, 30, 0, 30), datetime(2025, 3, 30, 3, 30),
+     datetime(2025, 3, 30, 23, 45), datetime(2025, 3, 31, 0, 15)],
+    # autunno: le 02:00-03:00 si ripetono (UTC+2 → UTC+1)
+    [datetime(2025, 10, 25, 23, 30), datetime(2025, 10, 26, 0, 30), datetime(2025, 10, 26, 2, 30),
+     datetime(2025, 10, 26, 23, 45), datetime(2025, 10, 27, 0, 15)],
+])
+def test_local_days_across_dst(db, user, local_times):
+    for i, t in enumerate(local_times):
+        _add(db, user, _utc(t), i % 6)
+    _assert_consistent(db, user)
+    st = db.get(UserStats, user)
+    days = sorted({t.date() for t in local_times})
+    assert (st.first_entry_date, st.last_entry_date) == (days[0], days[-1])
+    assert sum(st.weekday_counts) == len(local_times)
+    assert st.current_streak == len(days)
+
+
+def test_tz_change_rebuilds_local_days(db, user):
+    _add(db, user, datetime(2025, 5, 1, 23, 30), 3)          # 2 maggio a Roma, 1 maggio a New York
+    assert db.get(UserStats, user).last_entry_date == date(2025, 5, 2)
+    us.tz_changed(db, user, "America/New_York")
+    db.commit()
+    st = db.get(UserStats, user)
+    assert (st.tz, st.last_entry_date) == ("America/New_York", date(2025, 5, 1))
+    _assert_consistent(db, user)
+
+
+def test_ring_shift():
+    st = us._empty("x", "UTC")
+    st.last_entry_date = date(2025, 1, 1)
+    st.daily_moods = [[i, i] for i in range(us.RING_DAYS)]
+    us._ring_shift(st, date(2025, 1, 3))
+    assert st.daily_moods[:2] == [[2, 2], [3, 3]]
+    assert st.daily_moods[-2:] == [[0, 0], [0, 0]]
+    assert len(st.daily_moods) == us.RING_DAYS
+    us._ring_shift(st, date(2025, 6, 1))
+    assert st.daily_moods == [[0, 0]] * us.RING_DAYS
+
+
+def test_view_windows_and_streak_relative_to_today(db, user):
+    now = datetime(2025, 6, 30, 10, tzinfo=timezone.utc)
+    for days, mood in [(20, 1), (6, 3), (1, 5)]:
+        _add(db, user, (now - timedelta(days=days)).replace(tzinfo=None), mood)
+    view = us.stats_view(db.get(UserStats, user), now)
+    assert view["mood_avg_7d"] == 4.0
+    assert view["mood_avg_30d"] == 3.0
+    assert view["current_streak"] == 1                      # ultima entry ieri: ancora in corso
+    later = us.stats_view(db.get(UserStats, user), now + timedelta(days=2))
+    assert later["current_streak"] == 0
+    assert later["mood_avg_7d"] == 5.0
+
+
+def test_get_stats_builds_missing_row(db, user):
+    db.execute(insert(Entry).values(user_id=user, title="t", content="c", mood=2,
+                                    created_at=datetime(2025, 1, 1, 12)))
+    db.commit()
+    assert db.get(UserStats, user) is None
+    view = us.get_stats(db, user)
+    assert (view["entries"], view["mood_avg"]) == (1, 2.0)
+    assert db.get(UserStats, user) is not None
+
+
+def test_repeated_delivery_and_delete(db, user):
+    """Le route vere: rilettura sotto lock, la ripetizione non conta due volte."""
+    from app.api.routes.entries import _delete_entry
+    from app.api.routes.internal import patch_sentiment
+
+    keep = _add(db, user, _utc(datetime(2025, 7, 1, 9)), 2)
+    twice = _add(db, user, _utc(datetime(2025, 7, 1, 18)))
+    for _ in range(2):
+        patch_sentiment(twice, {"sentiment_score": 4}, db)
+    _assert_consistent(db, user)
+    assert db.get(UserStats, user).mood_count == 2
+
+    assert _delete_entry(db, user, keep)
+    assert not _delete_entry(db, user, keep)
+    _assert_consistent(db, user)
+    assert db.get(UserStats, user).entries_count == 1
+    assert db.scalar(select(func.count()).select_from(EntryTombstone)) == 1
+
+
+def test_decimal_scores_truncate_like_stats(db, user):
+    from app.api.routes.internal import batch_patch_sentiment, patch_sentiment
+    from app.schemas.internal import BatchSentimentIn
+
+    a = _add(db, user, _utc(datetime(2025, 8, 1, 9)))
+    b = _add(db, user, _utc(datetime(2025, 8, 1, 10)))
+    patch_sentiment(a, {"sentiment_score": 3.7}, db)
+    out = batch_patch_sentiment(BatchSentimentIn(items=[{"entry_id": b, "sentiment_score": 4.9},
+                                                         {"entry_id": a, "sentiment_score": 5.5}]), db)
+    assert [r["ok"] for r in out["results"]] == [True, False]
+    assert db.scalars(select(Entry.mood).order_by(Entry.id)).all() == [3, 4]
+    _assert_consistent(db, user)
+    assert db.get(UserStats, user).mood_hist == [0, 0, 0, 1, 1, 0]